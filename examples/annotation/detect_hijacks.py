@@ -4,10 +4,17 @@
 
 from __future__ import print_function
 
-import json
+import signal
 import logging
+import functools
 
 from tabi.emulator import detect_hijacks
+from tabi.records import to_json
+from tabi.backends import BACKENDS
+from tabi.backends.spill import SpillTree
+from tabi.annotate import AnnotationContext
+from tabi.conflicts import ConflictTracker, FlapDamping, \
+    PeerStormDetector
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +53,48 @@ if __name__ == "__main__":
                         help="CSV file containing IRR organisation objects")
     parser.add_argument("--rpki-roa-file",
                         help="CSV file containing ROA")
+    parser.add_argument("--irr-rpsl-file", action="append",
+                        help="RPSL dump of an IRR database, possibly "
+                             "gzipped, providing route objects and "
+                             "relations; can be repeated")
+    parser.add_argument("--rtr-cache",
+                        help="HOST:PORT of an RTR cache providing the ROA, "
+                             "instead of --rpki-roa-file")
+    parser.add_argument("--index",
+                        help="directory of the compiled metadata, see "
+                             "tabi-index")
+    parser.add_argument("--reload-interval", type=int,
+                        help="seconds between two checks of the metadata "
+                             "files, SIGHUP also reloads them")
+    parser.add_argument("--suppress-duplicates", action="store_true",
+                        help="only report the new conflicts of announces "
+                             "identical to the stored route")
+    parser.add_argument("--track-conflicts", action="store_true",
+                        help="report conflicts start, summaries and end")
+    parser.add_argument("--summary-interval", type=int, default=3600,
+                        help="seconds between two summaries of a conflict")
+    parser.add_argument("--storm-threshold", type=int,
+                        help="conflicting updates per window above which "
+                             "a peer is in storm")
+    parser.add_argument("--storm-window", type=int, default=60,
+                        help="seconds during which conflicting updates are "
+                             "counted per peer")
+    parser.add_argument("--flap-damping", action="store_true",
+                        help="suppress the conflicts of flapping prefixes")
+    parser.add_argument("--full-annotation", action="store_true",
+                        help="compute every annotation, not only the ones "
+                             "deciding the type")
+    parser.add_argument("-p", "--annotation-processes", type=int,
+                        help="number of processes annotating the conflicts "
+                             "while the RIB is updated")
+    parser.add_argument("--rib-backend", default="radix",
+                        choices=["radix"] + sorted(BACKENDS),
+                        help="prefix tree used by the RIB, nparray is "
+                             "experimental and slower than py-radix")
+    parser.add_argument("--rib-max-nodes", type=int,
+                        help="with the spill backend, number of prefixes "
+                             "kept in memory, the others being stored on "
+                             "disk")
     parser.add_argument("-v", "--verbose", action="store_true",
                         help="more logging")
 
@@ -76,7 +125,39 @@ if __name__ == "__main__":
     if args.irr_mnt_file is not None:
         kwargs["irr_mnt_file"] = args.irr_mnt_file
 
+    if args.irr_rpsl_file is not None:
+        kwargs["irr_rpsl_files"] = args.irr_rpsl_file
+
+    if args.rtr_cache is not None:
+        host, port = args.rtr_cache.rsplit(":", 1)
+        kwargs["rtr_cache"] = (host, int(port))
+
+    if args.index is not None:
+        kwargs["index"] = args.index
+
+    kwargs["suppress_duplicates"] = args.suppress_duplicates
+    kwargs["annotation_processes"] = args.annotation_processes
+    kwargs["rib_backend"] = args.rib_backend
+    if args.rib_backend == "spill" and args.rib_max_nodes is not None:
+        kwargs["rib_backend"] = functools.partial(SpillTree,
+                                                  max_nodes=args.rib_max_nodes)
+
+    context = AnnotationContext(full_annotation=args.full_annotation)
+    signal.signal(signal.SIGHUP, lambda signum, frame: context.request_reload())
+    kwargs["context"] = context
+    kwargs["reload_interval"] = args.reload_interval
+
+    if args.track_conflicts:
+        kwargs["conflict_tracker"] = ConflictTracker(args.summary_interval)
+
+    if args.storm_threshold is not None:
+        kwargs["storm_detector"] = PeerStormDetector(args.storm_threshold,
+                                                     args.storm_window)
+
+    if args.flap_damping:
+        kwargs["flap_damping"] = FlapDamping()
+
     # detect the conflicts and print them
     for conflict in detect_hijacks(**kwargs):
-        if conflict["type"] == "ABNORMAL":
-            print(json.dumps(conflict))
+        if conflict["type"] in ("ABNORMAL", "STORM", "DAMPING"):
+            print(to_json(conflict))
@@ -32,12 +32,18 @@ setup(
     license="mit",
     packages=find_packages(exclude=["tests*", "examples*"]),
     entry_points={
-        "console_scripts": ["tabi=tabi.parallel.__main__:main"]
+        "console_scripts": ["tabi=tabi.parallel.__main__:main",
+                            "tabi-index=tabi.index:main [numpy]",
+                            "tabi-reannotate=tabi.reannotate:main"]
     },
     install_requires=[
-        "py-radix",
+        # tabi.backends.hashed is used instead under PyPy
+        'py-radix; platform_python_implementation != "PyPy"',
         "python-dateutil",
     ],
+    extras_require={
+        "numpy": ["numpy"],
+    },
     tests_require=["pytest>=2.7.1"],
     cmdclass={"test": PyTest}
 )
@@ -2,14 +2,40 @@
 # Copyright (C) 2016 ANSSI
 # This file is part of the tabi project licensed under the MIT license.
 
+import os
+import logging
+import threading
+
 from csv import reader
+from functools import partial
 from itertools import chain
-from collections import defaultdict
+from collections import defaultdict, deque, namedtuple
+
+from tabi.rib import Radix, radix_call
+from tabi.helpers import CriticalException, LRUCache, default_opener, \
+    compressed_opener, as_prefix
+from tabi.aspath import canonical_as_path, intern_as_path
 
-from tabi.helpers import default_opener
+logger = logging.getLogger(__name__)
 
 fake_maintainers = ["RIPE-NCC-END-MNT", "AFRINIC-HM-MNT"]
 
+# Default number of annotations kept by an AnnotationContext
+DEFAULT_ANNOTATIONS = 1 << 18
+
+RelationGroups = namedtuple("RelationGroups",
+                            ["organisations", "contacts", "maintainers"])
+
+# RPSL classes read from the IRR dumps, the organisation and mntner objects
+# are skipped: the relations only come from the references of aut-num
+RPSL_CLASSES = ("route", "route6", "aut-num")
+
+# Attributes of aut-num objects -> type of relation in relations_dicts
+RPSL_RELATIONS = {"org": "organisations",
+                  "admin-c": "contacts",
+                  "tech-c": "contacts",
+                  "mnt-by": "maintainers"}
+
 
 def fill_relation_struct(input, relations_dicts, relation_type,
                          opener=default_opener):
@@ -76,6 +102,152 @@ def fill_roa_struct(input, rad_tree, opener=default_opener):
                 new_node.data[asn] = max(new_node.data.get(asn, 0), int(roa[2]))
 
 
+def iter_rpsl_objects(rpsl_file, classes=None):
+    """
+    Yield the objects of an RPSL file one by one, as lists of
+    (attribute, value) whose first attribute is the class of the object.
+    Objects whose class is not in `classes' are skipped without being parsed.
+
+    :param rpsl_file: file object of an RPSL database dump
+    :param classes: RPSL classes to yield, every class if None
+    :return: Generator of lists
+    """
+
+    attributes = []
+    skip = False
+    for line in rpsl_file:
+        line = line.rstrip("\r\n")
+        if not line or line.isspace():
+            # End of the object
+            if attributes:
+                yield attributes
+            attributes = []
+            skip = False
+            continue
+
+        if skip or line[0] in "%#":
+            continue
+
+        if line[0] in " \t+":
+            # Continuation of the previous attribute
+            if attributes:
+                attribute, value = attributes[-1]
+                value = "%s %s" % (value, line[1:].split("#", 1)[0].strip())
+                attributes[-1] = (attribute, value.strip())
+            continue
+
+        attribute, separator, value = line.partition(":")
+        if not separator:
+            continue
+        attribute = attribute.strip().lower()
+        if not attributes and classes is not None and \
+                attribute not in classes:
+            skip = True
+            continue
+        attributes.append((attribute, value.split("#", 1)[0].strip()))
+
+    if attributes:
+        yield attributes
+
+
+def rpsl_asn(value):
+    """Return the ASN of an "AS<number>" RPSL value, or None."""
+
+    if value[:2].upper() != "AS":
+        return None
+    try:
+        return int(value[2:])
+    except ValueError:
+        return None
+
+
+def iter_rpsl_entries(input, source=None, opener=compressed_opener):
+    """
+    Yield the route objects and relations of an RPSL dump, with the columns
+    of the CSV files, as (kind, authority, prefix or name, asn) tuples.
+    kind is "route_objects" or a type of relation of `fill_relation_struct'.
+
+    :param input: RPSL file, decompressed on the fly if it ends with .gz
+    :param source: authority of the objects, by default their source
+        attribute in lower case
+    :param opener: Function to use in order to open the file
+    :return: Generator of tuples
+    """
+
+    with opener(input) as rpsl_file:
+        for attributes in iter_rpsl_objects(rpsl_file, RPSL_CLASSES):
+            rpsl_class, key = attributes[0]
+            values = defaultdict(list)
+            for attribute, value in attributes[1:]:
+                values[attribute].append(value)
+            authority = source
+            if authority is None:
+                authority = "".join(values.get("source", ())[:1]).lower()
+
+            if rpsl_class == "aut-num":
+                asn = rpsl_asn(key)
+                if asn is None:
+                    continue
+                for attribute, relation_type in RPSL_RELATIONS.iteritems():
+                    for value in values.get(attribute, ()):
+                        for name in value.split(","):
+                            name = name.strip()
+                            if name and name not in fake_maintainers:
+                                yield relation_type, authority, name, asn
+
+            else:
+                for origin in values.get("origin", ()):
+                    asn = rpsl_asn(origin)
+                    if asn is not None:
+                        yield "route_objects", authority, key, asn
+
+
+def fill_rpsl_structs(input, rad_tree=None, relations_dicts=None,
+                      source=None, opener=compressed_opener):
+    """
+    Copy the route objects and the relations of an RPSL dump into rad_tree
+    and relations_dicts, in a single pass over the file.
+
+    The relations come from the aut-num objects: their org, admin-c and
+    tech-c, and mnt-by attributes respectively fill the organisations,
+    contacts and maintainers of relations_dicts, as `fill_relation_struct'.
+    Only the aut-num, route and route6 objects are read: the organisation
+    and mntner objects are skipped, so two ASN are only related when their
+    aut-num reference the same name, not e.g. organisations sharing a
+    maintainer.
+
+    :param input: RPSL file, decompressed on the fly if it ends with .gz
+    :param rad_tree: Radix tree filled like `fill_ro_struct', or None
+    :param relations_dicts: dictionary filled like `fill_relation_struct',
+        or None
+    :param source: authority of the objects, by default their source
+        attribute in lower case
+    :param opener: Function to use in order to open the file
+    :return: Nothing
+    """
+
+    if relations_dicts is not None:
+        for relation_type in set(RPSL_RELATIONS.itervalues()):
+            for name in (relation_type, "%s_reverse" % relation_type):
+                if name not in relations_dicts:
+                    relations_dicts[name] = defaultdict(set)
+
+    for kind, authority, name, asn in iter_rpsl_entries(input, source,
+                                                        opener):
+        if kind == "route_objects":
+            if rad_tree is None:
+                continue
+            try:
+                node = rad_tree.add(name)
+            except ValueError:
+                logger.debug("invalid route object prefix %s", name)
+                continue
+            node.data.setdefault(asn, set()).add(authority)
+        elif relations_dicts is not None:
+            relations_dicts["%s_reverse" % kind][asn].add(name)
+            relations_dicts[kind][name].add(asn)
+
+
 def annotate_if_relation(relations_dicts, conflict):
     """
     Add "relation": list(relations) to conflict if ASes in conflict have the
@@ -152,7 +324,104 @@ def annotate_if_relation(relations_dicts, conflict):
     return conflict
 
 
-def annotate_if_roa(roa_rad_tree, conflict):
+class RelationIndex(object):
+    """
+    Relations of every ASN precomputed from the structures filled by
+    `fill_relation_struct', as used by `annotate_if_relation'.
+
+    groups[asn] is a RelationGroups of frozensets of integer ids: the
+    organisations of the ASN, and the contacts and maintainers of the ASN and
+    of its siblings (ASN sharing an organisation). Equal sets are shared.
+    """
+
+    def __init__(self, relations_dicts):
+        orgs = relations_dicts.get("organisations", {})
+        orgs_reverse = relations_dicts.get("organisations_reverse", {})
+        mnts_reverse = relations_dicts.get("maintainers_reverse", {})
+        contacts_reverse = relations_dicts.get("contacts_reverse", {})
+
+        self.ids = dict()
+        self.sets = dict()
+        self.groups = dict()
+
+        # Contacts and maintainers ids of the siblings, per organisations set
+        siblings_groups = dict()
+
+        asns = set(orgs_reverse)
+        asns.update(mnts_reverse)
+        asns.update(contacts_reverse)
+        for asn in asns:
+            as_orgs = orgs_reverse.get(asn, ())
+            org_ids = self.intern("org", as_orgs)
+            siblings = siblings_groups.get(org_ids, None)
+            if siblings is None:
+                members = set(chain.from_iterable([orgs.get(org, list())
+                                                   for org in as_orgs]))
+                contacts = set(chain.from_iterable(
+                    [contacts_reverse.get(member, ()) for member in members]))
+                mnts = set(chain.from_iterable(
+                    [mnts_reverse.get(member, ()) for member in members]))
+                siblings = siblings_groups[org_ids] = (members, contacts,
+                                                       mnts)
+
+            members, contacts, mnts = siblings
+            if asn not in members:
+                contacts = contacts.union(contacts_reverse.get(asn, ()))
+                mnts = mnts.union(mnts_reverse.get(asn, ()))
+            self.groups[asn] = RelationGroups(org_ids,
+                                              self.intern("contact", contacts),
+                                              self.intern("mnt", mnts))
+
+    def intern(self, kind, names):
+        """Return the shared frozenset of the ids of `names'."""
+
+        ids = frozenset([self.ids.setdefault((kind, name), len(self.ids))
+                         for name in names])
+        return self.sets.setdefault(ids, ids)
+
+    def relations(self, as1, as2):
+        """Return the list of relations between `as1' and `as2'."""
+
+        groups1 = self.groups.get(as1, None)
+        groups2 = self.groups.get(as2, None)
+        relations = list()
+        if groups1 is None or groups2 is None:
+            return relations
+        if not groups1.organisations.isdisjoint(groups2.organisations):
+            relations.append("org")
+        if not groups1.contacts.isdisjoint(groups2.contacts):
+            relations.append("contact")
+        if not groups1.maintainers.isdisjoint(groups2.maintainers):
+            relations.append("mnt")
+        return relations
+
+
+def annotate_if_relation_index(relation_index, conflict):
+    """
+    Same as `annotate_if_relation' using a RelationIndex.
+
+    :param relation_index: RelationIndex built from the relations
+    :param conflict: conflict dictionary to annotate
+    :return: `conflict'
+    """
+
+    announce = conflict.get("announce", None)
+    if announce is None:
+        return conflict
+
+    conflict_with = conflict.get("conflict_with", None)
+    if conflict_with is None:
+        return conflict
+
+    relations = relation_index.relations(announce["asn"],
+                                         conflict_with["asn"])
+    if len(relations) > 0:
+        conflict["relation"] = conflict.get("relation", list())
+        conflict["relation"].extend(relations)
+    return conflict
+
+
+def annotate_if_roa(roa_rad_tree, conflict, announce_only=False):
     announce = conflict.get("announce", None)
     if announce is None:
         return conflict
@@ -160,17 +429,19 @@ def annotate_if_roa(roa_rad_tree, conflict):
     if conflict_with is None:
         return conflict
     annotate_roa_announce(announce, roa_rad_tree)
-    annotate_roa_announce(conflict_with, roa_rad_tree)
+    if not announce_only:
+        annotate_roa_announce(conflict_with, roa_rad_tree)
     return conflict
 
 
-def annotate_if_route_objects(ro_rad_tree, conflict):
+def annotate_if_route_objects(ro_rad_tree, conflict, announce_only=False):
     """
     Check the `conflict' for valid route objects from the "announce" and
     "conflict_with" fields.
 
     :param conflict: conflict dictionnary to annotate
     :param ro_rad_tree: radix tree containing route objects, AS nb in data["asn"]
+    :param announce_only: only check the "announce" field
     :return: `conflict'
     """
 
@@ -181,7 +452,8 @@ def annotate_if_route_objects(ro_rad_tree, conflict):
     if conflict_with is None:
         return conflict
     annotate_route_announce(announce, ro_rad_tree)
-    annotate_route_announce(conflict_with, ro_rad_tree)
+    if not announce_only:
+        annotate_route_announce(conflict_with, ro_rad_tree)
     return conflict
 
 
@@ -193,9 +465,9 @@ def annotate_route_announce(announce, ro_rad_tree):
     :param ro_rad_tree: radix tree containing route objects, AS nb in data["asn"]
     :return: `announce'
     """
-    prefix = announce["prefix"]
+    prefix = as_prefix(announce["prefix"])
     asn = announce["asn"]
-    ro_declared = ro_rad_tree.search_covering(prefix)
+    ro_declared = radix_call(ro_rad_tree.search_covering, prefix)
 
     valid = set(announce.get("valid", set()))
     for node in ro_declared:
@@ -215,37 +487,17 @@ def annotate_roa_announce(announce, roa_rad_tree):
     :param roa_rad_tree: radix tree containing ROA
     :return: `announce'
     """
-    prefix = announce["prefix"]
+    prefix = as_prefix(announce["prefix"])
     asn = announce["asn"]
-    roa_declared = roa_rad_tree.search_covering(prefix)
+    roa_declared = radix_call(roa_rad_tree.search_covering, prefix)
     for node in roa_declared:
-        if asn in node.data and int(prefix.split("/")[1]) <= node.data[asn]:
+        if asn in node.data and prefix.length <= node.data[asn]:
             announce["valid"] = announce.get("valid", list())
             announce["valid"].append("roa")
             break
     return announce
 
 
-def canonical_as_path(as_path):
-    """
-    Transform an AS_PATH from a string to a list without prepending and
-    handling correctly AS_SETs.
-    """
-    new_as_path = []
-    segments = as_path.split()
-    for i, segment in enumerate(segments):
-        if not segment.startswith("{"):
-            asn = int(segment)
-            if len(new_as_path) == 0 or new_as_path[-1][0] != asn:
-                new_as_path.append([asn])
-        else:
-            if i == 0:
-                raise ValueError("as set in the first segment is illegal")
-            as_set = {int(asn) for asn in segment[1:-1].split(",")}
-            new_as_path.append(list(as_set))
-    return new_as_path
-
-
 def annotate_if_direct(conflict):
     """
     Add "direct": False to `conflict' if "as_path" from `conflict'
@@ -265,7 +517,7 @@ def annotate_if_direct(conflict):
 
     as_path = announce["as_path"]
     asn = conflict_with["asn"]
-    ases = canonical_as_path(as_path)
+    ases = intern_as_path(as_path).canonical
     if len(ases) > 1 and asn in ases[-2]:
         conflict["direct"] = True
     elif len(ases) > 2 and asn in chain.from_iterable(ases[:-2]):
@@ -307,3 +559,442 @@ def annotate_directly_with_type(conflict, relations_dict, ro_rad_tree,
     annotate_if_direct(conflict)
     annotate_with_type(conflict)
     return conflict
+
+
+def is_type_decided(conflict):
+    """
+    Return True if the annotations of `conflict' already decide the type
+    given by `annotate_with_type'.
+    """
+    announce = conflict.get("announce", None)
+    if announce is None or "conflict_with" not in conflict:
+        # Withdraws are never annotated
+        return True
+    return "valid" in announce or "relation" in conflict \
+        or "direct" in conflict
+
+
+def annotate_with_precedence(funcs, conflict):
+    """
+    Apply the annotation `funcs' to `conflict' until its type is decided,
+    then annotate it with `annotate_with_type'.
+
+    `funcs' must be ordered by the precedence of the type they lead to:
+    VALID (ROA and route objects), RELATION then DIRECT/NODIRECT.
+
+    :param funcs: list of annotation functions taking a conflict
+    :param conflict: one line of output from `detect_conflicts' task
+    :return: `conflict'
+    """
+    for f in funcs:
+        if is_type_decided(conflict):
+            break
+        f(conflict)
+    return annotate_with_type(conflict)
+
+
+def build_relation_index(irr_org_file, irr_mnt_file, opener=default_opener):
+    """Return the RelationIndex of the organisations and maintainers files."""
+
+    relations_dict = dict()
+    fill_relation_struct(irr_org_file, relations_dict, "organisations",
+                         opener)
+    fill_relation_struct(irr_mnt_file, relations_dict, "maintainers",
+                         opener)
+    return RelationIndex(relations_dict)
+
+
+def build_ro_tree(irr_ro_file, opener=default_opener):
+    """Return the radix tree of the route objects file."""
+
+    ro_rad_tree = Radix()
+    fill_ro_struct(irr_ro_file, ro_rad_tree, opener)
+    return ro_rad_tree
+
+
+def build_roa_tree(rpki_roa_file, opener=default_opener):
+    """Return the radix tree of the ROA file."""
+
+    roa_rad_tree = Radix()
+    fill_roa_struct(rpki_roa_file, roa_rad_tree, opener)
+    return roa_rad_tree
+
+
+def build_rpsl(*rpsl_files):
+    """
+    Return the radix tree of the route objects and the RelationIndex of the
+    RPSL dumps `rpsl_files'.
+    """
+
+    ro_rad_tree = Radix()
+    relations_dict = dict()
+    for rpsl_file in rpsl_files:
+        fill_rpsl_structs(rpsl_file, ro_rad_tree, relations_dict)
+    return {"ro_rad_tree": ro_rad_tree,
+            "relation_index": RelationIndex(relations_dict)}
+
+
+def build_index(path):
+    """Return the structures of a compiled index, see `tabi.index'."""
+
+    from tabi.index import load_index
+    index = load_index(path)
+    structures = dict()
+    if index.relation_index is not None:
+        structures["relation_index"] = index.relation_index
+    if index.route_objects is not None:
+        structures["ro_rad_tree"] = index.route_objects
+    if index.roas is not None:
+        structures["roa_rad_tree"] = index.roas
+    return structures
+
+
+# Source kind -> (function building the structures, structure name or None
+# if the function returns a dictionary of structures)
+SOURCE_BUILDERS = {"index": (build_index, None),
+                   "relations": (build_relation_index, "relation_index"),
+                   "route_objects": (build_ro_tree, "ro_rad_tree"),
+                   "roas": (build_roa_tree, "roa_rad_tree"),
+                   "rpsl": (build_rpsl, None)}
+
+
+def sources_mtime(files):
+    """Return the last modification time of `files' or of their content."""
+
+    mtime = 0
+    for filename in files:
+        try:
+            if os.path.isdir(filename):
+                for name in os.listdir(filename):
+                    mtime = max(mtime, os.path.getmtime(
+                        os.path.join(filename, name)))
+            else:
+                mtime = max(mtime, os.path.getmtime(filename))
+        except OSError:
+            # The file is being replaced, check again later
+            pass
+    return mtime
+
+
+class AnnotationSnapshot(object):
+    """
+    Metadata and the cache of the annotations computed with it. A snapshot
+    is never modified once in use: reloads build a new one.
+    """
+
+    def __init__(self, relation_index=None, ro_rad_tree=None,
+                 roa_rad_tree=None, full_annotation=False,
+                 maxsize=DEFAULT_ANNOTATIONS):
+        self.relation_index = relation_index
+        self.ro_rad_tree = ro_rad_tree
+        self.roa_rad_tree = roa_rad_tree
+        self.full_annotation = full_annotation
+        self.cache = LRUCache(maxsize)
+
+        announce_only = not full_annotation
+        relation_checks = []
+        if relation_index is not None:
+            relation_checks.append(partial(annotate_if_relation_index,
+                                           relation_index))
+        valid_checks = []
+        if roa_rad_tree is not None:
+            valid_checks.append(partial(annotate_if_roa, roa_rad_tree,
+                                        announce_only=announce_only))
+        if ro_rad_tree is not None:
+            valid_checks.append(partial(annotate_if_route_objects,
+                                        ro_rad_tree,
+                                        announce_only=announce_only))
+        if full_annotation:
+            self.checks = relation_checks + valid_checks[::-1]
+        else:
+            self.checks = valid_checks + relation_checks
+
+    def structures(self):
+        """Return the metadata as keyword arguments of the constructor."""
+
+        return {"relation_index": self.relation_index,
+                "ro_rad_tree": self.ro_rad_tree,
+                "roa_rad_tree": self.roa_rad_tree}
+
+    def lookup(self, announce, conflict_with):
+        """
+        Return the ("valid" of the announce, "valid" of the conflicting
+        announce, "relation") tuple of a conflict.
+        """
+
+        key = (announce["prefix"], announce["asn"],
+               conflict_with["prefix"], conflict_with["asn"])
+        annotations = self.cache.get(key)
+        if annotations is None:
+            conflict = {"announce": {"prefix": key[0], "asn": key[1]},
+                        "conflict_with": {"prefix": key[2], "asn": key[3]}}
+            if self.full_annotation:
+                for f in self.checks:
+                    f(conflict)
+            else:
+                for f in self.checks:
+                    if is_type_decided(conflict):
+                        break
+                    f(conflict)
+            annotations = (conflict["announce"].get("valid", None),
+                           conflict["conflict_with"].get("valid", None),
+                           conflict.get("relation", None))
+            self.cache[key] = annotations
+        return annotations
+
+
+class AnnotationContext(object):
+    """
+    Metadata used to annotate conflicts, and a bounded LRU cache of the
+    annotations depending only on the conflict identity: the announced and
+    conflicting prefixes and ASN.
+
+    Both are kept in an AnnotationSnapshot that is replaced atomically each
+    time metadata is (re)loaded, so conflicts can be annotated while new
+    metadata is built in another thread. `reload' rebuilds the structures
+    whose source files changed, `watch' does it periodically in the
+    background and also fetches the ROA changes of an RTR cache; they are
+    applied by `annotate' between two conflicts. An RTR cache is the only
+    source of ROA: it cannot be used with a ROA CSV file, and the ROA of
+    compiled indexes are ignored.
+
+    By default, the annotations stop as soon as the type is decided, see
+    `annotate_with_precedence'; every annotation is computed with
+    `full_annotation'.
+    """
+
+    def __init__(self, maxsize=DEFAULT_ANNOTATIONS, full_annotation=False):
+        self.maxsize = maxsize
+        self.full_annotation = full_annotation
+        self.snapshot = AnnotationSnapshot(full_annotation=full_annotation,
+                                           maxsize=maxsize)
+        # kind -> (arguments of the builder, modification time)
+        self.sources = dict()
+        self.reloads = 0
+        # `lock' protects the snapshot swaps, `build_lock' serializes the
+        # builds so that conflicts are annotated while they run
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+        # RTR client keeping the ROA tree up to date, and fetched changes
+        self.rtr = None
+        self.rtr_changes = deque()
+        # Statistics of the replaced snapshots and of the annotation
+        # processes
+        self.old_hits = 0
+        self.old_misses = 0
+
+    @property
+    def cache(self):
+        return self.snapshot.cache
+
+    @property
+    def hits(self):
+        return self.old_hits + self.snapshot.cache.hits
+
+    @property
+    def misses(self):
+        return self.old_misses + self.snapshot.cache.misses
+
+    def load(self, kind, *args):
+        """Build the structures of the source `kind' and use them."""
+
+        if kind == "roas" and self.rtr is not None:
+            raise CriticalException("ROA are already fetched from an RTR "
+                                    "cache")
+        with self.build_lock:
+            structures = self.build(kind, args)
+            with self.lock:
+                self.swap(structures)
+
+    def build(self, kind, args):
+        """Record the source `kind' and return its structures."""
+
+        files = [arg for arg in args if isinstance(arg, basestring)]
+        mtime = sources_mtime(files)
+        builder, name = SOURCE_BUILDERS[kind]
+        structures = builder(*args)
+        if name is not None:
+            structures = {name: structures}
+        self.sources[kind] = (args, mtime)
+        return structures
+
+    def swap(self, structures):
+        """Replace the snapshot with one using the new `structures'."""
+
+        old = self.snapshot
+        new_structures = old.structures()
+        new_structures.update(structures)
+        if self.rtr is not None:
+            new_structures["roa_rad_tree"] = self.rtr.rad_tree
+        self.snapshot = AnnotationSnapshot(full_annotation=self.full_annotation,
+                                           maxsize=self.maxsize,
+                                           **new_structures)
+        self.old_hits += old.cache.hits
+        self.old_misses += old.cache.misses
+
+    def load_relations(self, irr_org_file, irr_mnt_file,
+                       opener=default_opener):
+        """Load the organisations and maintainers CSV files."""
+        self.load("relations", irr_org_file, irr_mnt_file, opener)
+
+    def load_route_objects(self, irr_ro_file, opener=default_opener):
+        """Load the route objects CSV file."""
+        self.load("route_objects", irr_ro_file, opener)
+
+    def load_roas(self, rpki_roa_file, opener=default_opener):
+        """Load the ROA CSV file."""
+        self.load("roas", rpki_roa_file, opener)
+
+    def load_rpsl(self, *rpsl_files):
+        """Load the route objects and relations of RPSL dumps."""
+        self.load("rpsl", *rpsl_files)
+
+    def load_index(self, path):
+        """Load the metadata compiled with `tabi.index.compile_index'."""
+        self.load("index", path)
+
+    def load_rtr(self, host, port):
+        """
+        Use the ROA of an RTR validator cache, see `tabi.rtr'. They are
+        updated when the sources are watched.
+        """
+
+        if "roas" in self.sources:
+            raise CriticalException("ROA are already loaded from a CSV file")
+        from tabi.rtr import RTRClient
+        rtr = RTRClient(host, port)
+        rtr.update()
+        with self.lock:
+            self.rtr = rtr
+            self.swap({})
+
+    def fetch_rtr(self):
+        """Fetch the ROA changes from the RTR cache, applied by `annotate'."""
+
+        if self.rtr is None:
+            return
+        try:
+            full, changes = self.rtr.fetch()
+        except Exception:
+            # Start a new session with the next fetch
+            self.rtr.close()
+            self.rtr.session_id = None
+            raise
+        if full or len(changes):
+            self.rtr_changes.append((full, changes))
+
+    def apply_rtr(self):
+        """Apply the fetched ROA changes to the tree in use, return them."""
+
+        applied = []
+        while len(self.rtr_changes):
+            full, changes = self.rtr_changes.popleft()
+            self.rtr.apply(full, changes)
+            applied.append((full, changes))
+        # Cached annotations may be wrong now
+        self.invalidate()
+        return applied
+
+    def invalidate(self):
+        """Forget the cached annotations."""
+
+        with self.lock:
+            self.swap({})
+
+    def changed_sources(self):
+        """Return the kinds of the sources modified since they were loaded."""
+
+        changed = []
+        for kind, (args, mtime) in self.sources.items():
+            files = [arg for arg in args if isinstance(arg, basestring)]
+            if sources_mtime(files) != mtime:
+                changed.append(kind)
+        return changed
+
+    def reload(self, kinds=None):
+        """
+        Rebuild the structures of the modified sources, or of `kinds', then
+        swap them in at once. Return the list of reloaded kinds.
+
+        The snapshot in use is only locked during the swap, so that the ROA
+        changes of an RTR cache can be applied during the rebuild.
+        """
+
+        with self.build_lock:
+            if kinds is None:
+                kinds = self.changed_sources()
+            structures = dict()
+            # The compiled index first, CSV files override it
+            for kind in sorted(kinds, key=lambda kind: kind != "index"):
+                args, _ = self.sources[kind]
+                structures.update(self.build(kind, args))
+            if len(kinds):
+                with self.lock:
+                    self.swap(structures)
+                    self.reloads += 1
+        return kinds
+
+    def request_reload(self):
+        """Reload every source in a background thread, e.g. on SIGHUP."""
+
+        thread = threading.Thread(target=self.reload,
+                                  args=(list(self.sources),))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def watch(self, interval=60):
+        """Check the sources every `interval' seconds in a thread."""
+
+        def run():
+            while not self.stopped.wait(interval):
+                try:
+                    self.reload()
+                    self.fetch_rtr()
+                except Exception:
+                    logger.exception("cannot reload annotation metadata")
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target=run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop watching the sources."""
+
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def annotate(self, conflict):
+        """
+        Annotate `conflict' like `annotate_with_type' after the other
+        annotation functions.
+
+        :param conflict: one line of output from `detect_conflicts' task
+        :return: `conflict'
+        """
+
+        # The ROA tree is only modified here, never while it is read
+        if len(self.rtr_changes):
+            self.apply_rtr()
+
+        snapshot = self.snapshot
+        announce = conflict.get("announce", None)
+        conflict_with = conflict.get("conflict_with", None)
+        if announce is not None and conflict_with is not None:
+            valid, conflict_valid, relation = snapshot.lookup(announce,
+                                                              conflict_with)
+            if relation is not None:
+                conflict["relation"] = list(relation)
+            if valid is not None:
+                announce["valid"] = list(valid)
+            if conflict_valid is not None:
+                conflict_with["valid"] = list(conflict_valid)
+
+        if self.full_annotation or not is_type_decided(conflict):
+            annotate_if_direct(conflict)
+        return annotate_with_type(conflict)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 ANSSI
+# This file is part of the tabi project licensed under the MIT license.
+
+# Interned AS_PATH objects
+
+from tabi.helpers import LRUCache, get_as_origin
+
+# Default number of distinct AS_PATH kept in the intern table
+DEFAULT_AS_PATHS = 1 << 20
+
+
+def canonical_as_path(as_path):
+    """
+    Transform an AS_PATH from a string to a list without prepending and
+    handling correctly AS_SETs.
+    """
+    new_as_path = []
+    segments = as_path.split()
+    for i, segment in enumerate(segments):
+        if not segment.startswith("{"):
+            asn = int(segment)
+            if len(new_as_path) == 0 or new_as_path[-1][0] != asn:
+                new_as_path.append([asn])
+        else:
+            if i == 0:
+                raise ValueError("as set in the first segment is illegal")
+            as_set = {int(asn) for asn in segment[1:-1].split(",")}
+            new_as_path.append(list(as_set))
+    return new_as_path
+
+
+class ASPath(object):
+    """
+    Parsed AS_PATH shared by every route using it.
+
+    `origins' is the tuple of origin ASN as returned by `get_as_origin',
+    `origin' is a single ASN or a frozenset when the path ends with an AS_SET.
+    The canonical form is computed on first access and must not be modified.
+    """
+
+    __slots__ = ("path", "origins", "origin", "_canonical")
+
+    def __init__(self, path):
+        self.path = path
+        self.origins = tuple(get_as_origin(path))
+        origin = frozenset(self.origins)
+        if len(origin) == 1:
+            origin = iter(origin).next()
+        self.origin = origin
+        self._canonical = None
+
+    @property
+    def canonical(self):
+        """AS_PATH without prepending, see `canonical_as_path'."""
+        if self._canonical is None:
+            self._canonical = canonical_as_path(self.path)
+        return self._canonical
+
+    def __repr__(self):
+        return "ASPath(%r)" % self.path
+
+
+class ASPathTable(object):
+    """
+    Bounded intern table mapping AS_PATH strings to ASPath objects. The least
+    recently used paths are evicted when the table is full.
+    """
+
+    def __init__(self, maxsize=DEFAULT_AS_PATHS):
+        self.entries = LRUCache(maxsize)
+
+    def get(self, as_path):
+        """
+        Return the ASPath object of `as_path', parsing it only if unknown.
+        Raise CriticalException if `as_path' is invalid.
+        """
+        entry = self.entries.get(as_path)
+        if entry is None:
+            entry = ASPath(as_path)
+            self.entries[as_path] = entry
+        return entry
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+
+
+as_paths = ASPathTable()
+
+
+def intern_as_path(as_path):
+    """Return the shared ASPath object of `as_path' from the default table."""
+    return as_paths.get(as_path)
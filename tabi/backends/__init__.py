@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 ANSSI
+# This file is part of the tabi project licensed under the MIT license.
+
+# RIB backends
+#
+# A backend is a prefix tree with the methods of py-radix used by the RIBs:
+# add, search_exact, search_covering, search_covered, delete, nodes and
+# prefixes, called with a prefix text or with the packed= and masklen=
+# keywords. Its nodes have the prefix, network, prefixlen, packed, family
+# and data attributes of py-radix nodes.
+
+import socket
+import importlib
+
+from tabi.helpers import CriticalException, as_prefix, mask_packed
+
+# Name of a backend -> (module, class), "nparray" is experimental: it is
+# several times slower than py-radix on covering lookups
+BACKENDS = {
+    "hashed": ("tabi.backends.hashed", "HashTree"),
+    "nparray": ("tabi.backends.nparray", "ArrayTree"),
+    "spill": ("tabi.backends.spill", "SpillTree"),
+}
+
+
+class Node(object):
+    """Node of a RIB backend, like a py-radix node without its parent."""
+
+    __slots__ = ("network", "prefix", "prefixlen", "packed", "family",
+                 "data")
+
+    def __init__(self, family, packed, prefixlen):
+        self.network = socket.inet_ntop(family, packed)
+        self.prefix = "%s/%d" % (self.network, prefixlen)
+        self.prefixlen = prefixlen
+        self.packed = packed
+        self.family = family
+        self.data = dict()
+
+    def __repr__(self):
+        return "<Node %s>" % self.prefix
+
+
+def parse_key(network=None, masklen=None, packed=None):
+    """
+    Return the (family, packed network, length) of a prefix given like to
+    py-radix methods, its host bits unset.
+    """
+
+    if packed is None:
+        if masklen is not None:
+            network = "%s/%s" % (network, masklen)
+        prefix = as_prefix(network)
+        packed, masklen = prefix.packed, prefix.length
+    elif masklen is None:
+        masklen = 8 * len(packed)
+    if len(packed) == 4:
+        family = socket.AF_INET
+    else:
+        family = socket.AF_INET6
+    if masklen < 0 or masklen > 8 * len(packed):
+        raise ValueError("invalid prefix length")
+    return family, mask_packed(packed, masklen), masklen
+
+
+def new_tree(backend=None):
+    """
+    Return an empty tree of `backend': the name of a backend, a class or a
+    function returning a tree, or None and "radix" for py-radix. If py-radix is not installed, None is
+    the "hashed" backend.
+    """
+
+    if backend is None or backend == "radix":
+        try:
+            from radix import Radix
+        except ImportError:
+            if backend is not None:
+                raise CriticalException("py-radix is not installed")
+            backend = "hashed"
+        else:
+            return Radix()
+    if not isinstance(backend, basestring):
+        return backend()
+    try:
+        module_name, class_name = BACKENDS[backend]
+    except KeyError:
+        raise CriticalException("unknown RIB backend '%s'" % backend)
+    return getattr(importlib.import_module(module_name), class_name)()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 ANSSI
+# This file is part of the tabi project licensed under the MIT license.
+
+# Compare the RIB backends on random prefixes
+#
+#   python -m tabi.backends.benchmark --prefixes 500000 --queries 100000
+
+from __future__ import print_function
+
+import time
+import random
+import socket
+import struct
+
+from tabi.backends import BACKENDS, new_tree
+from tabi.helpers import Prefix
+
+# Prefix lengths of the IPv4 and IPv6 routes, weighted roughly like a RIB
+IPV4_LENGTHS = [8, 12, 14, 16, 18, 19, 20, 21, 22, 22, 23, 23] + [24] * 20
+IPV6_LENGTHS = [29, 32, 32, 36, 40, 44, 48, 48, 48, 48]
+
+
+def random_prefix(generator, ipv6_ratio=0.2):
+    """Return a random Prefix, with its host bits unset."""
+
+    if generator.random() < ipv6_ratio:
+        length = generator.choice(IPV6_LENGTHS)
+        address = (0x2000 << 112) | (generator.getrandbits(64) << 48)
+        address &= ~((1 << (128 - length)) - 1)
+        packed = struct.pack("!QQ", address >> 64, address & (2 ** 64 - 1))
+        family = socket.AF_INET6
+    else:
+        length = generator.choice(IPV4_LENGTHS)
+        address = generator.getrandbits(32)
+        address &= ~((1 << (32 - length)) - 1)
+        packed = struct.pack("!I", address)
+        family = socket.AF_INET
+    prefix = "%s/%d" % (socket.inet_ntop(family, packed), length)
+    return Prefix(prefix, packed, length)
+
+
+def more_specific(generator, prefix):
+    """Return a random prefix covered by `prefix'."""
+
+    width = 8 * len(prefix.packed)
+    length = generator.randint(prefix.length, min(width, prefix.length + 8))
+    address = 0
+    for byte in bytearray(prefix.packed):
+        address = (address << 8) | byte
+    address |= generator.getrandbits(width) & ((1 << (width - prefix.length)) - 1)
+    address &= ~((1 << (width - length)) - 1)
+    packed = "".join(chr((address >> shift) & 0xff)
+                     for shift in range(width - 8, -8, -8))
+    family = socket.AF_INET if width == 32 else socket.AF_INET6
+    prefix = "%s/%d" % (socket.inet_ntop(family, packed), length)
+    return Prefix(prefix, packed, length)
+
+
+def timed(function, *args):
+    """Return the seconds taken by `function', and its result."""
+
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+
+def benchmark(backend, prefixes, queries):
+    """Return the (operation, seconds) of `backend'."""
+
+    tree = new_tree(backend)
+
+    def add():
+        for prefix in prefixes:
+            tree.add(packed=prefix.packed, masklen=prefix.length)
+
+    def search_covering():
+        found = 0
+        for prefix in queries:
+            found += len(tree.search_covering(packed=prefix.packed,
+                                              masklen=prefix.length))
+        return found
+
+    def search_exact():
+        found = 0
+        for prefix in queries:
+            if tree.search_exact(packed=prefix.packed,
+                                 masklen=prefix.length) is not None:
+                found += 1
+        return found
+
+    def delete():
+        for prefix in prefixes[::2]:
+            try:
+                tree.delete(packed=prefix.packed, masklen=prefix.length)
+            except KeyError:
+                pass
+
+    results = []
+    for name, function in (("add", add),
+                           ("search_covering", search_covering),
+                           ("search_exact", search_exact),
+                           ("delete", delete),
+                           ("search_covering after delete", search_covering)):
+        seconds, _ = timed(function)
+        results.append((name, seconds))
+    return results
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare the RIB backends")
+    parser.add_argument("--prefixes", type=int, default=200000,
+                        help="number of prefixes added to the RIB")
+    parser.add_argument("--queries", type=int, default=100000,
+                        help="number of prefixes searched")
+    parser.add_argument("--seed", type=int, default=2807,
+                        help="seed of the random prefixes")
+    parser.add_argument("backends", nargs="*",
+                        default=["radix"] + sorted(BACKENDS),
+                        help="backends to compare")
+    args = parser.parse_args()
+
+    generator = random.Random(args.seed)
+    prefixes = [random_prefix(generator) for _ in range(args.prefixes)]
+    # Half of the queries are more specific than a stored prefix
+    queries = []
+    for _ in range(args.queries):
+        if generator.random() < 0.5:
+            queries.append(more_specific(generator,
+                                         generator.choice(prefixes)))
+        else:
+            queries.append(random_prefix(generator))
+
+    print("%d prefixes, %d queries" % (len(prefixes), len(queries)))
+    for backend in args.backends:
+        print(backend)
+        for name, seconds in benchmark(backend, prefixes, queries):
+            print("  %-30s %8.3fs" % (name, seconds))
+
+
+if __name__ == "__main__":
+    main()
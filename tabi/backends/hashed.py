@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 ANSSI
+# This file is part of the tabi project licensed under the MIT license.
+
+# Pure-Python RIB backend
+#
+# The networks of each address family and prefix length are the integer
+# keys of a dictionary of nodes. A covering lookup masks the address to
+# every stored length and looks it up. Only dictionaries and integers are
+# used, which the PyPy JIT optimises well, and py-radix is not needed.
+
+import socket
+import struct
+
+from operator import attrgetter
+
+from tabi.backends import Node, parse_key
+
+# Number of bits of the addresses of each address family
+FAMILY_BITS = {socket.AF_INET: 32, socket.AF_INET6: 128}
+
+# Integer masks of every prefix length, per address family
+MASKS = dict((family, [((1 << length) - 1) << (bits - length)
+                       for length in range(bits + 1)])
+             for family, bits in FAMILY_BITS.iteritems())
+
+
+def packed_int(packed):
+    """Return the integer value of a packed address."""
+
+    if len(packed) == 4:
+        return struct.unpack("!I", packed)[0]
+    high, low = struct.unpack("!QQ", packed)
+    return (high << 64) | low
+
+
+class HashTree(object):
+    """Prefix tree with the interface of py-radix, on dictionaries."""
+
+    def __init__(self):
+        # family -> length -> network -> node
+        self.tables = dict((family, dict()) for family in FAMILY_BITS)
+        # family -> stored lengths, the longest first
+        self.lengths = dict((family, []) for family in FAMILY_BITS)
+
+    def add(self, network=None, masklen=None, packed=None):
+        family, packed, length = parse_key(network, masklen, packed)
+        networks = self.tables[family].get(length, None)
+        if networks is None:
+            networks = self.tables[family][length] = dict()
+            self.lengths[family] = sorted(self.tables[family], reverse=True)
+        key = packed_int(packed)
+        node = networks.get(key, None)
+        if node is None:
+            node = networks[key] = Node(family, packed, length)
+        return node
+
+    def search_exact(self, network=None, masklen=None, packed=None):
+        family, packed, length = parse_key(network, masklen, packed)
+        networks = self.tables[family].get(length, None)
+        if networks is None:
+            return None
+        return networks.get(packed_int(packed), None)
+
+    def delete(self, network=None, masklen=None, packed=None):
+        family, packed, length = parse_key(network, masklen, packed)
+        networks = self.tables[family].get(length, None)
+        if networks is None or networks.pop(packed_int(packed), None) is None:
+            raise KeyError("no such address")
+        if not len(networks):
+            del self.tables[family][length]
+            self.lengths[family].remove(length)
+
+    def search_covering(self, network=None, masklen=None, packed=None):
+        """Return the nodes covering a prefix, the most specific first."""
+
+        family, packed, length = parse_key(network, masklen, packed)
+        address = packed_int(packed)
+        masks = MASKS[family]
+        tables = self.tables[family]
+
+        nodes = []
+        for stored in self.lengths[family]:
+            if stored <= length:
+                node = tables[stored].get(address & masks[stored], None)
+                if node is not None:
+                    nodes.append(node)
+        return nodes
+
+    def search_covered(self, network=None, masklen=None, packed=None):
+        """Return the nodes covered by a prefix, itself included."""
+
+        family, packed, length = parse_key(network, masklen, packed)
+        bits = FAMILY_BITS[family]
+        low = packed_int(packed)
+        high = low | ((1 << (bits - length)) - 1)
+
+        nodes = []
+        for stored in reversed(self.lengths[family]):
+            if stored < length:
+                continue
+            networks = self.tables[family][stored]
+            count = 1 << (stored - length)
+            if count <= len(networks):
+                # Look up every network of this length in the prefix
+                step = 1 << (bits - stored)
+                key = low
+                while key <= high:
+                    node = networks.get(key, None)
+                    if node is not None:
+                        nodes.append(node)
+                    key += step
+            else:
+                nodes.extend(node for key, node in networks.iteritems()
+                             if low <= key <= high)
+        return nodes
+
+    def nodes(self):
+        nodes = []
+        for tables in self.tables.itervalues():
+            for networks in tables.itervalues():
+                nodes.extend(networks.itervalues())
+        nodes.sort(key=attrgetter("family", "packed", "prefixlen"))
+        return nodes
+
+    def prefixes(self):
+        return [node.prefix for node in self.nodes()]
+
+    def __iter__(self):
+        return iter(self.nodes())
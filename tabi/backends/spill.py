@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 ANSSI
+# This file is part of the tabi project licensed under the MIT license.
+
+# RIB backend spilling cold prefixes to disk
+#
+# At most `max_nodes' nodes are kept in an in-memory tree. Beyond, the least
+# recently used ones are pickled into an SQLite database, keyed by their
+# packed network followed by their length, and removed from the tree. A
+# spilled node is moved back to the tree when it is searched.
+#
+# The number of spilled prefixes of each length and a Bloom filter of their
+# keys are kept in memory, so that most searches never read the database.
+
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import cPickle
+
+from collections import OrderedDict
+from operator import attrgetter
+
+from tabi.backends import Node, mask_packed, new_tree, parse_key
+from tabi.helpers import CriticalException
+
+# Default number of nodes kept in memory
+MAX_NODES = 1000000
+
+# Smallest budget, larger than the number of nodes used by a search
+MIN_NODES = 1024
+
+# Number of writes between two commits
+COMMIT_INTERVAL = 10000
+
+
+def node_key(packed, length):
+    return packed + chr(length)
+
+
+def temporary_path():
+    """Return the path of a new temporary database."""
+
+    fd, path = tempfile.mkstemp(prefix="tabi-rib-", suffix=".sqlite")
+    os.close(fd)
+    return path
+
+
+def last_packed(packed, length):
+    """Return the last packed address of a prefix."""
+
+    full, bits = divmod(length, 8)
+    if full >= len(packed):
+        return packed
+    last = chr(ord(packed[full]) | (0xff >> bits))
+    return packed[:full] + last + "\xff" * (len(packed) - full - 1)
+
+
+class BloomFilter(object):
+    """Set of keys with false positives, and no removal."""
+
+    def __init__(self, bits=1 << 20, hashes=3):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray(bits >> 3)
+        self.count = 0
+
+    def positions(self, key):
+        value = hash(key)
+        step = (value >> 32) | 1
+        for i in range(self.hashes):
+            yield (value + i * step) % self.bits
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        for position in self.positions(key):
+            if not self.array[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class SpillTree(object):
+    """
+    Prefix tree with the interface of py-radix, keeping at most `max_nodes'
+    nodes in a tree of `backend' and the others in the SQLite database
+    `path', a temporary file by default.
+
+    The nodes returned by `nodes' that are spilled are copies, modifying
+    them has no effect. `nodes' loads every spilled node in memory, use
+    the iteration over the tree to keep the memory budget.
+
+    A forked process uses a copy of the database, made when it first needs
+    it, and never closes or removes the database of its parent. `commit'
+    must be called before forking so that the copy has every spilled node.
+    """
+
+    def __init__(self, max_nodes=MAX_NODES, path=None, backend=None):
+        if max_nodes < MIN_NODES:
+            raise CriticalException("a RIB needs at least %d nodes in "
+                                    "memory" % MIN_NODES)
+        self.max_nodes = max_nodes
+        self.memory = new_tree(backend)
+        # key -> node of the tree, the least recently used first
+        self.used = OrderedDict()
+
+        self.path = path
+        self.temporary = path is None
+        # The database is opened when the first node is spilled, e.g. after
+        # the RIB was given to a new process, by the process `pid'
+        self.db = None
+        self.pid = None
+        self.writes = 0
+
+        # family -> length -> number of spilled nodes
+        self.spilled = dict((family, dict())
+                            for family in (socket.AF_INET, socket.AF_INET6))
+        self.summary = BloomFilter()
+
+    def connect(self):
+        """Create the database."""
+
+        if self.temporary:
+            self.path = temporary_path()
+        self.open()
+        self.db.execute("DROP TABLE IF EXISTS nodes")
+        self.db.execute("CREATE TABLE nodes (key BLOB PRIMARY KEY, "
+                        "data BLOB)")
+
+    def open(self):
+        self.db = sqlite3.connect(self.path)
+        self.pid = os.getpid()
+        # The database is a cache, not kept after a crash
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.execute("PRAGMA journal_mode = OFF")
+
+    def own(self):
+        """Use a copy of the database of the parent in a forked process."""
+
+        if self.db is None or self.pid == os.getpid():
+            return
+        # The connection of the parent must not be used
+        parent_path = self.path
+        self.db = None
+        self.path = temporary_path()
+        self.temporary = True
+        shutil.copyfile(parent_path, self.path)
+        self.open()
+        self.writes = 0
+
+    def commit(self):
+        """Write the spilled nodes to the database, e.g. before a fork."""
+
+        if self.db is not None and self.pid == os.getpid():
+            self.db.commit()
+            self.writes = 0
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """
+        Close the database, and remove it if it is temporary. A forked
+        process only forgets the database of its parent.
+        """
+
+        if self.db is not None:
+            if self.pid == os.getpid():
+                self.db.close()
+                if self.temporary:
+                    os.remove(self.path)
+            self.db = None
+
+    def count(self, family, length, delta):
+        counts = self.spilled[family]
+        counts[length] = counts.get(length, 0) + delta
+        if not counts[length]:
+            del counts[length]
+
+    def touch(self, node):
+        """Mark a node of the tree as recently used."""
+
+        key = node_key(node.packed, node.prefixlen)
+        self.used.pop(key, None)
+        self.used[key] = node
+
+    def wrote(self, count):
+        self.writes += count
+        if self.writes >= COMMIT_INTERVAL:
+            self.db.commit()
+            self.writes = 0
+
+    def restore(self, family, packed, length, data):
+        """Move a spilled node back to the tree."""
+
+        key = node_key(packed, length)
+        self.db.execute("DELETE FROM nodes WHERE key = ?", (buffer(key),))
+        self.wrote(1)
+        self.count(family, length, -1)
+        node = self.memory.add(packed=packed, masklen=length)
+        node.data.update(cPickle.loads(data))
+        self.used[key] = node
+        return node
+
+    def fault(self, family, packed, length):
+        """Move the spilled node of a prefix back to the tree, or None."""
+
+        key = node_key(packed, length)
+        if length not in self.spilled[family] or key not in self.summary:
+            return None
+        self.own()
+        row = self.db.execute("SELECT data FROM nodes WHERE key = ?",
+                              (buffer(key),)).fetchone()
+        if row is None:
+            return None
+        return self.restore(family, packed, length, str(row[0]))
+
+    def shrink(self, keep=0):
+        """
+        Spill the least recently used nodes if there are too many, but not
+        the `keep' most recently used ones, e.g. the nodes about to be
+        returned.
+        """
+
+        if len(self.used) <= self.max_nodes:
+            return
+        if self.db is None:
+            self.connect()
+        self.own()
+
+        # Spill a tenth of the budget at once
+        count = min(len(self.used) - self.max_nodes + self.max_nodes / 10,
+                    len(self.used) - keep)
+        rows = []
+        for _ in range(count):
+            key, node = self.used.popitem(last=False)
+            rows.append((buffer(key),
+                         buffer(cPickle.dumps(node.data,
+                                              cPickle.HIGHEST_PROTOCOL))))
+            self.memory.delete(packed=node.packed, masklen=node.prefixlen)
+            self.count(node.family, node.prefixlen, 1)
+            self.summary.add(key)
+        self.db.executemany("INSERT OR REPLACE INTO nodes VALUES (?, ?)",
+                            rows)
+        self.wrote(len(rows))
+
+        # Keep the false positives rare
+        if self.summary.count > self.summary.bits / 10:
+            self.rebuild_summary()
+
+    def rebuild_summary(self):
+        """Build the Bloom filter of the spilled keys."""
+
+        spilled = sum(sum(counts.itervalues())
+                      for counts in self.spilled.itervalues())
+        bits = 1 << 20
+        while bits < 20 * spilled:
+            bits <<= 1
+        self.summary = BloomFilter(bits)
+        for key, in self.db.execute("SELECT key FROM nodes"):
+            self.summary.add(str(key))
+
+    def add(self, network=None, masklen=None, packed=None):
+        family, packed, length = parse_key(network, masklen, packed)
+        node = self.memory.search_exact(packed=packed, masklen=length)
+        if node is None:
+            node = self.fault(family, packed, length)
+        if node is None:
+            node = self.memory.add(packed=packed, masklen=length)
+        self.touch(node)
+        self.shrink()
+        return node
+
+    def search_exact(self, network=None, masklen=None, packed=None):
+        family, packed, length = parse_key(network, masklen, packed)
+        node = self.memory.search_exact(packed=packed, masklen=length)
+        if node is None:
+            node = self.fault(family, packed, length)
+            if node is not None:
+                self.shrink()
+        else:
+            self.touch(node)
+        return node
+
+    def delete(self, network=None, masklen=None, packed=None):
+        family, packed, length = parse_key(network, masklen, packed)
+        key = node_key(packed, length)
+        if self.used.pop(key, None) is not None:
+            self.memory.delete(packed=packed, masklen=length)
+            return
+        if length in self.spilled[family] and key in self.summary:
+            self.own()
+            cursor = self.db.execute("DELETE FROM nodes WHERE key = ?",
+                                     (buffer(key),))
+            if cursor.rowcount:
+                self.wrote(1)
+                self.count(family, length, -1)
+                return
+        raise KeyError("no such address")
+
+    def search_covering(self, network=None, masklen=None, packed=None):
+        """Return the nodes covering a prefix, the most specific first."""
+
+        family, packed, length = parse_key(network, masklen, packed)
+        faulted = False
+        for stored in self.spilled[family].keys():
+            if stored <= length and \
+               self.fault(family, mask_packed(packed, stored),
+                          stored) is not None:
+                faulted = True
+
+        nodes = self.memory.search_covering(packed=packed, masklen=length)
+        for node in nodes:
+            self.touch(node)
+        if faulted:
+            self.shrink(len(nodes))
+        return nodes
+
+    def spilled_covered(self, family, packed, length):
+        """Return the (key, data) of the spilled nodes covered by a prefix."""
+
+        if self.db is None:
+            return []
+        self.own()
+        width = len(packed)
+        rows = self.db.execute("SELECT key, data FROM nodes "
+                               "WHERE key BETWEEN ? AND ?",
+                               (buffer(node_key(packed, length)),
+                                buffer(node_key(last_packed(packed, length),
+                                                8 * width))))
+        return [(str(key), str(data)) for key, data in rows
+                if len(key) == width + 1 and ord(key[width]) >= length]
+
+    def search_covered(self, network=None, masklen=None, packed=None):
+        """
+        Return the nodes covered by a prefix, itself included. They are all
+        kept in memory, even beyond `max_nodes', until the next call.
+        """
+
+        family, packed, length = parse_key(network, masklen, packed)
+        for key, data in self.spilled_covered(family, packed, length):
+            self.restore(family, key[:-1], ord(key[-1]), data)
+
+        nodes = self.memory.search_covered(packed=packed, masklen=length)
+        for node in nodes:
+            self.touch(node)
+        self.shrink(len(nodes))
+        return nodes
+
+    def iter_spilled(self):
+        """Yield copies of the spilled nodes."""
+
+        if self.db is None:
+            return
+        self.own()
+        for key, data in self.db.execute("SELECT key, data FROM nodes"):
+            key = str(key)
+            if len(key) == 5:
+                family = socket.AF_INET
+            else:
+                family = socket.AF_INET6
+            node = Node(family, key[:-1], ord(key[-1]))
+            node.data.update(cPickle.loads(str(data)))
+            yield node
+
+    def nodes(self):
+        nodes = self.memory.nodes()
+        nodes.extend(self.iter_spilled())
+        nodes.sort(key=attrgetter("family", "packed", "prefixlen"))
+        return nodes
+
+    def prefixes(self):
+        return [node.prefix for node in self.nodes()]
+
+    def __iter__(self):
+        """
+        Yield the nodes in memory, then copies of the spilled ones read one
+        by one, without loading the whole tree. The tree must not be
+        modified meanwhile.
+        """
+
+        for node in self.memory.nodes():
+            yield node
+        for node in self.iter_spilled():
+            yield node
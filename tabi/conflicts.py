@@ -0,0 +1,683 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 ANSSI
+# This file is part of the tabi project licensed under the MIT license.
+
+# Stateful processing of the conflicts produced by the engines
+
+import abc
+import logging
+
+from collections import OrderedDict, deque
+
+from tabi.helpers import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Types of the notices reported along with the conflicts
+NOTICE_TYPES = ("STORM", "DAMPING")
+
+
+def conflict_key(conflict):
+    """
+    Return the (prefix, conflicting prefix, origin, conflicting origin)
+    tuple identifying a conflict.
+    """
+    announce = conflict["announce"]
+    conflict_with = conflict["conflict_with"]
+    return (announce["prefix"], conflict_with["prefix"],
+            announce["asn"], conflict_with["asn"])
+
+
+class ReportedConflicts(object):
+    """
+    Keys of the conflicts last reported for the announce of each peer and
+    prefix, used to only report the new conflicts of duplicate announces.
+    At most `max_entries' are kept, the least recently announced being
+    forgotten first: their conflicts are then reported again.
+    """
+
+    def __init__(self, max_entries=1000000):
+        self.entries = LRUCache(max_entries)
+
+    def new_conflicts(self, update, conflicts, duplicate):
+        """
+        Remember the `conflicts' of `update' and return the ones that must
+        be reported: all of them, or if `update' is a `duplicate' of the
+        previous announce of its peer, the ones that were not reported for
+        this announce.
+        """
+
+        peer_key = (update.prefix, update.peer_as, update.peer_ip)
+        previous = self.entries.pop(peer_key, None)
+        keys = frozenset(conflict_key(conflict) for conflict in conflicts
+                         if "announce" in conflict)
+        if len(keys):
+            self.entries[peer_key] = keys
+        if not duplicate or previous is None:
+            return conflicts
+        return [conflict for conflict in conflicts
+                if "announce" not in conflict or
+                conflict_key(conflict) not in previous]
+
+    def forget(self, update):
+        """Forget the conflicts of the previous announce of a peer."""
+
+        self.entries.pop((update.prefix, update.peer_as, update.peer_ip),
+                         None)
+
+
+class ConflictState(object):
+    """Information kept about an ongoing conflict."""
+
+    __slots__ = ("collector", "as_path", "peers", "updates",
+                 "first_seen", "last_seen", "last_summary")
+
+    def __init__(self, collector, as_path, timestamp):
+        self.collector = collector
+        self.as_path = as_path
+        self.peers = set()
+        self.updates = 1
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.last_summary = timestamp
+
+
+class ConflictTracker(object):
+    """
+    Follow conflicts from their first announce to the withdraw of the last
+    peer announcing them.
+
+    Instead of a record per update in conflict, `process' returns:
+      - the first conflicting record, with "event": "start"
+      - a "summary" record every `summary_interval' seconds
+      - an "end" record when no peer announces the conflict anymore, or when
+        it is evicted because more than `max_conflicts' are followed.
+    Records concerning withdraws are returned unchanged.
+
+    Summaries are due according to the timestamps of the updates, expected
+    to increase. Every update gives the summaries of all the conflicts due,
+    and `summaries' gives them when no updates are received.
+    """
+
+    def __init__(self, summary_interval=3600, max_conflicts=100000):
+        self.summary_interval = summary_interval
+        self.conflicts = LRUCache(max_conflicts, on_evict=self._evicted)
+        # keys of the conflicts, the least recently summarized first
+        self.schedule = OrderedDict()
+        # (prefix, peer_as, peer_ip) -> keys of the conflicts announced
+        self.peers = dict()
+        self.evicted = []
+
+    def _evicted(self, key, state):
+        """Close a conflict removed from the bounded storage."""
+
+        del self.schedule[key]
+        for peer_as, peer_ip in state.peers:
+            peer_key = (key[0], peer_as, peer_ip)
+            keys = self.peers.get(peer_key, None)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self.peers[peer_key]
+        event = self.event("end", key, state, state.last_seen)
+        event["reason"] = "evicted"
+        self.evicted.append(event)
+
+    def event(self, kind, key, state, timestamp):
+        """Prepare and return an ordered dictionary describing a conflict."""
+
+        prefix, conflict_prefix, asn, conflict_asn = key
+        tmp_announce = OrderedDict([("prefix", prefix),
+                                    ("asn", asn),
+                                    ("as_path", state.as_path)])
+        tmp_conflict_with = OrderedDict([("prefix", conflict_prefix),
+                                         ("asn", conflict_asn)])
+        return OrderedDict([("timestamp", timestamp),
+                            ("collector", state.collector),
+                            ("event", kind),
+                            ("announce", tmp_announce),
+                            ("conflict_with", tmp_conflict_with),
+                            ("asn", conflict_asn),
+                            ("peers", len(state.peers)),
+                            ("updates", state.updates),
+                            ("first_seen", state.first_seen),
+                            ("last_seen", state.last_seen)])
+
+    def process(self, update, conflicts):
+        """
+        Account the `conflicts' produced by `update' and return the records
+        that must be reported. `update' replaces the previous announce of
+        its peer for its prefix, a withdraw has no conflicting announce.
+        """
+
+        records = []
+        timestamp = float(update.timestamp)
+        peer = (update.peer_as, update.peer_ip)
+        peer_key = (update.prefix, update.peer_as, update.peer_ip)
+
+        keys = set()
+        for conflict in conflicts:
+            if "announce" not in conflict:
+                records.append(conflict)
+                continue
+
+            key = conflict_key(conflict)
+            keys.add(key)
+            state = self.conflicts.get(key)
+            if state is None:
+                state = ConflictState(update.collector,
+                                      conflict["announce"]["as_path"],
+                                      timestamp)
+                state.peers.add(peer)
+                self.conflicts[key] = state
+                self.schedule[key] = None
+                conflict["event"] = "start"
+                records.append(conflict)
+                continue
+
+            state.peers.add(peer)
+            state.updates += 1
+            state.last_seen = timestamp
+            state.as_path = conflict["announce"]["as_path"]
+
+        # The peer does not announce its previous conflicts anymore
+        previous_keys = self.peers.pop(peer_key, None)
+        if len(keys):
+            self.peers[peer_key] = keys
+        if previous_keys is not None:
+            for key in previous_keys - keys:
+                state = self.conflicts.peek(key)
+                if state is None:
+                    continue
+                state.peers.discard(peer)
+                if len(state.peers) == 0:
+                    del self.conflicts[key]
+                    del self.schedule[key]
+                    records.append(self.event("end", key, state, timestamp))
+
+        if len(self.evicted):
+            records += self.evicted
+            self.evicted = []
+
+        records += self.summaries(timestamp)
+        return records
+
+    def summaries(self, timestamp):
+        """
+        Return the "summary" records of the conflicts not summarized during
+        `summary_interval' seconds before `timestamp'.
+        """
+
+        records = []
+        while len(self.schedule):
+            key = next(iter(self.schedule))
+            state = self.conflicts.peek(key)
+            if timestamp - state.last_summary < self.summary_interval:
+                break
+            state.last_summary = timestamp
+            del self.schedule[key]
+            self.schedule[key] = None
+            records.append(self.event("summary", key, state, timestamp))
+        return records
+
+
+def aggregate_key(record):
+    """
+    Return the (victim ASN, hijacker ASN, prefix) tuple used to aggregate
+    a conflict record.
+    """
+    announce = record.get("announce", None)
+    if announce is None:
+        announce = record["withdraw"]
+    return (record["asn"], announce["asn"], announce["prefix"])
+
+
+class AggregateState(object):
+    """Conflicts counted for an aggregation key, one bucket per step."""
+
+    __slots__ = ("buckets", "first_seen", "last_seen")
+
+    def __init__(self, timestamp):
+        self.buckets = deque()
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+
+
+class ConflictAggregator(object):
+    """
+    Roll up conflict records per (victim ASN, hijacker ASN, prefix) over
+    time windows of `window' seconds, based on the records timestamps.
+
+    Windows are tumbling when `step' is None, otherwise a window ends every
+    `step' seconds (sliding windows). A summary is reported for each key seen
+    during a window, withdraws of conflicts are counted separately from the
+    conflicts. Keys without conflicts during `ttl' seconds are forgotten.
+    """
+
+    def __init__(self, window=60, step=None, ttl=None):
+        self.window = window
+        self.step = window if step is None else step
+        self.ttl = window if ttl is None else max(ttl, window)
+        self.keys = OrderedDict()
+        self.current = None
+
+    def add(self, record):
+        """Account `record' and return the summaries of closed windows."""
+
+        timestamp = float(record["timestamp"])
+        summaries = []
+        if self.current is None:
+            self.current = timestamp - timestamp % self.step
+        else:
+            summaries = self.tick(timestamp)
+
+        key = aggregate_key(record)
+        state = self.keys.pop(key, None)
+        if state is None:
+            state = AggregateState(timestamp)
+        self.keys[key] = state
+        state.last_seen = max(state.last_seen, timestamp)
+
+        # Late records are counted in the current bucket
+        if len(state.buckets) == 0 or state.buckets[-1][0] != self.current:
+            state.buckets.append([self.current, 0, 0, set()])
+        if "withdraw" in record:
+            state.buckets[-1][2] += 1
+        else:
+            state.buckets[-1][1] += 1
+        peer_as = record.get("peer_as", None)
+        if peer_as is not None:
+            state.buckets[-1][3].add((peer_as, record.get("peer_ip", None)))
+
+        return summaries
+
+    def tick(self, timestamp):
+        """Return the summaries of the windows closed at `timestamp'."""
+
+        if self.current is None:
+            return []
+        bucket = timestamp - timestamp % self.step
+        if bucket <= self.current:
+            return []
+        return self.advance(bucket)
+
+    def advance(self, bucket):
+        """Close the windows ending before `bucket' and return summaries."""
+
+        summaries = []
+        end = self.current + self.step
+        while end <= bucket and len(self.keys):
+            summaries += self.summaries(end)
+            end += self.step
+            # Skip the windows without any conflict
+            if not any(len(state.buckets)
+                       for state in self.keys.itervalues()):
+                break
+        self.expire(bucket)
+        self.current = bucket
+        return summaries
+
+    def expire(self, now):
+        """Forget the keys without conflicts during the last `ttl' seconds."""
+
+        # The least recently seen keys come first
+        while len(self.keys):
+            key, state = next(self.keys.iteritems())
+            if state.last_seen >= now - self.ttl:
+                break
+            del self.keys[key]
+
+    def flush(self):
+        """Return the summaries of the current window."""
+
+        if self.current is None:
+            return []
+        summaries = self.summaries(self.current + self.step)
+        self.keys.clear()
+        self.current = None
+        return summaries
+
+    def summaries(self, end):
+        """Return the summaries of the window ending at `end'."""
+
+        start = end - self.window
+        summaries = []
+        for key, state in self.keys.iteritems():
+            while len(state.buckets) and state.buckets[0][0] < start:
+                state.buckets.popleft()
+            conflicts = 0
+            withdraws = 0
+            peers = set()
+            for bucket_start, count, withdraw_count, bucket_peers in \
+                    state.buckets:
+                if bucket_start < end:
+                    conflicts += count
+                    withdraws += withdraw_count
+                    peers.update(bucket_peers)
+            if conflicts or withdraws:
+                summaries.append(self.summary(key, state, start, end,
+                                              conflicts, withdraws,
+                                              len(peers)))
+
+        return summaries
+
+    def summary(self, key, state, start, end, conflicts, withdraws, peers):
+        """Prepare and return an ordered dictionary summarizing a window."""
+
+        victim_asn, hijacker_asn, prefix = key
+        return OrderedDict([("timestamp", end),
+                            ("window_start", start),
+                            ("window_end", end),
+                            ("prefix", prefix),
+                            ("asn", victim_asn),
+                            ("hijacker_asn", hijacker_asn),
+                            ("conflicts", conflicts),
+                            ("withdraws", withdraws),
+                            ("peers", peers),
+                            ("first_seen", state.first_seen),
+                            ("last_seen", state.last_seen)])
+
+
+class PeerRate(object):
+    """Conflicting updates counted for a peer."""
+
+    __slots__ = ("window_start", "count", "storm")
+
+    def __init__(self, timestamp):
+        self.window_start = timestamp
+        self.count = 0
+        self.storm = None
+
+
+class PeerStorm(object):
+    """Information kept about a peer sending too many conflicting updates."""
+
+    __slots__ = ("collector", "first_seen", "last_seen", "updates",
+                 "suppressed")
+
+    def __init__(self, collector, timestamp, updates):
+        self.collector = collector
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.updates = updates
+        self.suppressed = 0
+
+
+class ConflictGuard(object):
+    """
+    Base class of the objects deciding if the conflicts of an update must be
+    reported. Notices about their decisions are kept in `events'. A guard
+    not implementing `account' and `is_suppressed' cannot be built.
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self):
+        self.events = []
+
+    @abc.abstractmethod
+    def account(self, update, conflicting):
+        """
+        Account an update, `conflicting' is True if it produced conflicts.
+        Return True if its conflicts must be suppressed.
+        """
+
+    @abc.abstractmethod
+    def is_suppressed(self, update):
+        """Return True if the conflicts of `update' are currently suppressed."""
+
+    def filter(self, update, conflicts):
+        """See `filter_conflicts'."""
+        return filter_conflicts(update, conflicts, [self])
+
+    def pop_events(self):
+        """Return and forget the notices to report."""
+
+        events = self.events
+        self.events = []
+        return events
+
+
+def filter_conflicts(update, conflicts, guards):
+    """
+    Return a (conflicting, conflicts) tuple: whether `update' is in conflict,
+    and the list of its `conflicts' that must be reported according to
+    `guards'. Suppressed conflicts are not enumerated.
+    """
+
+    conflicts = iter(conflicts)
+    first = next(conflicts, None)
+    conflicting = first is not None
+    suppressed = False
+    for guard in guards:
+        # Every guard must account the update
+        suppressed = guard.account(update, conflicting) or suppressed
+    if suppressed or not conflicting:
+        return conflicting, []
+    return True, [first] + list(conflicts)
+
+
+class PeerStormDetector(ConflictGuard):
+    """
+    Detect peers sending more than `threshold' conflicting updates in
+    `window' seconds, as during a full table leak.
+
+    The conflicts of a peer in storm are not reported. A "STORM" record is
+    reported when the storm starts, and another one with the number of
+    updates suppressed when the peer sends less than `threshold' conflicting
+    updates during a window. The updates of the other peers, or `expire',
+    end the storms of the peers that stopped sending updates.
+    """
+
+    def __init__(self, threshold=1000, window=60):
+        super(PeerStormDetector, self).__init__()
+        self.threshold = threshold
+        self.window = window
+        # (peer_as, peer_ip) -> PeerRate
+        self.peers = dict()
+        # (peer_as, peer_ip) -> PeerRate of the peers in storm
+        self.storms = dict()
+
+    def event(self, kind, peer, storm):
+        """Prepare and return an ordered dictionary describing a storm."""
+
+        peer_as, peer_ip = peer
+        return OrderedDict([("timestamp", storm.last_seen),
+                            ("collector", storm.collector),
+                            ("peer_as", peer_as),
+                            ("peer_ip", peer_ip),
+                            ("type", "STORM"),
+                            ("event", kind),
+                            ("updates", storm.updates),
+                            ("suppressed", storm.suppressed),
+                            ("first_seen", storm.first_seen),
+                            ("last_seen", storm.last_seen)])
+
+    def account(self, update, conflicting):
+        """
+        Account an update of a peer, `conflicting' is True if it produced
+        conflicts. Return True if its conflicts must be suppressed.
+        """
+
+        timestamp = float(update.timestamp)
+        if len(self.storms):
+            self.expire(timestamp)
+        peer = (update.peer_as, update.peer_ip)
+        rate = self.peers.get(peer, None)
+        if rate is None:
+            rate = self.peers[peer] = PeerRate(timestamp)
+
+        if timestamp - rate.window_start >= self.window:
+            if rate.storm is not None and rate.count < self.threshold:
+                self.end(peer, rate)
+            rate.window_start = timestamp
+            rate.count = 0
+
+        if not conflicting:
+            return False
+
+        rate.count += 1
+        storm = rate.storm
+        if storm is not None:
+            storm.updates += 1
+            storm.suppressed += 1
+            storm.last_seen = timestamp
+            return True
+
+        if rate.count > self.threshold:
+            rate.storm = PeerStorm(update.collector, timestamp, rate.count)
+            rate.storm.suppressed = 1
+            self.storms[peer] = rate
+            self.events.append(self.event("start", peer, rate.storm))
+            return True
+
+        return False
+
+    def end(self, peer, rate):
+        """End the storm of a peer."""
+
+        self.events.append(self.event("end", peer, rate.storm))
+        rate.storm = None
+        del self.storms[peer]
+
+    def expire(self, timestamp):
+        """
+        End the storms of the peers that sent less than `threshold'
+        conflicting updates during the last window before `timestamp'.
+        """
+
+        for peer, rate in self.storms.items():
+            elapsed = timestamp - rate.window_start
+            # The window of the storm ended, and the next one is empty
+            if elapsed >= 2 * self.window or \
+               (elapsed >= self.window and rate.count < self.threshold):
+                self.end(peer, rate)
+                rate.window_start = timestamp
+                rate.count = 0
+
+    def is_suppressed(self, update):
+        """Return True if the peer of `update' is in storm."""
+
+        rate = self.peers.get((update.peer_as, update.peer_ip), None)
+        return rate is not None and rate.storm is not None
+
+
+class FlapState(object):
+    """Damping information kept about a prefix."""
+
+    __slots__ = ("penalty", "last_update", "suppressed", "collector",
+                 "origins")
+
+    def __init__(self, collector, timestamp):
+        self.penalty = 0.0
+        self.last_update = timestamp
+        self.suppressed = None
+        self.collector = collector
+        # (peer_as, peer_ip) -> last origin announced
+        self.origins = dict()
+
+
+class FlapDamping(ConflictGuard):
+    """
+    Damp prefixes oscillating between origins, in the style of the RFC 2439
+    route flap damping.
+
+    Each conflicting update changing the origin announced by its peer for a
+    prefix adds `penalty' to the figure of merit of the prefix, which decays
+    exponentially with a `half_life' in seconds: a stable conflict seen by
+    many peers is not damped. The conflicts
+    of a prefix are suppressed once the figure of merit goes over
+    `suppress_limit', and reported again once it decays under `reuse_limit'.
+    It never goes over `max_penalty'. A "DAMPING" record is reported when a
+    prefix is suppressed and when it is reused.
+    At most `max_prefixes' prefixes are followed.
+    """
+
+    def __init__(self, penalty=1000, suppress_limit=2000, reuse_limit=750,
+                 half_life=900, max_penalty=12000, max_prefixes=100000):
+        super(FlapDamping, self).__init__()
+        self.penalty = penalty
+        self.suppress_limit = suppress_limit
+        self.reuse_limit = reuse_limit
+        self.half_life = half_life
+        self.max_penalty = max_penalty
+        self.prefixes = LRUCache(max_prefixes, on_evict=self._evicted)
+
+    def _evicted(self, prefix, state):
+        """Reuse a prefix removed from the bounded storage."""
+
+        if state.suppressed is not None:
+            event = self.event("reused", prefix, state, state.last_update)
+            event["reason"] = "evicted"
+            self.events.append(event)
+
+    def event(self, kind, prefix, state, timestamp):
+        """Prepare and return an ordered dictionary describing a prefix."""
+
+        return OrderedDict([("timestamp", timestamp),
+                            ("collector", state.collector),
+                            ("prefix", prefix),
+                            ("type", "DAMPING"),
+                            ("event", kind),
+                            ("penalty", int(state.penalty)),
+                            ("suppressed", state.suppressed or 0)])
+
+    def decay(self, state, timestamp):
+        """Decay the figure of merit of a prefix up to `timestamp'."""
+
+        elapsed = timestamp - state.last_update
+        if elapsed > 0:
+            state.penalty *= 2 ** (-elapsed / float(self.half_life))
+            state.last_update = timestamp
+
+    def account(self, update, conflicting):
+        """
+        Account an update of a prefix, `conflicting' is True if it produced
+        conflicts. Return True if its conflicts must be suppressed.
+        """
+
+        timestamp = float(update.timestamp)
+        prefix = update.prefix
+        state = self.prefixes.get(prefix)
+        if state is None:
+            if not conflicting:
+                return False
+            state = FlapState(update.collector, timestamp)
+            self.prefixes[prefix] = state
+
+        self.decay(state, timestamp)
+        if state.suppressed is not None and state.penalty < self.reuse_limit:
+            self.events.append(self.event("reused", prefix, state, timestamp))
+            state.suppressed = None
+
+        # The origin announced by the peer flips
+        peer = (update.peer_as, update.peer_ip)
+        previous = state.origins.get(peer, None)
+        flip = False
+        if update.origin is not None:
+            state.origins[peer] = update.origin
+            flip = previous is not None and previous != update.origin
+
+        if not conflicting:
+            return state.suppressed is not None
+
+        if flip:
+            state.penalty = min(state.penalty + self.penalty,
+                                self.max_penalty)
+        if state.suppressed is not None:
+            state.suppressed += 1
+            return True
+
+        if state.penalty > self.suppress_limit:
+            state.suppressed = 1
+            self.events.append(self.event("suppressed", prefix, state,
+                                          timestamp))
+            return True
+
+        return False
+
+    def is_suppressed(self, update):
+        """Return True if the conflicts of the prefix of `update' are damped."""
+
+        state = self.prefixes.peek(update.prefix)
+        return state is not None and state.suppressed is not None
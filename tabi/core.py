@@ -5,10 +5,16 @@
 import logging
 
 from itertools import chain
-from collections import namedtuple, OrderedDict
+from collections import namedtuple
+
+from tabi.helpers import CriticalException, as_prefix, node_prefix
+from tabi.records import record_type
 
 logger = logging.getLogger(__name__)
 
+# Conflicts of the updates that are not in conflict
+NO_CONFLICTS = ()
+
 InternalMessage = namedtuple("InternalMessage",
                              ["type",
                               "timestamp",
@@ -22,7 +28,31 @@ InternalMessage = namedtuple("InternalMessage",
 PeerInformation = namedtuple("PeerInformation",
                              ["peer_as", "peer_ip"])
 RouteInformation = namedtuple("RouteInformation",
-                              ["origin", "data"])
+                              ["origin", "as_path", "data"])
+
+# Output records
+AnnounceRecord = record_type("AnnounceRecord", ["prefix", "asn", "as_path"])
+DefaultRecord = record_type("DefaultRecord",
+                            ["timestamp", "collector", "peer_as", "peer_ip",
+                             "announce"])
+RouteRecord = record_type("RouteRecord",
+                          ["timestamp", "collector", "peer_as", "peer_ip",
+                           "type", "prefix", "as_path", "asn", "num_routes"])
+WithdrawRecord = record_type("WithdrawRecord",
+                             ["timestamp", "collector", "peer_as", "peer_ip",
+                              "type", "prefix", "asn", "num_routes"])
+UpdateRecord = record_type("UpdateRecord",
+                           ["type", "prefix", "asn", "as_path"])
+UpdateWithdrawRecord = record_type("UpdateWithdrawRecord",
+                                   ["type", "prefix", "asn"])
+ConflictWithRecord = record_type("ConflictWithRecord", ["prefix", "asn"])
+ConflictRecord = record_type("ConflictRecord",
+                             ["timestamp", "collector", "peer_as", "peer_ip",
+                              "announce", "conflict_with", "asn"])
+WithdrawConflictRecord = record_type("WithdrawConflictRecord",
+                                     ["timestamp", "collector", "peer_as",
+                                      "peer_ip", "withdraw", "conflict_with",
+                                      "asn"])
 
 
 def iter_origin(origin):
@@ -36,39 +66,34 @@ def iter_origin(origin):
             yield asn
 
 
+def is_default_route(update):
+    """Return True if the mask length of the prefix of `update' is lower than
+    8 bits.
+    """
+
+    try:
+        return as_prefix(update.prefix).length < 8
+    except CriticalException:
+        return False
+
+
 def default_route(update):
     """Function that handles the processing of UPDATEs containing
     the default prefixes (where mask length is lower than 8 bits).
     """
 
-    try:
-        _, masklen = update.prefix.split("/")
-        if int(masklen) < 8:
-            for asn in iter_origin(update.origin):
-                tmp_announce = OrderedDict([("prefix", update.prefix),
-                                            ("asn", asn),
-                                            ("as_path", update.as_path)])
-                default_info = OrderedDict([("timestamp", update.timestamp),
-                                            ("collector", update.collector),
-                                            ("peer_as", update.peer_as),
-                                            ("peer_ip", update.peer_ip),
-                                            ("announce", tmp_announce)])
-                yield default_info
-    except ValueError:
-        pass
+    if is_default_route(update):
+        for asn in iter_origin(update.origin):
+            tmp_announce = AnnounceRecord(update.prefix, asn, update.as_path)
+            yield DefaultRecord(update.timestamp, update.collector,
+                                update.peer_as, update.peer_ip, tmp_announce)
 
 
 def format_route(update, num_routes):
     for asn in iter_origin(update.origin):
-        yield OrderedDict([("timestamp", update.timestamp),
-                           ("collector", update.collector),
-                           ("peer_as", update.peer_as),
-                           ("peer_ip", update.peer_ip),
-                           ("type", update.type),
-                           ("prefix", update.prefix),
-                           ("as_path", update.as_path),
-                           ("asn", asn),
-                           ("num_routes", num_routes)])
+        yield RouteRecord(update.timestamp, update.collector, update.peer_as,
+                          update.peer_ip, update.type, update.prefix,
+                          update.as_path, asn, num_routes)
 
 
 def route(rib, update, data=None):
@@ -76,39 +101,46 @@ def route(rib, update, data=None):
 
     # Update the RIB with this route information
     peer_info = PeerInformation(update.peer_as, update.peer_ip)
-    route_info = RouteInformation(update.origin, data)
+    route_info = RouteInformation(update.origin, update.as_path, data)
     node = rib.update(update.prefix, peer_info, route_info)
     return format_route(update, len(node.data))
 
 
+def is_duplicate(rib, update):
+    """
+    Return True if `update' announces the same origin and AS_PATH as the
+    route already stored in the RIB for its peer.
+    """
+    peer = rib.peer(update.peer_as, update.peer_ip)
+    if peer is None:
+        return False
+    ri = rib.lookup(update.prefix, peer)
+    return ri is not None and ri.as_path == update.as_path \
+        and ri.origin == update.origin
+
+
 def format_hijack(update, origin, conflict_prefix, conflict_asn):
-    """Prepare and return an ordered dictionary, that could be
-    logged or manipulated.
+    """Prepare and return records, that could be
+    logged or manipulated like ordered dictionaries.
     """
 
-    tmp_conflict_with = OrderedDict([("prefix", conflict_prefix),
-                                     ("asn", conflict_asn)])
+    tmp_conflict_with = ConflictWithRecord(conflict_prefix, conflict_asn)
 
     for asn in iter_origin(origin):
         if update.as_path is None:
-            announce_key = "withdraw"
-            tmp_announce = OrderedDict([("type", update.type),
-                                        ("prefix", update.prefix),
-                                        ("asn", asn)])
+            tmp_withdraw = UpdateWithdrawRecord(update.type, update.prefix,
+                                                asn)
+            yield WithdrawConflictRecord(update.timestamp, update.collector,
+                                         update.peer_as, update.peer_ip,
+                                         tmp_withdraw, tmp_conflict_with,
+                                         conflict_asn)
         else:
-            announce_key = "announce"
-            tmp_announce = OrderedDict([("type", update.type),
-                                        ("prefix", update.prefix),
-                                        ("asn", asn),
-                                        ("as_path", update.as_path)])
-
-        yield OrderedDict([("timestamp", update.timestamp),
-                           ("collector", update.collector),
-                           ("peer_as", update.peer_as),
-                           ("peer_ip", update.peer_ip),
-                           (announce_key, tmp_announce),
-                           ("conflict_with", tmp_conflict_with),
-                           ("asn", conflict_asn)])
+            tmp_announce = UpdateRecord(update.type, update.prefix, asn,
+                                        update.as_path)
+            yield ConflictRecord(update.timestamp, update.collector,
+                                 update.peer_as, update.peer_ip,
+                                 tmp_announce, tmp_conflict_with,
+                                 conflict_asn)
 
 
 def same_origin(origin1, origin2):
@@ -147,26 +179,22 @@ def hijack(rib, update):
 
         # Find conflicting ASN origin
         tmp_origins = set()
-        for ri_origin, _ in node.data.itervalues():
-            if not same_origin(origin, ri_origin):
-                tmp_origins.update(iter_origin(ri_origin))
+        for ri in node.data.itervalues():
+            if not same_origin(origin, ri.origin):
+                tmp_origins.update(iter_origin(ri.origin))
 
         for asn in tmp_origins:
-            messages.append(format_hijack(update, origin, node.prefix, asn))
+            messages.append(format_hijack(update, origin,
+                                          node_prefix(node), asn))
 
     return chain.from_iterable(messages)
 
 
 def format_withdraw(withdraw, origin, num_routes):
     for asn in iter_origin(origin):
-        yield OrderedDict([("timestamp", withdraw.timestamp),
-                           ("collector", withdraw.collector),
-                           ("peer_as", withdraw.peer_as),
-                           ("peer_ip", withdraw.peer_ip),
-                           ("type", withdraw.type),
-                           ("prefix", withdraw.prefix),
-                           ("asn", asn),
-                           ("num_routes", num_routes)])
+        yield WithdrawRecord(withdraw.timestamp, withdraw.collector,
+                             withdraw.peer_as, withdraw.peer_ip,
+                             withdraw.type, withdraw.prefix, asn, num_routes)
 
 
 def withdraw(rib, withdraw):
@@ -184,3 +212,84 @@ def withdraw(rib, withdraw):
         if ri is not None:
             return format_withdraw(withdraw, ri.origin, num_routes)
     return []
+
+
+def process_update(rib, update, is_watched=None, data=None, routes=None):
+    """
+    Fused `hijack' then `withdraw' or `route' processing of an UPDATE or a
+    WITHDRAW. The nodes covering its prefix are searched once, they give the
+    conflicts and the node of the prefix, which is then modified.
+
+    Nothing is allocated for an update without conflicts when `routes' is
+    None and the route stored in the RIB does not change.
+
+    :param is_watched: Function returning True if the route of an update
+        without conflicts must be stored
+    :param data: Data stored with the route
+    :param routes: List where the route and withdraw records are added
+    :return: List of conflicts, NO_CONFLICTS if there are none, or None if
+        the update is a default route, which is not processed
+    """
+
+    prefix = as_prefix(update.prefix)
+    if prefix.length < 8:
+        return None
+
+    peer = rib.peer(update.peer_as, update.peer_ip)
+    nodes = rib.search_all_containing(prefix)
+    node = None
+    if len(nodes) and nodes[0].prefixlen == prefix.length:
+        node = nodes[0]
+
+    # Same prefix (first) then less specific hijacks, as in hijack()
+    conflicts = NO_CONFLICTS
+    origin = update.origin
+    for covering in nodes:
+        if origin is None:
+            # withdraw, see hijack()
+            ri = covering.data.get(peer, None)
+            if ri is None:
+                break
+            origin = ri.origin
+
+        tmp_origins = None
+        for ri in covering.data.itervalues():
+            if not same_origin(origin, ri.origin):
+                if tmp_origins is None:
+                    tmp_origins = set()
+                tmp_origins.update(iter_origin(ri.origin))
+
+        if tmp_origins is not None:
+            if conflicts is NO_CONFLICTS:
+                conflicts = []
+            for asn in tmp_origins:
+                conflicts.extend(format_hijack(update, origin,
+                                               node_prefix(covering), asn))
+
+    if update.as_path is None or update.origin is None:
+        # Withdrawal of routes
+        if node is not None:
+            ri = node.data.pop(peer, None)
+            num_routes = len(node.data)
+            if num_routes == 0:
+                rib.delete(prefix)
+            if ri is not None and routes is not None:
+                routes.extend(format_withdraw(update, ri.origin, num_routes))
+
+    elif len(conflicts) or is_watched is None or is_watched(update) is True:
+        ri = None
+        if node is not None:
+            ri = node.data.get(peer, None)
+        if ri is None or ri.origin != update.origin \
+                or ri.as_path != update.as_path or ri.data != data:
+            route_info = RouteInformation(update.origin, update.as_path, data)
+            if ri is not None:
+                node.data[peer] = route_info
+            else:
+                if peer is None:
+                    peer = PeerInformation(update.peer_as, update.peer_ip)
+                node = rib.update(prefix, peer, route_info)
+        if routes is not None:
+            routes.extend(format_route(update, len(node.data)))
+
+    return conflicts
@@ -3,46 +3,68 @@
 # This file is part of the tabi project licensed under the MIT license.
 
 import logging
+import threading
+import multiprocessing
 
-from functools import partial
-from itertools import chain
+from itertools import chain, islice
 from collections import deque
 
-from tabi.rib import EmulatedRIB, Radix
-from tabi.core import default_route, route, withdraw, hijack
+from tabi.rib import EmulatedRIB
+from tabi.core import default_route, is_default_route, is_duplicate, route, \
+    process_update
 from tabi.input.mabo import mabo_format
-from tabi.annotate import annotate_if_relation, annotate_if_route_objects, \
-    annotate_if_roa, annotate_if_direct, annotate_with_type, \
-    fill_relation_struct, fill_ro_struct, fill_roa_struct
+from tabi.annotate import AnnotationContext
+from tabi.conflicts import NOTICE_TYPES, filter_conflicts
 from tabi.helpers import default_opener
 
 
 logger = logging.getLogger(__name__)
 
+# AnnotationContext of the annotation processes, inherited when they are
+# forked, and number of RTR changes they applied since
+pool_context = None
+pool_rtr_changes = 0
 
-def process_message(rib, collector, message, is_watched=None, data=None):
+
+def process_message(rib, collector, message, is_watched=None, data=None,
+                    suppress_duplicates=False, storm_detector=None,
+                    flap_damping=None):
     """
     Modify the RIB according to the BGP `message'.
+
+    If `suppress_duplicates' is True, an announce identical to the route
+    already stored for its peer (same origin and AS_PATH) does not produce
+    routes, and only produces the conflicts that were not reported for the
+    previous announce, e.g. with a covering prefix announced since.
+    If `storm_detector' is a PeerStormDetector, the conflicts of the peers
+    in storm are not returned. If `flap_damping' is a FlapDamping, the
+    conflicts of the damped prefixes are not returned.
     """
-    default = list(default_route(message))
-    if len(default) > 0:
+    if is_default_route(message):
         # XXX replace with a filter function
         # we ignore default routes
-        return default, [], []
-
-    conflicts = list(hijack(rib, message))
-    if message.as_path is None or message.origin is None:
-        routes = withdraw(rib, message)
-    elif len(conflicts) > 0 \
-            or is_watched is None or is_watched(message) is True:
-        routes = route(rib, message, data)
-    else:
-        routes = []
-    return default, routes, conflicts
+        return list(default_route(message)), [], []
+
+    duplicate = suppress_duplicates and message.as_path is not None \
+        and is_duplicate(rib, message)
+
+    routes = []
+    conflicts = process_update(rib, message, is_watched, data,
+                               None if duplicate else routes)
+    if suppress_duplicates and message.as_path is not None:
+        conflicts = rib.reported.new_conflicts(message, conflicts, duplicate)
+    guards = [guard for guard in (storm_detector, flap_damping)
+              if guard is not None]
+    if len(guards) > 0:
+        _, conflicts = filter_conflicts(message, conflicts, guards)
+    return [], routes, list(conflicts)
 
 
 def detect_conflicts(collector, files, opener=default_opener,
-                     format=mabo_format, is_watched=None):
+                     format=mabo_format, is_watched=None,
+                     suppress_duplicates=False, conflict_tracker=None,
+                     storm_detector=None, flap_damping=None,
+                     rib_backend=None):
     """
     Get a list of conflicts (hijacks without annotation) from the BGP files
     (bviews and updates).
@@ -52,10 +74,22 @@ def detect_conflicts(collector, files, opener=default_opener,
     :param opener: Function to use in order to open the files
     :param format: Format of the BGP data in the files
     :param is_watched: Function returning True if the BGP update must be followed
+    :param suppress_duplicates: Only report the new conflicts of announces
+        identical to the stored route
+    :param conflict_tracker: ConflictTracker used to report the conflicts
+        lifecycle instead of a conflict per update, it also tracks the
+        conflicts suppressed by the storm detector or the flap damping
+    :param storm_detector: PeerStormDetector used to summarize the conflicts
+        of the peers sending too many conflicting updates
+    :param flap_damping: FlapDamping used to suppress the conflicts of the
+        prefixes oscillating between origins
+    :param rib_backend: Backend of the RIB, see `tabi.backends.new_tree'
     :return: Generator of conflicts
     """
-    rib = EmulatedRIB()
+    rib = EmulatedRIB(rib_backend)
     queue = deque(files)
+    guards = [guard for guard in (storm_detector, flap_damping)
+              if guard is not None]
 
     # insert initial bview in the RIB
     bviews = []
@@ -67,7 +101,7 @@ def detect_conflicts(collector, files, opener=default_opener,
                     for msg in format(collector, data):
                         if msg.type != "F":
                             raise ValueError
-                        if len(list(default_route(msg))) > 0:
+                        if is_default_route(msg):
                             logger.warning("got a default route %s", msg)
                             continue
                         if is_watched is None or is_watched(msg):
@@ -87,24 +121,192 @@ def detect_conflicts(collector, files, opener=default_opener,
         with opener(file) as f:
             for data in f:
                 for msg in format(collector, data):
-                    default, _, conflicts = process_message(
-                        rib, collector, msg, is_watched)
-                    if len(default) > 0:
+                    duplicate = suppress_duplicates and \
+                        msg.as_path is not None and is_duplicate(rib, msg)
+                    # Fast path: nothing is allocated for updates without
+                    # conflicts
+                    conflicts = process_update(rib, msg, is_watched)
+                    if conflicts is None:
                         logger.warning("got a default route %s", msg)
+                        continue
+                    # The tracker needs every conflict of the update, a
+                    # missing one has ended
+                    tracked = conflicts
+                    if suppress_duplicates and msg.as_path is not None:
+                        conflicts = rib.reported.new_conflicts(msg,
+                                                               conflicts,
+                                                               duplicate)
+                    suppressed = False
+                    if len(guards) > 0:
+                        _, reported = filter_conflicts(msg, conflicts, guards)
+                        for guard in guards:
+                            for event in guard.pop_events():
+                                yield event
+                            suppressed = suppressed or \
+                                guard.is_suppressed(msg)
+                        if conflict_tracker is None:
+                            conflicts = reported
+                    if conflict_tracker is not None:
+                        # Suppressed conflicts are still tracked, only their
+                        # start is not reported
+                        conflicts = conflict_tracker.process(msg, tracked)
+                        if suppressed:
+                            conflicts = [conflict for conflict in conflicts
+                                         if conflict.get("event") != "start"]
+                    elif suppressed:
+                        continue
                     for conflict in conflicts:
                         yield conflict
 
 
+def annotate_conflict(context, conflict):
+    """Annotate `conflict' with `context', notices are not annotated."""
+
+    if conflict.get("type", None) in NOTICE_TYPES:
+        return conflict
+    return context.annotate(conflict)
+
+
+def annotate_batch(conflicts, rtr_changes=()):
+    """
+    Annotate a batch of conflicts in an annotation process, after applying
+    the `rtr_changes' fetched since the fork that were not applied yet.
+    Return the conflicts, and the cache hits and misses of the batch.
+    """
+
+    global pool_rtr_changes
+    if len(rtr_changes) > pool_rtr_changes:
+        pool_context.rtr_changes.extend(rtr_changes[pool_rtr_changes:])
+        pool_context.apply_rtr()
+        pool_rtr_changes = len(rtr_changes)
+
+    hits, misses = pool_context.hits, pool_context.misses
+    conflicts = [annotate_conflict(pool_context, conflict)
+                 for conflict in conflicts]
+    return (conflicts, pool_context.hits - hits,
+            pool_context.misses - misses)
+
+
+def init_annotation_process():
+    """Forget the state of the threads of the parent process."""
+
+    global pool_rtr_changes
+    pool_rtr_changes = 0
+    pool_context.lock = threading.Lock()
+    pool_context.build_lock = threading.Lock()
+    pool_context.thread = None
+    pool_context.rtr_changes = deque()
+
+
+def fork_annotation_pool(context, processes):
+    """
+    Fork a pool of `processes' annotating with `context': its metadata is
+    shared copy-on-write with the processes.
+    """
+
+    global pool_context
+    pool_context = context
+    return multiprocessing.Pool(processes, init_annotation_process)
+
+
+def annotate_parallel(context, conflicts, processes, batch_size=1000,
+                      max_batches=None):
+    """
+    Annotate `conflicts' in batches with a pool of `processes', and yield
+    them in their original order.
+
+    `conflicts' keeps being consumed, and the RIB updated, while at most
+    `max_batches' batches are annotated. The pool is forked again when the
+    metadata of `context' is reloaded. The ROA changes fetched from an RTR
+    cache are sent with each batch instead, until there are more than
+    `batch_size' of them. The cache statistics of the processes are added
+    to those of `context'.
+
+    :param context: AnnotationContext where the metadata is loaded
+    :param conflicts: iterable of conflicts and notices
+    :param processes: Number of annotation processes
+    :param batch_size: Number of conflicts sent at once to a process
+    :param max_batches: Number of batches annotated at the same time, twice
+        the number of processes by default
+    :return: Generator of annotated conflicts
+    """
+
+    if max_batches is None:
+        max_batches = 2 * processes
+
+    def results(result):
+        conflicts, hits, misses = result.get()
+        context.old_hits += hits
+        context.old_misses += misses
+        return conflicts
+
+    conflicts = iter(conflicts)
+    pending = deque()
+    structures = context.snapshot.structures()
+    # RTR changes applied since the fork, and their number of ROA
+    rtr_changes = ()
+    rtr_roas = 0
+    pool = fork_annotation_pool(context, processes)
+    try:
+        while True:
+            batch = list(islice(conflicts, batch_size))
+            if not batch:
+                break
+
+            # Changes fetched from an RTR cache are applied between batches
+            if len(context.rtr_changes):
+                applied = context.apply_rtr()
+                rtr_changes += tuple(applied)
+                rtr_roas += sum(len(changes) for _, changes in applied)
+            if context.snapshot.structures() != structures or \
+               rtr_roas > batch_size:
+                # Batches still pending use the old metadata
+                while pending:
+                    for conflict in results(pending.popleft()):
+                        yield conflict
+                pool.close()
+                pool.join()
+                structures = context.snapshot.structures()
+                rtr_changes = ()
+                rtr_roas = 0
+                pool = fork_annotation_pool(context, processes)
+
+            pending.append(pool.apply_async(annotate_batch,
+                                            (batch, rtr_changes)))
+            while pending and (len(pending) >= max_batches or
+                               pending[0].ready()):
+                for conflict in results(pending.popleft()):
+                    yield conflict
+
+        while pending:
+            for conflict in results(pending.popleft()):
+                yield conflict
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+
+
 def detect_hijacks(collector, files,
                    irr_org_file=None,
                    irr_mnt_file=None,
                    irr_ro_file=None,
                    rpki_roa_file=None,
                    opener=default_opener,
-                   format=mabo_format, is_watched=None):
+                   format=mabo_format, is_watched=None,
+                   suppress_duplicates=False, conflict_tracker=None,
+                   storm_detector=None, flap_damping=None,
+                   full_annotation=False, index=None, context=None,
+                   reload_interval=None, rtr_cache=None,
+                   irr_rpsl_files=None, annotation_processes=None,
+                   annotation_batch=1000, rib_backend=None):
     """
     Detect BGP hijacks from `files' and annotate them using metadata.
 
+    By default, the annotations are computed in the precedence order of the
+    type they lead to, and only until the type is decided. With
+    `full_annotation', every annotation is computed.
+
     :param collector: Name of the collector the BGP files come from
     :param files: List of BGP files to process
     :param irr_org_file: CSV file containing irr,organisation,asn
@@ -113,33 +315,77 @@ def detect_hijacks(collector, files,
     :param rpki_roa_file: CSV file containing asn,prefix,max_length,valid
     :param opener: Function to use in order to open the files
     :param format: Format of the BGP data in the files
+    :param suppress_duplicates: Only report the new conflicts of announces
+        identical to the stored route
+    :param conflict_tracker: ConflictTracker used to report the conflicts
+        lifecycle instead of a conflict per update, it also tracks the
+        conflicts suppressed by the storm detector or the flap damping
+    :param storm_detector: PeerStormDetector used to summarize the conflicts
+        of the peers sending too many conflicting updates
+    :param flap_damping: FlapDamping used to suppress the conflicts of the
+        prefixes oscillating between origins
+    :param full_annotation: Compute every annotation of the conflicts
+    :param index: Directory of the metadata compiled with
+        `tabi.index.compile_index', used instead of the CSV files
+    :param context: AnnotationContext where the metadata is loaded, e.g. to
+        request reloads from outside
+    :param reload_interval: Seconds between two checks of the metadata
+        files, modified files are reloaded without pausing the detection
+    :param rtr_cache: (host, port) of an RTR cache providing the ROA instead
+        of `rpki_roa_file', kept up to date every `reload_interval' seconds
+    :param irr_rpsl_files: List of RPSL dumps, possibly gzipped, providing
+        the route objects and relations instead of the CSV files
+    :param annotation_processes: Number of processes annotating the
+        conflicts while the RIB is updated, annotation is done inline if None
+    :param annotation_batch: Number of conflicts annotated at once by a
+        process
+    :param rib_backend: Backend of the RIB, see `tabi.backends.new_tree'
     :return: Generator of hijacks (conflicts with annotation)
     """
 
     logger.info("loading metadata...")
-    funcs = [annotate_if_direct]
+    if context is None:
+        context = AnnotationContext(full_annotation=full_annotation)
+    if index is not None:
+        context.load_index(index)
+
+    if irr_rpsl_files:
+        context.load_rpsl(*irr_rpsl_files)
+
     if irr_org_file is not None and irr_mnt_file is not None:
-        relations_dict = dict()
-        fill_relation_struct(irr_org_file, relations_dict,
-                             "organisations")
-        fill_relation_struct(irr_mnt_file, relations_dict, "maintainers")
-        funcs.append(partial(annotate_if_relation, relations_dict))
+        context.load_relations(irr_org_file, irr_mnt_file)
 
     if irr_ro_file is not None:
-        ro_rad_tree = Radix()
-        fill_ro_struct(irr_ro_file, ro_rad_tree)
-        funcs.append(partial(annotate_if_route_objects, ro_rad_tree))
+        context.load_route_objects(irr_ro_file)
 
     if rpki_roa_file is not None:
-        roa_rad_tree = Radix()
-        fill_roa_struct(rpki_roa_file, roa_rad_tree)
-        funcs.append(partial(annotate_if_roa, roa_rad_tree))
+        context.load_roas(rpki_roa_file)
+
+    if rtr_cache is not None:
+        context.load_rtr(*rtr_cache)
+
+    if reload_interval is not None:
+        context.watch(reload_interval)
 
-    funcs.append(annotate_with_type)
     logger.info("starting hijacks detection...")
-    for conflict in detect_conflicts(collector, files,
-                                     opener=opener, format=format,
-                                     is_watched=is_watched):
-        for f in funcs:
-            f(conflict)
-        yield conflict
+    conflicts = detect_conflicts(
+        collector, files, opener=opener, format=format,
+        is_watched=is_watched,
+        suppress_duplicates=suppress_duplicates,
+        conflict_tracker=conflict_tracker,
+        storm_detector=storm_detector, flap_damping=flap_damping,
+        rib_backend=rib_backend)
+    if annotation_processes is not None:
+        conflicts = annotate_parallel(context, conflicts,
+                                      annotation_processes, annotation_batch)
+    else:
+        conflicts = (annotate_conflict(context, conflict)
+                     for conflict in conflicts)
+    try:
+        for conflict in conflicts:
+            yield conflict
+    finally:
+        if reload_interval is not None:
+            context.stop()
+    logger.info("annotation cache: %d hits, %d misses",
+                context.hits, context.misses)
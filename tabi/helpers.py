@@ -15,6 +15,7 @@ import contextlib
 import subprocess
 
 from gzip import GzipFile
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +38,22 @@ def default_opener(f):
         yield f
 
 
+@contextlib.contextmanager
+def compressed_opener(f):
+    """
+    Open `f' like default_opener, decompressing it if its name ends with .gz.
+    """
+    if isinstance(f, basestring) and f.endswith(".gz"):
+        g = GzipFile(f, "r")
+        try:
+            yield g
+        finally:
+            g.close()
+    else:
+        with default_opener(f) as g:
+            yield g
+
+
 def gunzip_fork(filename, output):
     """
     Call gunzip.
@@ -190,9 +207,16 @@ def critical_error(message):
 
 
 def check_python_radix():
-    """Check if py-radix is ok."""
+    """
+    Check if py-radix is ok. Return the RIB backend used by default:
+    "radix", or "hashed" if py-radix is not installed.
+    """
 
-    import radix
+    try:
+        import radix
+    except ImportError:
+        # The pure-Python backend is used instead, e.g. under PyPy
+        return "hashed"
 
     # Check if search_best() is patched
     r = radix.Radix()
@@ -222,6 +246,8 @@ def check_python_radix():
         message += "  Please upgrade py-radix."
         raise CriticalException(message)
 
+    return "radix"
+
 
 def get_packed_addr(prefix_arg, plen=None):
     """Return the binary representation of a prefix."""
@@ -271,6 +297,63 @@ def get_packed_addr(prefix_arg, plen=None):
                                 IP prefix !" % prefix_arg)
 
 
+def mask_packed(packed, length):
+    """Return the packed address `packed' with the bits after `length' unset."""
+
+    full, bits = divmod(length, 8)
+    if full >= len(packed):
+        return packed
+    zeros = "\x00" * (len(packed) - full - 1)
+    if bits:
+        last = chr(ord(packed[full]) & (0xff00 >> bits) & 0xff)
+        return packed[:full] + last + zeros
+    return packed[:full] + "\x00" + zeros
+
+
+class Prefix(str):
+    """
+    IP prefix parsed once: the string value is the prefix text used for
+    output, `packed' and `length' are its binary representation, the host
+    bits unset like in py-radix.
+
+    Python 2 does not support __slots__ in subclasses of str, so only the
+    `packed' and `length' attributes are stored.
+    """
+
+    def __new__(cls, prefix, packed=None, length=None):
+        self = str.__new__(cls, prefix)
+        if packed is None:
+            if "/" in prefix:
+                packed, length = get_packed_addr(prefix)
+            else:
+                # a single address, as accepted by py-radix
+                packed, length = get_packed_addr(prefix,
+                                                 128 if ":" in prefix else 32)
+            packed = mask_packed(packed, length)
+        self.packed = packed
+        self.length = length
+        return self
+
+    @property
+    def family(self):
+        return socket.AF_INET if len(self.packed) == 4 else socket.AF_INET6
+
+    def __reduce__(self):
+        return (Prefix, (str(self), self.packed, self.length))
+
+
+def as_prefix(prefix):
+    """Return `prefix' as a Prefix object, parsing it if needed."""
+    if isinstance(prefix, Prefix):
+        return prefix
+    return Prefix(prefix)
+
+
+def node_prefix(node):
+    """Return the Prefix of a radix node without parsing its text."""
+    return Prefix(node.prefix, node.packed, node.prefixlen)
+
+
 def get_as_origin(as_path):
     """Extract the origin AS from an AS_PATH and return a list."""
 
@@ -327,3 +410,68 @@ def get_as_origin(as_path):
     else:
         raise CriticalException("get_as_origin(): invalid "
                                 "AS_PATH %s !" % as_path)
+
+
+class LRUCache(object):
+    """
+    Mapping holding at most `maxsize' entries. When full, the least recently
+    used entry is evicted and given to the optional `on_evict' callback.
+    """
+
+    def __init__(self, maxsize=None, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Return the value of `key' and mark it as recently used."""
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        if self.maxsize is not None:
+            while len(self.entries) > self.maxsize:
+                old_key, old_value = self.entries.popitem(last=False)
+                if self.on_evict is not None:
+                    self.on_evict(old_key, old_value)
+
+    def __delitem__(self, key):
+        del self.entries[key]
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def pop(self, key, default=None):
+        return self.entries.pop(key, default)
+
+    def peek(self, key, default=None):
+        """Return the value of `key' without updating the statistics."""
+        return self.entries.get(key, default)
+
+    def iteritems(self):
+        return self.entries.iteritems()
+
+    def clear(self):
+        self.entries.clear()
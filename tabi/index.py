@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 ANSSI
+# This file is part of the tabi project licensed under the MIT license.
+
+# Compiled annotation metadata
+#
+# ROAs, route objects and relations are compiled once into a directory of
+# NumPy arrays. Loading memory-maps the arrays: it is almost instant and the
+# pages are shared by every process using the same index.
+
+import os
+import json
+import socket
+import struct
+
+from collections import namedtuple
+
+import numpy
+
+from tabi.annotate import RelationIndex, fill_relation_struct
+from tabi.helpers import default_opener, as_prefix
+from tabi.validator import FAMILY_WIDTHS, MASKS, OriginValidator
+
+FAMILY_NAMES = {socket.AF_INET: "ipv4", socket.AF_INET6: "ipv6"}
+
+# Order of the relation kinds in the relation groups array
+RELATION_KINDS = ("org", "contact", "mnt")
+
+MappedNode = namedtuple("MappedNode",
+                        ["prefix", "prefixlen", "packed", "family", "data"])
+
+
+def array_path(path, *names):
+    """Return the filename of an array of the index stored in `path'."""
+    return os.path.join(path, "%s.npy" % ".".join(names))
+
+
+def write_origin_table(path, name, table):
+    """
+    Write an OriginTable: per address family, the keys and values of every
+    prefix length are concatenated, offsets[length] is the position of the
+    first entry of `length'.
+    """
+
+    for family, width in FAMILY_WIDTHS.iteritems():
+        keys = [numpy.zeros(0, dtype="S%d" % (width + 4))]
+        values = [numpy.zeros(0, dtype=numpy.int64)]
+        offsets = [0]
+        for length in range(8 * width + 1):
+            arrays = table.arrays.get((family, length), None)
+            if arrays is not None:
+                keys.append(arrays[0])
+                values.append(arrays[1])
+                offsets.append(offsets[-1] + len(arrays[0]))
+            else:
+                offsets.append(offsets[-1])
+        family_name = FAMILY_NAMES[family]
+        numpy.save(array_path(path, name, family_name, "keys"),
+                   numpy.concatenate(keys))
+        numpy.save(array_path(path, name, family_name, "values"),
+                   numpy.concatenate(values))
+        numpy.save(array_path(path, name, family_name, "offsets"),
+                   numpy.array(offsets, dtype=numpy.int64))
+
+
+def write_relations(path, relation_index):
+    """
+    Write a RelationIndex: the sorted ASN, their groups as indexes of sets,
+    and the sets of ids stored one after the other.
+    """
+
+    sets = dict()
+    sets_offsets = [0]
+    sets_ids = []
+
+    def set_index(ids):
+        index = sets.get(ids, None)
+        if index is None:
+            index = sets[ids] = len(sets)
+            sets_ids.extend(sorted(ids))
+            sets_offsets.append(len(sets_ids))
+        return index
+
+    asns = sorted(relation_index.groups)
+    groups = numpy.zeros((len(asns), len(RELATION_KINDS)), dtype=numpy.int32)
+    for row, asn in enumerate(asns):
+        groups[row] = [set_index(ids) for ids in relation_index.groups[asn]]
+
+    numpy.save(array_path(path, "relations", "asns"),
+               numpy.array(asns, dtype=numpy.int64))
+    numpy.save(array_path(path, "relations", "groups"), groups)
+    numpy.save(array_path(path, "relations", "offsets"),
+               numpy.array(sets_offsets, dtype=numpy.int64))
+    numpy.save(array_path(path, "relations", "ids"),
+               numpy.array(sets_ids, dtype=numpy.int64))
+
+
+def compile_index(path, irr_ro_file=None, rpki_roa_file=None,
+                  irr_org_file=None, irr_mnt_file=None,
+                  opener=default_opener):
+    """
+    Compile the annotation metadata into the directory `path'.
+
+    :param path: Directory where the index is written
+    :param irr_ro_file: CSV file containing irr,prefix,asn
+    :param rpki_roa_file: CSV file containing asn,prefix,max_length,valid
+    :param irr_org_file: CSV file containing irr,organisation,asn
+    :param irr_mnt_file: CSV file containing irr,maintainer,asn
+    :param opener: Function to use in order to open the files
+    :return: Nothing
+    """
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    validator = OriginValidator()
+    if rpki_roa_file is not None:
+        validator.load_roas(rpki_roa_file, opener)
+        write_origin_table(path, "roas", validator.roas)
+
+    if irr_ro_file is not None:
+        validator.load_route_objects(irr_ro_file, opener)
+        write_origin_table(path, "route_objects", validator.route_objects)
+        with open(os.path.join(path, "bases.json"), "w") as bases_file:
+            json.dump([sorted(bases) for bases in validator.bases],
+                      bases_file)
+
+    if irr_org_file is not None and irr_mnt_file is not None:
+        relations_dict = dict()
+        fill_relation_struct(irr_org_file, relations_dict, "organisations",
+                             opener)
+        fill_relation_struct(irr_mnt_file, relations_dict, "maintainers",
+                             opener)
+        write_relations(path, RelationIndex(relations_dict))
+
+
+class MappedOriginTable(object):
+    """
+    Memory-mapped OriginTable providing the `search_covering' method of
+    radix trees used by the annotation functions. The data of a node maps an
+    ASN to its value, transformed with `decode' if given.
+    """
+
+    def __init__(self, path, name, decode=None):
+        self.decode = decode
+        self.families = dict()
+        for family, family_name in FAMILY_NAMES.iteritems():
+            offsets = numpy.load(array_path(path, name, family_name,
+                                            "offsets"))
+            lengths = [length for length in range(len(offsets) - 1)
+                       if offsets[length + 1] > offsets[length]]
+            self.families[family] = (
+                numpy.load(array_path(path, name, family_name, "keys"),
+                           mmap_mode="r"),
+                numpy.load(array_path(path, name, family_name, "values"),
+                           mmap_mode="r"),
+                offsets, lengths)
+
+    def search_covering(self, network=None, masklen=None, packed=None):
+        """Return the nodes covering a prefix, the most specific first."""
+
+        if packed is None:
+            if masklen is not None:
+                network = "%s/%s" % (network, masklen)
+            prefix = as_prefix(network)
+            packed, masklen = prefix.packed, prefix.length
+        family = socket.AF_INET if len(packed) == 4 else socket.AF_INET6
+        keys, values, offsets, lengths = self.families[family]
+        width = len(packed)
+        address = numpy.frombuffer(packed, dtype=numpy.uint8)
+
+        nodes = []
+        for length in reversed(lengths):
+            if length > masklen:
+                continue
+            network = (address & MASKS[family][length]).tostring()
+            start, end = offsets[length], offsets[length + 1]
+            segment = keys[start:end]
+            first = numpy.searchsorted(segment, network + "\x00" * 4, "left")
+            last = numpy.searchsorted(segment, network + "\xff" * 4, "right")
+            if first == last:
+                continue
+            data = dict()
+            for position in range(first, last):
+                key = str(segment[position]).ljust(width + 4, "\x00")
+                value = int(values[start + position])
+                if self.decode is not None:
+                    value = self.decode(value)
+                data[struct.unpack(">I", key[width:])[0]] = value
+            prefix = "%s/%d" % (socket.inet_ntop(family, network), length)
+            nodes.append(MappedNode(prefix, length, network, family, data))
+        return nodes
+
+
+class MappedRelationIndex(object):
+    """Memory-mapped RelationIndex."""
+
+    def __init__(self, path):
+        self.asns = numpy.load(array_path(path, "relations", "asns"),
+                               mmap_mode="r")
+        self.groups = numpy.load(array_path(path, "relations", "groups"),
+                                 mmap_mode="r")
+        self.offsets = numpy.load(array_path(path, "relations", "offsets"),
+                                  mmap_mode="r")
+        self.ids = numpy.load(array_path(path, "relations", "ids"),
+                              mmap_mode="r")
+
+    def find(self, asn):
+        """Return the row of `asn' in the groups array, or None."""
+
+        row = numpy.searchsorted(self.asns, asn)
+        if row < len(self.asns) and self.asns[row] == asn:
+            return row
+        return None
+
+    def relations(self, as1, as2):
+        """Return the list of relations between `as1' and `as2'."""
+
+        relations = list()
+        row1 = self.find(as1)
+        row2 = self.find(as2)
+        if row1 is None or row2 is None:
+            return relations
+        for kind, set1, set2 in zip(RELATION_KINDS, self.groups[row1],
+                                    self.groups[row2]):
+            ids1 = self.ids[self.offsets[set1]:self.offsets[set1 + 1]]
+            if len(ids1) == 0:
+                continue
+            if set1 == set2 or not set(ids1.tolist()).isdisjoint(
+                    self.ids[self.offsets[set2]:self.offsets[set2 + 1]]
+                    .tolist()):
+                relations.append(kind)
+        return relations
+
+
+class MappedIndex(object):
+    """
+    Annotation metadata loaded from a compiled index, a structure is None if
+    it was not compiled.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        self.roas = None
+        if os.path.exists(array_path(path, "roas", "ipv4", "keys")):
+            self.roas = MappedOriginTable(path, "roas")
+
+        self.route_objects = None
+        if os.path.exists(array_path(path, "route_objects", "ipv4", "keys")):
+            with open(os.path.join(path, "bases.json")) as bases_file:
+                bases = [set(irrs) for irrs in json.load(bases_file)]
+            self.route_objects = MappedOriginTable(path, "route_objects",
+                                                   bases.__getitem__)
+
+        self.relation_index = None
+        if os.path.exists(array_path(path, "relations", "asns")):
+            self.relation_index = MappedRelationIndex(path)
+
+
+def load_index(path):
+    """Return the MappedIndex compiled in the directory `path'."""
+    return MappedIndex(path)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Compile annotation metadata into an index")
+    parser.add_argument("index", help="directory where the index is written")
+    parser.add_argument("--irr-ro-file",
+                        help="CSV file containing IRR route objects")
+    parser.add_argument("--irr-mnt-file",
+                        help="CSV file containing IRR maintainer objects")
+    parser.add_argument("--irr-org-file",
+                        help="CSV file containing IRR organisation objects")
+    parser.add_argument("--rpki-roa-file",
+                        help="CSV file containing ROA")
+    args = parser.parse_args()
+
+    compile_index(args.index, irr_ro_file=args.irr_ro_file,
+                  rpki_roa_file=args.rpki_roa_file,
+                  irr_org_file=args.irr_org_file,
+                  irr_mnt_file=args.irr_mnt_file)
+
+
+if __name__ == "__main__":
+    main()
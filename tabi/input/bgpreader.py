@@ -10,8 +10,9 @@ import subprocess
 from contextlib import contextmanager
 
 from tabi.core import InternalMessage
-from tabi.helpers import check_ris_filenames, get_as_origin, \
-    critical_error, process_iterator, gzip_opener
+from tabi.aspath import intern_as_path
+from tabi.helpers import check_ris_filenames, \
+    critical_error, process_iterator, gzip_opener, Prefix, CriticalException
 
 logger = logging.getLogger(__name__)
 
@@ -23,20 +24,24 @@ def bgpreader_format_bview(collector, data):
     as_path = data[8]
     if len(as_path) > 0:
         try:
-            origin = frozenset(get_as_origin(as_path))
+            path = intern_as_path(as_path)
         except:
             logger.warning("invalid AS_PATH %s", as_path)
         else:
-            if len(origin) == 1:
-                origin = iter(origin).next()
+            origin = path.origin
+            try:
+                prefix = Prefix(data[6])
+            except CriticalException:
+                logger.warning("invalid prefix %s", data[6])
+                return
             yield InternalMessage("F",
                                   data[1],
                                   data[3],
                                   int(data[4]),
                                   data[5],
-                                  data[6],
+                                  prefix,
                                   origin,
-                                  as_path)
+                                  path.path)
 
 
 def bgpreader_format_update(collector, data):
@@ -44,32 +49,41 @@ def bgpreader_format_update(collector, data):
     Transform an bgpreader update message to the internal representation.
     """
     if data[0] == "W":
+        try:
+            prefix = Prefix(data[6])
+        except CriticalException:
+            logger.warning("invalid prefix %s", data[6])
+            return
         yield InternalMessage("W",
                               data[1],
                               data[3],
                               int(data[4]),
                               data[5],
-                              data[6],
+                              prefix,
                               None,
                               None)
     elif data[0] == "A":
         as_path = data[8]
         if len(as_path) > 0:
             try:
-                origin = frozenset(get_as_origin(as_path))
+                path = intern_as_path(as_path)
             except:
                 logger.warning("invalid AS_PATH %s", as_path)
             else:
-                if len(origin) == 1:
-                    origin = iter(origin).next()
+                origin = path.origin
+                try:
+                    prefix = Prefix(data[6])
+                except CriticalException:
+                    logger.warning("invalid prefix %s", data[6])
+                    return
                 yield InternalMessage("U",
                                       data[1],
                                       data[3],
                                       int(data[4]),
                                       data[5],
-                                      data[6],
+                                      prefix,
                                       origin,
-                                      as_path)
+                                      path.path)
 
 
 def bgpreader_format(collector, message):
@@ -8,8 +8,9 @@ import logging
 from contextlib import contextmanager
 
 from tabi.core import InternalMessage
-from tabi.helpers import check_ris_filenames, get_as_origin, \
-    process_iterator, gzip_opener, mabo_fork
+from tabi.aspath import intern_as_path
+from tabi.helpers import check_ris_filenames, \
+    process_iterator, gzip_opener, mabo_fork, Prefix, CriticalException
 
 logger = logging.getLogger(__name__)
 
@@ -18,26 +19,30 @@ def mabo_format_td2(collector, data):
     """
     Transform an mabo table dump v2 message to the internal representation.
     """
+    try:
+        prefix = Prefix(data["prefix"])
+    except CriticalException:
+        logger.warning("invalid prefix %s", data["prefix"])
+        return
     for entry in data.get("entries", []):
         as_path = entry["as_path"]
         if len(as_path) == 0:
             # skip announces from IGP
             continue
         try:
-            origin = frozenset(get_as_origin(as_path))
+            path = intern_as_path(as_path)
         except:
             logger.warning("invalid AS_PATH %s", as_path)
         else:
-            if len(origin) == 1:
-                origin = iter(origin).next()
+            origin = path.origin
             yield InternalMessage("F",
                                   data["timestamp"],
                                   collector,
                                   int(entry["peer_as"]),
                                   entry["peer_ip"],
-                                  data["prefix"],
+                                  prefix,
                                   origin,
-                                  as_path)
+                                  path.path)
 
 
 def mabo_format_update(collector, data):
@@ -45,33 +50,42 @@ def mabo_format_update(collector, data):
     Transform an mabo update message to the internal representation.
     """
     for entry in data.get("withdraw", []):
+        try:
+            prefix = Prefix(entry)
+        except CriticalException:
+            logger.warning("invalid prefix %s", entry)
+            continue
         yield InternalMessage("W",
                               data["timestamp"],
                               collector,
                               int(data["peer_as"]),
                               data["peer_ip"],
-                              entry,
+                              prefix,
                               None,
                               None)
 
     as_path = data.get("as_path", "")
     if len(as_path) != 0:
         try:
-            origin = frozenset(get_as_origin(as_path))
+            path = intern_as_path(as_path)
         except:
             logger.warning("invalid AS_PATH %s", as_path)
         else:
-            if len(origin) == 1:
-                origin = iter(origin).next()
+            origin = path.origin
             for entry in data.get("announce", []):
+                try:
+                    prefix = Prefix(entry)
+                except CriticalException:
+                    logger.warning("invalid prefix %s", entry)
+                    continue
                 yield InternalMessage("U",
                                       data["timestamp"],
                                       collector,
                                       int(data["peer_as"]),
                                       data["peer_ip"],
-                                      entry,
+                                      prefix,
                                       origin,
-                                      as_path)
+                                      path.path)
 
 
 def mabo_format(collector, message):
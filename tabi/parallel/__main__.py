@@ -21,6 +21,7 @@ import datetime
 import collections
 import traceback
 
+import tabi.backends
 import tabi.parallel.helpers
 import tabi.parallel.writers
 import tabi.parallel.mrtprocess
@@ -41,7 +42,7 @@ def main():
 
     # Is the version of python radix OK ?
     try:
-        tabi.parallel.helpers.check_python_radix()
+        default_backend = tabi.parallel.helpers.check_python_radix()
     except tabi.parallel.helpers.CriticalException, message:
         tabi.parallel.helpers.critical_error(message)
 
@@ -68,6 +69,52 @@ def main():
     parser.add_option("-m", "--mode", dest="output_mode",
                       default="combined", choices=["legacy", "combined", "live"],
                       help="Select the output mode: legacy, combined or live")
+    parser.add_option("-u", "--suppress-duplicates", action="store_true",
+                      dest="suppress_duplicates", default=False,
+                      help="Only report the new conflicts of announces "
+                           "identical to the previous one of the same peer")
+    parser.add_option("-t", "--track-conflicts", action="store_true",
+                      dest="track_conflicts", default=False,
+                      help="Report the start, summaries and end of conflicts "
+                           "instead of every update in conflict")
+    parser.add_option("--summary-interval", dest="summary_interval",
+                      type="int", default=3600,
+                      help="Seconds between two summaries of a conflict")
+    parser.add_option("--max-conflicts", dest="max_conflicts",
+                      type="int", default=100000,
+                      help="Maximum number of conflicts followed by a job")
+    parser.add_option("--max-hijacks", dest="max_hijacks",
+                      type="int", default=1000000,
+                      help="Maximum number of hijacks remembered by a job, "
+                           "the withdraws of the least recently announced "
+                           "ones are lost beyond")
+    parser.add_option("--hijack-max-age", dest="hijack_max_age",
+                      type="int", default=None,
+                      help="Seconds after which a hijack that was not "
+                           "announced again is forgotten, its withdraw is "
+                           "then lost")
+    parser.add_option("--rib-backend", dest="rib_backend",
+                      default=default_backend,
+                      choices=["radix"] + sorted(tabi.backends.BACKENDS),
+                      help="Prefix tree used by the RIB, py-radix by "
+                           "default if it is installed; nparray is "
+                           "experimental and slower than py-radix")
+    parser.add_option("--rib-max-nodes", dest="rib_max_nodes",
+                      type="int", default=None,
+                      help="With the spill backend, number of prefixes kept "
+                           "in memory, the others being stored on disk")
+    parser.add_option("-w", "--window", dest="window", type="int",
+                      default=None,
+                      help="In live mode, aggregate hijacks over windows of "
+                           "this many seconds")
+    parser.add_option("--window-step", dest="window_step", type="int",
+                      default=None,
+                      help="Seconds between two windows, enables sliding "
+                           "windows")
+    parser.add_option("--window-ttl", dest="window_ttl", type="int",
+                      default=None,
+                      help="Seconds after which an idle aggregate is "
+                           "forgotten")
     parser.add_option("-v", "--verbose", action="store_true", dest="verbose",
                       default=False,
                       help="Turn on verbose output")
@@ -163,6 +210,14 @@ def main():
         tmp_parameters["num_jobs"] = options.jobs
         tmp_parameters["collector_id"] = collector_id
         tmp_parameters["stats"] = options.stats
+        tmp_parameters["suppress_duplicates"] = options.suppress_duplicates
+        tmp_parameters["track_conflicts"] = options.track_conflicts
+        tmp_parameters["summary_interval"] = options.summary_interval
+        tmp_parameters["max_conflicts"] = options.max_conflicts
+        tmp_parameters["max_hijacks"] = options.max_hijacks
+        tmp_parameters["hijack_max_age"] = options.hijack_max_age
+        tmp_parameters["rib_backend"] = options.rib_backend
+        tmp_parameters["rib_max_nodes"] = options.rib_max_nodes
         tmp_parameters["logger"] = logger
 
         # Pipe used to send results to a WriterProcess
@@ -193,6 +248,9 @@ def main():
     tmp_parameters["output_directory"] = output_directory
     tmp_parameters["directory"] = directory
     tmp_parameters["ases"] = asn_list
+    tmp_parameters["window"] = options.window
+    tmp_parameters["window_step"] = options.window_step
+    tmp_parameters["window_ttl"] = options.window_ttl
     tmp_parameters["logger"] = logger
 
     if options.output_mode == "legacy":
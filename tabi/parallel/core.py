@@ -4,7 +4,10 @@
 
 import collections
 import json
-import radix
+
+from tabi.helpers import LRUCache, as_prefix, node_prefix
+from tabi.conflicts import ReportedConflicts
+from tabi.records import record_type
 
 
 InternalMessage = collections.namedtuple("InternalMessage",
@@ -29,6 +32,31 @@ HijackInformation = collections.namedtuple("HijackInformation",
                                             ])
 
 
+# Output records
+PrefixRecord = record_type("PrefixRecord", ["prefix", "asn"])
+AnnounceRecord = record_type("AnnounceRecord", ["prefix", "asn", "as_path"])
+DefaultRecord = record_type("DefaultRecord",
+                            ["timestamp", "collector", "peer_as", "peer_ip",
+                             "announce"])
+RouteRecord = record_type("RouteRecord",
+                          ["timestamp", "collector", "peer_as", "peer_ip",
+                           "action", "prefix", "as_path", "asn"])
+WithdrawRecord = record_type("WithdrawRecord",
+                             ["timestamp", "collector", "peer_as", "peer_ip",
+                              "action", "prefix", "asn"])
+HijackRecord = record_type("HijackRecord",
+                           ["timestamp", "collector", "peer_as", "peer_ip",
+                            "type", "announce", "conflict_with", "asn"])
+HijackWithdrawRecord = record_type("HijackWithdrawRecord",
+                                   ["timestamp", "collector", "peer_as",
+                                    "peer_ip", "type", "withdraw", "asn"])
+
+
+def is_default_prefix(prefix):
+    """Return True if `prefix' is 0.0.0.0/0 or ::/0."""
+    return as_prefix(prefix).length == 0
+
+
 class DefaultRoute:
     """Object that handles the processing of UPDATEs containing
     the default prefixes.
@@ -37,26 +65,20 @@ class DefaultRoute:
     def process(self, update):
         """Process a default route, i.e. return a message or do nothing."""
 
-        if update.prefix == "0.0.0.0/0" or update.prefix == "::/0":
+        if is_default_prefix(update.prefix):
             return [self.message(update)]
         else:
             return []
 
     def message(self, update):
-        """Prepare and return an ordered dictionary, that could
-        be logged or manipulated.
+        """Prepare and return a record, that could
+        be logged or manipulated like an ordered dictionary.
         """
 
         u = update
-        tmp_announce = collections.OrderedDict([("prefix", u.prefix),
-                                                ("asn", u.asn),
-                                                ("as_path", u.as_path)])
-        default_info = collections.OrderedDict([("timestamp", u.timestamp),
-                                                ("collector", u.collector),
-                                                ("peer_as", u.peer_as),
-                                                ("peer_ip", u.peer_ip),
-                                                ("announce", tmp_announce)])
-        return default_info
+        tmp_announce = AnnounceRecord(u.prefix, u.asn, u.as_path)
+        return DefaultRecord(u.timestamp, u.collector, u.peer_as, u.peer_ip,
+                             tmp_announce)
 
 
 class Route:
@@ -76,21 +98,13 @@ class Route:
         return [self.message(update)]
 
     def message(self, update):
-        """Prepare and return an ordered dictionary, that could be
-        logged or manipulated.
+        """Prepare and return a record, that could be
+        logged or manipulated like an ordered dictionary.
         """
 
         u = update
-        route_info = collections.OrderedDict([("timestamp", u.timestamp),
-                                              ("collector", u.collector),
-                                              ("peer_as", u.peer_as),
-                                              ("peer_ip", u.peer_ip),
-                                              ("action", "A"),
-                                              ("prefix", u.prefix),
-                                              ("as_path", u.as_path),
-                                              ("asn", u.asn)])
-
-        return route_info
+        return RouteRecord(u.timestamp, u.collector, u.peer_as, u.peer_ip,
+                           "A", u.prefix, u.as_path, u.asn)
 
 
 class Hijack:
@@ -120,38 +134,23 @@ class Hijack:
                 # Store the hijacks information
                 hijack_info = HijackInformation(origin_asn, update.asn,
                                                 update.peer_as, update.peer_ip)
-                self.rib.update(update.prefix, hijack_info,
-                                "hijacks_information")
+                self.rib.update_hijack(update.prefix, hijack_info)
 
                 messages += [self.message(update, node.prefix, origin_asn)]
 
         return messages
 
     def message(self, update, conflict_prefix, conflict_asn):
-        """Prepare and return an ordered dictionary, that could be
-        logged or manipulated.
+        """Prepare and return a record, that could be
+        logged or manipulated like an ordered dictionary.
         """
 
         u = update
-        tmp_conflict_with = collections.OrderedDict([("prefix",
-                                                      conflict_prefix),
-                                                     ("asn", conflict_asn)])
-
-        tmp_announce = collections.OrderedDict([("prefix", u.prefix),
-                                                ("asn", u.asn),
-                                                ("as_path", u.as_path)])
-
-        hijack_info = collections.OrderedDict([("timestamp", u.timestamp),
-                                               ("collector", u.collector),
-                                               ("peer_as", u.peer_as),
-                                               ("peer_ip", u.peer_ip),
-                                               ("type", self.datatype),
-                                               ("announce", tmp_announce),
-                                               ("conflict_with",
-                                                tmp_conflict_with),
-                                               ("asn", conflict_asn)])
-
-        return hijack_info
+        tmp_conflict_with = PrefixRecord(conflict_prefix, conflict_asn)
+        tmp_announce = AnnounceRecord(u.prefix, u.asn, u.as_path)
+        return HijackRecord(u.timestamp, u.collector, u.peer_as, u.peer_ip,
+                            self.datatype, tmp_announce, tmp_conflict_with,
+                            conflict_asn)
 
 
 class Withdraw:
@@ -168,19 +167,22 @@ class Withdraw:
         route_messages = []
         hijack_messages = []
 
-        # Withdrawal of routes & hijacks
+        # Withdrawal of routes
         node = self.rib.search_exact(withdraw.prefix)
         if node:
             route_messages += self.perform_withdraw(node,
                                                     "routes_information",
                                                     withdraw)
-            hijack_messages += self.perform_withdraw(node,
-                                                     "hijacks_information",
-                                                     withdraw)
 
-        # Finally delete the node if there is no associated data
-        if node and not len(node.data.keys()):
-            self.rib.delete(withdraw.prefix)
+            # Finally delete the node if there is no associated data
+            if not len(node.data.keys()):
+                self.rib.delete(withdraw.prefix)
+
+        # Withdrawal of hijacks
+        for information in self.rib.hijacks.withdraw(withdraw.prefix,
+                                                     withdraw.peer_as,
+                                                     withdraw.peer_ip):
+            hijack_messages += [self.message(withdraw, information)]
 
         return route_messages, hijack_messages
 
@@ -214,95 +216,229 @@ class Withdraw:
         return messages
 
     def message(self, withdraw, information):
-        """Prepare and return an ordered dictionary, that could be logged
-        or manipulated.
+        """Prepare and return a record, that could be logged
+        or manipulated like an ordered dictionary.
         """
 
         withdraw_info = []
 
         if isinstance(information, RouteInformation):
             w = withdraw
-            ordererdict_data = [("timestamp", w.timestamp),
-                                ("collector", w.collector),
-                                ("peer_as", w.peer_as),
-                                ("peer_ip", w.peer_ip),
-                                ("action", self.datatype),
-                                ("prefix", w.prefix),
-                                ("asn", information.origin_asn)]
-            withdraw_info = collections.OrderedDict(ordererdict_data)
+            withdraw_info = WithdrawRecord(w.timestamp, w.collector,
+                                           w.peer_as, w.peer_ip,
+                                           self.datatype, w.prefix,
+                                           information.origin_asn)
 
         elif isinstance(information, HijackInformation):
             w = withdraw
-            tmp_withdraw = collections.OrderedDict([("prefix", w.prefix),
-                                                    ("asn",
-                                                     information.hijacker_asn)
-                                                    ])
-            ordererdict_data = [("timestamp", w.timestamp),
-                                ("collector", w.collector),
-                                ("peer_as", w.peer_as),
-                                ("peer_ip", w.peer_ip),
-                                ("type", self.datatype),
-                                ("withdraw", tmp_withdraw),
-                                # XXX: must add confict_with to
-                                # known which (prefix, asn)
-                                # tuple is concerned
-                                ("asn", information.origin_asn)]
-
-            withdraw_info = collections.OrderedDict(ordererdict_data)
+            tmp_withdraw = PrefixRecord(w.prefix, information.hijacker_asn)
+            # XXX: must add confict_with to
+            # known which (prefix, asn)
+            # tuple is concerned
+            withdraw_info = HijackWithdrawRecord(w.timestamp, w.collector,
+                                                 w.peer_as, w.peer_ip,
+                                                 self.datatype, tmp_withdraw,
+                                                 information.origin_asn)
 
         return withdraw_info
 
 
-def process_message(rib, message, keep_asn=lambda asn: True):
+class DuplicateFilter:
+    """Object that remembers the last AS_PATH announced by each peer, and
+    the conflicts that were reported for it.
+
+    At most `max_entries' prefixes and peers are remembered, the least
+    recently announced being forgotten first.
+    """
+
+    def __init__(self, max_entries=1000000):
+        self.as_paths = LRUCache(max_entries)
+        self.reported = ReportedConflicts(max_entries)
+
+    def key(self, update):
+        prefix = as_prefix(update.prefix)
+        return (prefix.packed, prefix.length, update.peer_as, update.peer_ip)
+
+    def is_duplicate(self, update):
+        """Return True if the same AS_PATH was the last one announced by the
+        peer.
+        """
+
+        as_paths = self.as_paths.get(self.key(update), None)
+        return as_paths is not None and \
+            as_paths.get(update.asn, None) == update.as_path
+
+    def remember(self, update):
+        """Remember the AS_PATH announced by the peer."""
+
+        key = self.key(update)
+        as_paths = self.as_paths.get(key, None)
+        if as_paths is None:
+            as_paths = self.as_paths[key] = dict()
+        as_paths[update.asn] = update.as_path
+
+    def new_conflicts(self, update, conflicts, duplicate):
+        """Return the conflicts of `update' that must be reported, see
+        `tabi.conflicts.ReportedConflicts'.
+        """
+
+        return self.reported.new_conflicts(update, conflicts, duplicate)
+
+    def forget(self, withdraw):
+        """Forget the AS_PATH announced by the peer of a withdraw."""
+
+        self.as_paths.pop(self.key(withdraw), None)
+        self.reported.forget(withdraw)
+
+
+class MessageProcessor:
+    """Object that processes abstracted BGP messages with the same RIB.
+
+    The objects processing each kind of messages are created once, and
+    reused for every message.
+
+    If `duplicates' is a DuplicateFilter, announces identical to the last one
+    of the same peer only refresh the RIB, and only produce the hijack
+    messages that were not produced for the previous announce.
+    If `tracker' is a ConflictTracker, hijack messages describe the conflicts
+    lifecycle.
+    """
+
     # XXX: - access_time could be an internal function wrapping time.time()
     #      - OR access_time could be set with the message timestamp, if older
     #      than 8 hours, delete it, or check with the date of the last bview...
     #      - OR count the number of processes bview !
-    """Parse abstracted BGP messages."""
-
-    # Lists that holds the messages that will be returned
-    default_messages = []
-    route_messages = []
-    hijack_messages = []
-
-    # Instanciate objects that process abstracted BGP messages
-    default_route = DefaultRoute()
-    route = Route(rib)
-    hijack = Hijack(rib, message.datatype)
-    withdraw = Withdraw(rib)
 
-    # Process WITHDRAW messages
-    for update in message.withdraws():
-        withdraw_routes, withdraw_hijacks = withdraw.process(update)
-        route_messages += withdraw_routes
-        hijack_messages += withdraw_hijacks
+    def __init__(self, rib, keep_asn=lambda asn: True, duplicates=None,
+                 tracker=None):
+        self.rib = rib
+        self.keep_asn = keep_asn
+        self.duplicates = duplicates
+        self.tracker = tracker
+
+        self.default_route = DefaultRoute()
+        self.route = Route(rib)
+        self.withdraw = Withdraw(rib)
+        # Hijack objects, by datatype
+        self.hijacks = dict()
+
+    def hijack(self, datatype):
+        """Return the Hijack object of `datatype'."""
+
+        hijack = self.hijacks.get(datatype, None)
+        if hijack is None:
+            hijack = self.hijacks[datatype] = Hijack(self.rib, datatype)
+        return hijack
+
+    def process(self, message, default_messages=None, route_messages=None,
+                hijack_messages=None):
+        """Parse an abstracted BGP message.
+
+        Messages are appended to the given lists, or to new ones.
+        Return the (default_messages, route_messages, hijack_messages) lists.
+        """
 
-    # Process UPDATE messages
-    for update in message.announces():
-        # Default routes are processed separately, then skipped.
-        # If inserted in the radix tree, they will be in conflict
-        # with every prefix !
+        # Lists that holds the messages that will be returned
+        if default_messages is None:
+            default_messages = []
+        if route_messages is None:
+            route_messages = []
+        if hijack_messages is None:
+            hijack_messages = []
+
+        rib = self.rib
+        keep_asn = self.keep_asn
+        duplicates = self.duplicates
+        tracker = self.tracker
+        hijack = self.hijack(message.datatype)
+
+        # Process WITHDRAW messages
+        for update in message.withdraws():
+            if duplicates is not None:
+                duplicates.forget(update)
+            withdraw_routes, withdraw_hijacks = self.withdraw.process(update)
+            if tracker is not None:
+                withdraw_hijacks = tracker.process(update, withdraw_hijacks)
+            route_messages += withdraw_routes
+            hijack_messages += withdraw_hijacks
+
+        # Conflicts of each announced prefix, given at once to the tracker
+        if tracker is not None:
+            tracked = collections.OrderedDict()
+
+        # Process UPDATE messages
+        for update in message.announces():
+            # Default routes are processed separately, then skipped.
+            # If inserted in the radix tree, they will be in conflict
+            # with every prefix !
+
+            if is_default_prefix(update.prefix):
+                # Process the default prefix
+                default_messages += self.default_route.process(update)
+
+                # Always skip a default
+                continue
+
+            duplicate = duplicates is not None and \
+                duplicates.is_duplicate(update)
+            if duplicate:
+                # Only refresh the routes & hijacks of this peer
+                rib.refresh(update.prefix, update.peer_as, update.peer_ip)
+
+            elif keep_asn(update.asn):
+                # Process the UPDATE if the corresponding ASN is monitored
+                route_messages += self.route.process(update)
+
+            # Detect if the UPDATE is in conflict, even if it is a duplicate
+            # as the routes of other prefixes changed
+            conflicts = [hijack_message
+                         for hijack_message in hijack.process(update)
+                         if keep_asn(hijack_message["asn"])]
+            reported = conflicts
+            if duplicates is not None:
+                # Only remember the announces producing messages
+                if not duplicate and (len(conflicts) or keep_asn(update.asn)):
+                    duplicates.remember(update)
+                reported = duplicates.new_conflicts(update, conflicts,
+                                                    duplicate)
+            if tracker is None:
+                hijack_messages += reported
+            else:
+                tracked.setdefault(update.prefix,
+                                   (update, []))[1].extend(conflicts)
+
+        if tracker is not None:
+            for update, conflicts in tracked.itervalues():
+                hijack_messages += tracker.process(update, conflicts)
+
+        return default_messages, route_messages, hijack_messages
+
+    def process_all(self, messages):
+        """Parse a batch of abstracted BGP messages.
+
+        Return the (default_messages, route_messages, hijack_messages) lists
+        of all the messages, in order.
+        """
 
-        if update.prefix == "0.0.0.0/0" or update.prefix == "::/0":
-            # Process the default prefix
-            default_messages += default_route.process(update)
+        results = ([], [], [])
+        for message in messages:
+            self.process(message, *results)
+        return results
 
-            # Always skip a default
-            continue
 
-        elif keep_asn(update.asn):
-            # Process the UPDATE if the corresponding ASN is monitored
-            route_messages += route.process(update)
+def process_message(rib, message, keep_asn=lambda asn: True, duplicates=None,
+                    tracker=None):
+    """Parse abstracted BGP messages.
 
-        # Detect if the UPDATE is in conflict
-        for message in hijack.process(update):
-            if keep_asn(message["asn"]):
-                hijack_messages += [message]
+    Use a MessageProcessor to parse several messages with the same RIB.
+    """
 
-    return default_messages, route_messages, hijack_messages
+    processor = MessageProcessor(rib, keep_asn, duplicates, tracker)
+    return processor.process(message)
 
 
-def bview_fake_withdraw(rib, collector_id, current_time, timestamp):
+def bview_fake_withdraw(rib, collector_id, current_time, timestamp,
+                        duplicates=None, tracker=None):
     """Function that fakes withdraw if RIB elements where not
     modified by a bview.
     """
@@ -310,13 +446,15 @@ def bview_fake_withdraw(rib, collector_id, current_time, timestamp):
     # List prefixes that need to be withdrawn
     to_withdraw = set()
     # Enumerate all nodes in the RIB
-    for node in rib.nodes():
+    for node in rib.iter_nodes():
         # Get all keys
         for key in node.data.keys():
             # Remember elements that were not "recently" accessed.
             for information_key, access_time in node.data[key].iteritems():
                 if access_time < current_time:
-                    to_withdraw.add((node.prefix, information_key))
+                    to_withdraw.add((node_prefix(node), information_key))
+    # Hijacks are ordered by access time
+    to_withdraw.update(rib.hijacks.older(current_time))
 
     # Really withdraw messages
     withdraw = Withdraw(rib, datatype="FW")
@@ -333,7 +471,11 @@ def bview_fake_withdraw(rib, collector_id, current_time, timestamp):
                                    prefix,
                                    None,
                                    None)
+        if duplicates is not None:
+            duplicates.forget(internal)
         withdraw_routes, withdraw_hijacks = withdraw.process(internal)
+        if tracker is not None:
+            withdraw_hijacks = tracker.process(internal, withdraw_hijacks)
         route_messages += withdraw_routes
         hijack_messages += withdraw_hijacks
 
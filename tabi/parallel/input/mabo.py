@@ -4,7 +4,8 @@
 
 import collections
 
-import tabi.parallel.helpers
+import tabi.aspath
+import tabi.helpers
 from tabi.parallel.core import InternalMessage
 
 
@@ -36,7 +37,8 @@ class MaboTableDumpV2Document:
             as_path = entry.get("as_path", [])
             if len(as_path):
                 # Extract AS origins from the AS PATH
-                as_origins = tabi.parallel.helpers.get_as_origin(as_path)
+                as_path = tabi.aspath.intern_as_path(as_path)
+                as_origins = as_path.origins
             else:
                 # Do not process empty AS PATH - aka data coming from an IGP
                 continue
@@ -44,7 +46,7 @@ class MaboTableDumpV2Document:
             # Build an element per AS origin
             for as_origin in as_origins:
                 element = TableDumpV2Element(as_origin,
-                                             entry.get("as_path", None),
+                                             as_path.path,
                                              int(entry.get("peer_as", None)),
                                              entry.get("peer_ip", None))
                 extracted_elements[element] = None
@@ -63,12 +65,13 @@ class MaboTableDumpV2Document:
     def announces(self):
         """Return abstracted announces, i.e an empty list."""
 
+        prefix = tabi.helpers.Prefix(self.message["prefix"])
         for element in self.elements():
             internal = InternalMessage(self.message["timestamp"],
                                        self.collector,
                                        element.peer_as,
                                        element.peer_ip,
-                                       self.message["prefix"],
+                                       prefix,
                                        element.asn,
                                        element.as_path)
             yield internal
@@ -89,7 +92,7 @@ class MaboUpdateDocument:
 
         if len(as_path):
             # Extract AS origins from the AS PATH
-            return tabi.parallel.helpers.get_as_origin(as_path)
+            return tabi.aspath.intern_as_path(as_path).origins
         else:
             # Do not process empty AS PATH - aka data coming from an IGP
             return []
@@ -101,6 +104,7 @@ class MaboUpdateDocument:
     def withdraws(self):
         """Return abstracted withdraws, i.e an empty list."""
         for prefix in self.message.get("withdraw", []):
+            prefix = tabi.helpers.Prefix(prefix)
             internal = InternalMessage(self.message["timestamp"],
                                        self.collector,
                                        int(self.message.get("peer_as", None)),
@@ -114,6 +118,7 @@ class MaboUpdateDocument:
         """Return abstracted announces, i.e an empty list."""
 
         for prefix in self.message.get("announce", []):
+            prefix = tabi.helpers.Prefix(prefix)
             for asn in self.get_as_origins():
                 internal = InternalMessage(self.message["timestamp"],
                                            self.collector,
@@ -11,11 +11,17 @@ import json
 import select
 import sys
 import traceback
+import functools
 
 import tabi.parallel.rib
 import tabi.parallel.core
 import tabi.parallel.helpers
+import tabi.conflicts
+import tabi.backends.spill
 
+from tabi.parallel.input.mabo import MaboTableDumpV2Document
+from tabi.parallel.input.mabo import MaboUpdateDocument
+from tabi.records import to_json
 
 logger = logging.getLogger(__name__)
 
@@ -62,16 +68,60 @@ class MRTProcess(multiprocessing.Process):
         self.parameters = parameters
         self.access_time = None
         self.timestamp = None
+        # Time when the last message was processed
+        self.process_time = None
 
         # Create the RIB
-        self.parameters["rib"] = tabi.parallel.rib.EmulatedRIB()
+        backend = self.parameters.get("rib_backend", None)
+        if backend == "spill" and self.parameters.get("rib_max_nodes", None):
+            backend = functools.partial(tabi.backends.spill.SpillTree,
+                                        max_nodes=self.parameters["rib_max_nodes"])
+        self.parameters["rib"] = tabi.parallel.rib.EmulatedRIB(self.parameters.get("max_hijacks", None),
+                                                               self.parameters.get("hijack_max_age", None),
+                                                               backend)
+
+        # Remember the last announces to suppress duplicates
+        if self.parameters.get("suppress_duplicates", False):
+            self.parameters["duplicates"] = tabi.parallel.core.DuplicateFilter()
+        else:
+            self.parameters["duplicates"] = None
+
+        # Follow the conflicts lifecycle
+        if self.parameters.get("track_conflicts", False):
+            tracker = tabi.conflicts.ConflictTracker(self.parameters["summary_interval"],
+                                                     self.parameters["max_conflicts"])
+            self.parameters["tracker"] = tracker
+        else:
+            self.parameters["tracker"] = None
+
+        # Process the messages with the same handlers
+        keep_asn = functools.partial(is_watched_asn, self.parameters)
+        self.processor = tabi.parallel.core.MessageProcessor(self.parameters["rib"],
+                                                             keep_asn,
+                                                             self.parameters["duplicates"],
+                                                             self.parameters["tracker"])
+
+    def _send_messages(self, default_messages, route_messages, hijack_messages):
+        """Send the messages to the results pipe."""
+
+        results_pipe = self.parameters["results_pipe"]
+
+        for message in default_messages:
+            results_pipe.send((DEFAULTS, None, to_json(message)))
+
+        for message in route_messages:
+            results_pipe.send((ROUTES, message["asn"], to_json(message)))
+
+        for message in hijack_messages:
+            if "withdraw" in message:  # XXX: format must be the same !
+                asn = message["withdraw"]["asn"]
+            else:
+                asn = message["conflict_with"]["asn"]
+            results_pipe.send((HIJACKS, asn, to_json(message)))
 
     def _process_line(self, tmp):
         """Process lines from mabo."""
 
-        from tabi.parallel.input.mabo import MaboTableDumpV2Document
-        from tabi.parallel.input.mabo import MaboUpdateDocument
-
         document = json.loads(tmp)
 
         if document.get("type", None) == "table_dump_v2":
@@ -84,25 +134,24 @@ class MRTProcess(multiprocessing.Process):
             self.parameters["logger"].warning("_process_line(): unknown type %s", document.get("type", None))
             return
 
-        import functools
-        keep_asn = functools.partial(is_watched_asn, self.parameters)
-
-        self.parameters["rib"].set_access_time(self.access_time)
-        default_messages, route_messages, hijack_messages = tabi.parallel.core.process_message(self.parameters["rib"], abstracted_message, keep_asn)
+        self._send_messages(*self.processor.process(abstracted_message))
         self.timestamp = abstracted_message.timestamp()
+        self.process_time = time.time()
 
-        for message in default_messages:
-            self.parameters["results_pipe"].send((DEFAULTS, None, json.dumps(message)))
+    def _send_summaries(self):
+        """Send the summaries of the conflicts due while no messages are
+        received.
+        """
 
-        for message in route_messages:
-            self.parameters["results_pipe"].send((ROUTES, message["asn"], json.dumps(message)))
+        tracker = self.parameters["tracker"]
+        if tracker is None or self.timestamp is None:
+            return
 
-        for message in hijack_messages:
-            if "withdraw" in message:  # XXX: format must be the same !
-                asn = message["withdraw"]["asn"]
-            else:
-                asn = message["conflict_with"]["asn"]
-            self.parameters["results_pipe"].send((HIJACKS, asn, json.dumps(message)))
+        # Timestamp of the messages, had they kept coming
+        timestamp = float(self.timestamp) + time.time() - self.process_time
+        summaries = tracker.summaries(timestamp)
+        if len(summaries):
+            self._send_messages([], [], summaries)
 
     def _process_file(self, filename):
         try:
@@ -117,6 +166,7 @@ class MRTProcess(multiprocessing.Process):
                     if is_ready(self.pipe.fileno()):
                         break
                     # Otherwise wait a bit for the file to be filled
+                    self._send_summaries()
                     time.sleep(0.01)
                     continue
 
@@ -151,30 +201,36 @@ class MRTProcess(multiprocessing.Process):
 
             # Do things according to commands
             if tmp == "STOP":
-                # Stop & get the number of prefixes stored in the tree
-                self.pipe.send(self.parameters["rib"].prefixes())  # XXX: false as routes & hijacks are merged
+                hijacks = self.parameters["rib"].hijacks
+                if hijacks.evicted or hijacks.expired:
+                    self.parameters["logger"].info("MRTProcess(%d): %d hijacks evicted, %d expired, "
+                                                   "their withdraws were not reported",
+                                                   self.parameters["job_id"], hijacks.evicted, hijacks.expired)
+
+                # Stop & get the number of prefixes stored in the tree,
+                # hijacks are stored separately
+                self.pipe.send(self.parameters["rib"].prefixes())
                 self.parameters["results_pipe"].send("DONE")
+
+                # Remove the nodes spilled to disk
+                if isinstance(self.parameters["rib"].radix, tabi.backends.spill.SpillTree):
+                    self.parameters["rib"].radix.close()
                 break
 
             elif tmp[:6] == "ACCESS":
                 # Store the access time
                 self.access_time = float(tmp[7:])
+                self.parameters["rib"].set_access_time(self.access_time)
                 continue
 
             elif tmp == "BVIEW_END":
                 # Remove prefixes that were not accessed by the bview
                 route_messages, hijack_messages = tabi.parallel.core.bview_fake_withdraw(self.parameters["rib"],
                                                                                     self.parameters["collector_id"],
-                                                                                    self.access_time, self.timestamp)
-                for message in route_messages:
-                    self.parameters["results_pipe"].send((ROUTES, message["asn"], json.dumps(message)))
-
-                for message in hijack_messages:
-                    if "withdraw" in message:  # XXX: format must be the same !
-                        asn = message["withdraw"]["asn"]
-                    else:
-                        asn = message["conflict_with"]["asn"]
-                    self.parameters["results_pipe"].send((HIJACKS, asn, json.dumps(message)))
+                                                                                    self.access_time, self.timestamp,
+                                                                                    self.parameters["duplicates"],
+                                                                                    self.parameters["tracker"])
+                self._send_messages([], route_messages, hijack_messages)
                 continue
 
             elif tmp == "SYNC_PING":
@@ -2,16 +2,128 @@
 # Copyright (C) 2016 ANSSI
 # This file is part of the tabi project licensed under the MIT license.
 
-import radix
 import time
+import logging
 import collections
 
+from tabi.rib import radix_call
+from tabi.backends import new_tree
+from tabi.helpers import LRUCache, as_prefix
+
+logger = logging.getLogger(__name__)
+
+
+class HijackTable(object):
+    """
+    Hijack information of a RIB, indexed by prefix outside of the radix tree.
+    At most `max_entries' are kept, the least recently updated being evicted
+    first, and if `max_age' is given, the entries not updated during
+    `max_age' seconds expire. Access times are expected to only increase.
+
+    The withdraw of an evicted or expired hijack is not reported, since its
+    information is lost. Evictions are counted in `evicted' and logged, the
+    number of evictions between two warnings doubling each time.
+    """
+
+    def __init__(self, max_entries=None, max_age=None):
+        self.max_age = max_age
+        # (packed, length, information) -> (prefix, access time), the least
+        # recently updated first
+        self.entries = LRUCache(max_entries, on_evict=self._evicted)
+        # (packed, length) -> information of the prefix, in insertion order
+        self.prefixes = dict()
+        self.evicted = 0
+        self.expired = 0
+        self.next_warning = 1
+
+    def _evicted(self, key, value):
+        self._forget(key)
+        self.evicted += 1
+        if self.evicted >= self.next_warning:
+            logger.warning("hijack table full, %d hijacks evicted: their "
+                           "withdraws are not reported", self.evicted)
+            self.next_warning *= 2
+
+    def _forget(self, key):
+        """Remove an entry from the prefixes index."""
+
+        packed, length, information = key
+        informations = self.prefixes[(packed, length)]
+        del informations[information]
+        if not len(informations):
+            del self.prefixes[(packed, length)]
+
+    def update(self, prefix, information, access_time):
+        """Store the information of `prefix' with its access time."""
+
+        prefix = as_prefix(prefix)
+        key = (prefix.packed, prefix.length)
+        informations = self.prefixes.get(key, None)
+        if informations is None:
+            informations = self.prefixes[key] = collections.OrderedDict()
+        informations[information] = None
+        self.entries[key + (information,)] = (prefix, access_time)
+
+        if self.max_age is not None:
+            self.expire(access_time - self.max_age)
+
+    def refresh(self, prefix, peer_as, peer_ip, access_time):
+        """Set the access time of the information sent by a peer."""
+
+        prefix = as_prefix(prefix)
+        key = (prefix.packed, prefix.length)
+        for information in self.prefixes.get(key, ()):
+            if information.peer_as == peer_as and \
+               information.peer_ip == peer_ip:
+                self.entries[key + (information,)] = (prefix, access_time)
+
+    def withdraw(self, prefix, peer_as, peer_ip):
+        """Remove and return the information of `prefix' sent by a peer."""
+
+        prefix = as_prefix(prefix)
+        key = (prefix.packed, prefix.length)
+        withdrawn = [information for information in self.prefixes.get(key, ())
+                     if information.peer_as == peer_as and
+                     information.peer_ip == peer_ip]
+        for information in withdrawn:
+            del self.entries[key + (information,)]
+            self._forget(key + (information,))
+        return withdrawn
+
+    def older(self, access_time):
+        """Return the (prefix, information) not updated since `access_time'."""
+
+        older = []
+        for key, (prefix, entry_time) in self.entries.iteritems():
+            if entry_time >= access_time:
+                break
+            older.append((prefix, key[2]))
+        return older
+
+    def expire(self, access_time):
+        """Forget the information not updated since `access_time'."""
+
+        while len(self.entries):
+            key, (prefix, entry_time) = next(self.entries.iteritems())
+            if entry_time >= access_time:
+                break
+            del self.entries[key]
+            self._forget(key)
+            self.expired += 1
+
+    def __len__(self):
+        return len(self.entries)
 
-class EmulatedRIB(object):
-    """Emulated RIB using a Radix object."""
 
-    def __init__(self):
-        self.radix = radix.Radix()
+class EmulatedRIB(object):
+    """
+    Emulated RIB using a Radix object, or the tree of another `backend', for
+    the routes, and a HijackTable for the hijacks.
+    """
+
+    def __init__(self, max_hijacks=None, hijack_max_age=None, backend=None):
+        self.radix = new_tree(backend)
+        self.hijacks = HijackTable(max_hijacks, hijack_max_age)
         self.access_time = time.time()
 
     def set_access_time(self, access_time):
@@ -35,26 +147,47 @@ class EmulatedRIB(object):
         """Update the information stored concerning a specific prefix."""
 
         # Check if the entry exists
-        node = self.radix.add(prefix)
+        node = radix_call(self.radix.add, prefix)
         if node:
             self.update_data(node, value, information_key)
 
+    def update_hijack(self, prefix, value):
+        """Update the hijack information concerning a specific prefix."""
+        self.hijacks.update(prefix, value, self.access_time)
+
+    def refresh(self, prefix, peer_as, peer_ip):
+        """Set the access time of the information sent by a peer."""
+
+        self.hijacks.refresh(prefix, peer_as, peer_ip, self.access_time)
+
+        node = radix_call(self.radix.search_exact, prefix)
+        if node is None:
+            return
+        for information in node.data.itervalues():
+            for value in information:
+                if value.peer_as == peer_as and value.peer_ip == peer_ip:
+                    information[value] = self.access_time
+
     def delete(self, prefix):
-        self.radix.delete(prefix)
+        radix_call(self.radix.delete, prefix)
 
     def search_all_containing(self, prefix):
-        tmp_node = self.radix.search_covering(prefix)
+        tmp_node = radix_call(self.radix.search_covering, prefix)
         if tmp_node is None:
             return []
         else:
             return tmp_node
 
     def search_exact(self, prefix):
-        tmp_node = self.radix.search_exact(prefix)
+        tmp_node = radix_call(self.radix.search_exact, prefix)
         return tmp_node
 
     def nodes(self):
         return self.radix.nodes()
 
+    def iter_nodes(self):
+        """Iterate over the nodes, without listing them if possible."""
+        return iter(self.radix)
+
     def prefixes(self):
         return self.radix.prefixes()
@@ -6,8 +6,11 @@ import multiprocessing
 import select
 import sys
 import gzip
+import json
+import time
 import os
 
+import tabi.conflicts
 import tabi.helpers
 import tabi.parallel.helpers
 import tabi.parallel.mrtprocess
@@ -16,6 +19,10 @@ import tabi.parallel.mrtprocess
 class BaseWriterProcess(multiprocessing.Process):
     """Base class for the processes that write the results to the disk."""
 
+    # Milliseconds without results after which `idle' is called, never if
+    # None
+    idle_timeout = None
+
     def __init__(self, results_pipes, parameters):
         multiprocessing.Process.__init__(self)
 
@@ -46,7 +53,10 @@ class BaseWriterProcess(multiprocessing.Process):
             # Iterate until all pipes are closed
             go = len(self.results_pipes)
             while go:
-                for (fd, _) in p.poll():
+                events = p.poll(self.idle_timeout)
+                if not events:
+                    self.idle()
+                for (fd, _) in events:
                     try:
                         tmp = fd2pipe[fd].recv()
                     except Exception:
@@ -65,6 +75,10 @@ class BaseWriterProcess(multiprocessing.Process):
             # Close file descriptors
             self.close_fds()
 
+    def idle(self):
+        """Called when no results were received during `idle_timeout'."""
+        pass
+
     def _write(self, tmp):
         data_type, asn, str_json = tmp
         if data_type == tabi.parallel.mrtprocess.ROUTES:
@@ -191,6 +205,10 @@ class LegacyWriterProcess(BaseWriterProcess):
 class LiveWriterProcess(BaseWriterProcess):
     """
     Live mode writer writes hijack results to stdout.
+
+    If the "window" parameter is set, hijacks are aggregated per victim ASN,
+    hijacker ASN and prefix, and a summary is written per time window. The
+    windows also end while no hijacks are received.
     """
 
     def __init__(self, results_pipes, parameters):
@@ -200,6 +218,46 @@ class LiveWriterProcess(BaseWriterProcess):
         self.parameters["hijacks_fd"] = sys.stdout
         self.parameters["defaults_fd"] = sys.stderr
 
+        self.aggregator = None
+        if self.parameters.get("window", None):
+            self.aggregator = tabi.conflicts.ConflictAggregator(
+                self.parameters["window"],
+                self.parameters.get("window_step", None),
+                self.parameters.get("window_ttl", None))
+            self.idle_timeout = 1000
+        # Timestamp of the last hijack, and time when it was received
+        self.timestamp = None
+        self.receive_time = None
+
+    def idle(self):
+        """Write the summaries of the windows ended since the last hijack."""
+
+        if self.aggregator is None or self.timestamp is None:
+            return
+        timestamp = self.timestamp + time.time() - self.receive_time
+        self.write_summaries(self.aggregator.tick(timestamp))
+
+    def _write(self, tmp):
+        data_type, asn, str_json = tmp
+        if self.aggregator is None or \
+           data_type != tabi.parallel.mrtprocess.HIJACKS:
+            return super(LiveWriterProcess, self)._write(tmp)
+
+        record = json.loads(str_json)
+        self.timestamp = float(record["timestamp"])
+        self.receive_time = time.time()
+        self.write_summaries(self.aggregator.add(record))
+
+    def write_summaries(self, summaries):
+        """Write the aggregated hijacks."""
+
+        if not len(summaries):
+            return
+        fd = self.parameters["hijacks_fd"]
+        for summary in summaries:
+            fd.write("%s\n" % json.dumps(summary))
+        fd.flush()
+
     def get_fd(self, str_key, asn):
         """Open or return the file descriptor that will be used
         to write results.
@@ -211,6 +269,9 @@ class LiveWriterProcess(BaseWriterProcess):
     def close_fds(self):
         """Close file descriptors."""
 
+        if self.aggregator is not None:
+            self.write_summaries(self.aggregator.flush())
+
         self.parameters["routes_fd"].close()
         self.parameters["hijacks_fd"].close()
         self.parameters["defaults_fd"].close()
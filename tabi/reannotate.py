@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 ANSSI
+# This file is part of the tabi project licensed under the MIT license.
+
+# Re-annotation of stored conflicts
+#
+# Conflicts are stored as JSON lines. When the metadata changes, only some
+# of them can get a different annotation: the ones whose announce or
+# conflict_with is covered by a route object or a ROA of the same ASN that
+# changed, and the ones involving an ASN whose relations changed. An index
+# of the stored conflicts by prefix and ASN finds them without annotating
+# the others.
+#
+# Files can also be entirely re-annotated in chunks by a pool of processes
+# sharing the metadata. Each process compresses its chunk into a gzip
+# member, and their concatenation is the compressed output.
+
+import os
+import json
+import logging
+import cPickle
+import contextlib
+import multiprocessing
+
+from gzip import GzipFile
+from itertools import islice
+from cStringIO import StringIO
+from collections import OrderedDict, defaultdict, deque, namedtuple
+
+from tabi.rib import Radix
+from tabi.annotate import fill_relation_struct, fill_ro_struct, \
+    fill_roa_struct, annotate_directly_with_type
+from tabi.helpers import default_opener, compressed_opener, gunzip_fork, \
+    CriticalException
+
+logger = logging.getLogger(__name__)
+
+RELATION_TYPES = ("organisations", "contacts", "maintainers")
+
+Metadata = namedtuple("Metadata",
+                      ["relations_dict", "ro_rad_tree", "roa_rad_tree"])
+
+# Metadata of the annotation processes, inherited when they are forked
+pool_metadata = None
+
+
+def load_metadata(irr_org_file=None, irr_mnt_file=None, irr_ro_file=None,
+                  rpki_roa_file=None, opener=default_opener):
+    """
+    Return the Metadata of the CSV files, the structures of missing files
+    are empty.
+    """
+
+    relations_dict = dict()
+    if irr_org_file is not None:
+        fill_relation_struct(irr_org_file, relations_dict, "organisations",
+                             opener)
+    if irr_mnt_file is not None:
+        fill_relation_struct(irr_mnt_file, relations_dict, "maintainers",
+                             opener)
+
+    ro_rad_tree = Radix()
+    if irr_ro_file is not None:
+        fill_ro_struct(irr_ro_file, ro_rad_tree, opener)
+
+    roa_rad_tree = Radix()
+    if rpki_roa_file is not None:
+        fill_roa_struct(rpki_roa_file, roa_rad_tree, opener)
+
+    return Metadata(relations_dict, ro_rad_tree, roa_rad_tree)
+
+
+def diff_trees(old_tree, new_tree):
+    """
+    Return the set of (prefix, asn) whose data differ between two radix
+    trees of route objects or ROA.
+    """
+
+    old_nodes = dict((node.prefix, node.data) for node in old_tree)
+    changed = set()
+    for node in new_tree:
+        old_data = old_nodes.pop(node.prefix, {})
+        for asn in set(old_data).union(node.data):
+            if old_data.get(asn, None) != node.data.get(asn, None):
+                changed.add((node.prefix, asn))
+    for prefix, old_data in old_nodes.iteritems():
+        changed.update((prefix, asn) for asn in old_data)
+    return changed
+
+
+def diff_relations(old_dict, new_dict):
+    """
+    Return the set of ASN whose relations may differ between two relations
+    dictionaries: the ASN whose organisations, contacts or maintainers
+    changed, and their siblings.
+    """
+
+    changed = set()
+    for relation_type in RELATION_TYPES:
+        reverse = "%s_reverse" % relation_type
+        old_reverse = old_dict.get(reverse, {})
+        new_reverse = new_dict.get(reverse, {})
+        for asn in set(old_reverse).union(new_reverse):
+            if old_reverse.get(asn, set()) != new_reverse.get(asn, set()):
+                changed.add(asn)
+
+    # The contacts and maintainers of an ASN are shared by its siblings
+    affected = set(changed)
+    for relations_dict in (old_dict, new_dict):
+        orgs = relations_dict.get("organisations", {})
+        orgs_reverse = relations_dict.get("organisations_reverse", {})
+        for asn in changed:
+            for org in orgs_reverse.get(asn, ()):
+                affected.update(orgs.get(org, ()))
+    return affected
+
+
+def diff_metadata(old, new):
+    """
+    Return the (prefix, asn) of the route objects and ROA, and the ASN of
+    the relations, that differ between the Metadata `old' and `new'.
+    """
+
+    prefixes = diff_trees(old.ro_rad_tree, new.ro_rad_tree)
+    prefixes.update(diff_trees(old.roa_rad_tree, new.roa_rad_tree))
+    asns = diff_relations(old.relations_dict, new.relations_dict)
+    return prefixes, asns
+
+
+class ConflictIndex(object):
+    """
+    Positions of the stored conflicts by prefix and ASN of their "announce"
+    and "conflict_with" fields. Withdraws are not indexed, their annotation
+    does not depend on the metadata.
+    """
+
+    def __init__(self):
+        self.rad_tree = Radix()
+        self.asns = defaultdict(set)
+
+    def add(self, position, conflict):
+        announce = conflict.get("announce", None)
+        conflict_with = conflict.get("conflict_with", None)
+        if announce is None or conflict_with is None:
+            return
+        for route in (announce, conflict_with):
+            node = self.rad_tree.add(route["prefix"])
+            node.data.setdefault(route["asn"], set()).add(position)
+            self.asns[route["asn"]].add(position)
+
+    def affected(self, prefixes, asns):
+        """
+        Return the set of positions of the conflicts covered by one of the
+        (prefix, asn) of `prefixes' or involving one of `asns'.
+        """
+
+        positions = set()
+        for prefix, asn in prefixes:
+            for node in self.rad_tree.search_covered(prefix):
+                positions.update(node.data.get(asn, ()))
+        for asn in asns:
+            positions.update(self.asns.get(asn, ()))
+        return positions
+
+
+def index_conflicts(input, opener=compressed_opener):
+    """Return the ConflictIndex of a file of conflicts, one per line."""
+
+    index = ConflictIndex()
+    with opener(input) as conflicts_file:
+        for position, line in enumerate(conflicts_file):
+            index.add(position, json.loads(line))
+    return index
+
+
+def load_conflict_index(index_file, input, opener=compressed_opener):
+    """
+    Return the ConflictIndex of `input' stored in `index_file', built and
+    stored again if `input' was modified since.
+    """
+
+    if os.path.exists(index_file) and \
+            os.path.getmtime(index_file) >= os.path.getmtime(input):
+        with open(index_file, "rb") as pickle_file:
+            return cPickle.load(pickle_file)
+    index = index_conflicts(input, opener)
+    with open(index_file, "wb") as pickle_file:
+        cPickle.dump(index, pickle_file, cPickle.HIGHEST_PROTOCOL)
+    return index
+
+
+def reannotate(conflict, metadata):
+    """Replace the annotations of `conflict' with the ones of `metadata'."""
+
+    for key in ("announce", "conflict_with"):
+        route = conflict.get(key, None)
+        if route is not None:
+            route.pop("valid", None)
+    for key in ("relation", "direct", "type"):
+        conflict.pop(key, None)
+    return annotate_directly_with_type(conflict, metadata.relations_dict,
+                                       metadata.ro_rad_tree,
+                                       metadata.roa_rad_tree)
+
+
+def open_output(output):
+    """Open `output' for writing, compressed if its name ends with .gz."""
+
+    if output.endswith(".gz"):
+        return GzipFile(output, "w")
+    return open(output, "w")
+
+
+def reannotate_changed(input, output, old, new, index=None, changes=None,
+                       opener=compressed_opener):
+    """
+    Copy the conflicts of `input' to `output', re-annotating with `new' only
+    the ones that may be annotated differently than with `old'. Other lines
+    are copied without being parsed.
+
+    :param input: File of conflicts, one JSON object per line
+    :param output: File written, compressed if its name ends with .gz
+    :param old: Metadata used to annotate `input'
+    :param new: Metadata used to annotate `output'
+    :param index: ConflictIndex of `input', built if None
+    :param changes: result of `diff_metadata(old, new)', computed if None
+    :param opener: Function to use in order to open `input'
+    :return: Number of conflicts re-annotated
+    """
+
+    if changes is None:
+        changes = diff_metadata(old, new)
+    prefixes, asns = changes
+    if index is None:
+        index = index_conflicts(input, opener)
+    positions = index.affected(prefixes, asns)
+
+    with opener(input) as conflicts_file:
+        output_file = open_output(output)
+        try:
+            for position, line in enumerate(conflicts_file):
+                if position in positions:
+                    conflict = json.loads(line, object_pairs_hook=OrderedDict)
+                    line = "%s\n" % json.dumps(reannotate(conflict, new))
+                output_file.write(line)
+        finally:
+            output_file.close()
+    return len(positions)
+
+
+@contextlib.contextmanager
+def gunzip_opener(input):
+    """
+    Open `input', decompressed by a gunzip process running in parallel if
+    its name ends with .gz.
+    """
+
+    if not input.endswith(".gz"):
+        with open(input) as input_file:
+            yield input_file
+        return
+
+    sp = gunzip_fork(input, None)
+    try:
+        yield sp.stdout
+    finally:
+        sp.stdout.close()
+        if sp.poll() is None:
+            sp.kill()
+        sp.wait()
+        for line in sp.stderr:
+            logger.error("gunzip_opener: gunzip: %s", line.strip())
+
+
+def annotate_chunk(lines, compress):
+    """
+    Re-annotate a chunk of JSON lines in an annotation process. Return the
+    lines, as a gzip member if `compress' is True.
+    """
+
+    output = StringIO()
+    output_file = output
+    if compress:
+        output_file = GzipFile(fileobj=output, mode="w")
+    for line in lines:
+        if not line.strip():
+            continue
+        conflict = json.loads(line, object_pairs_hook=OrderedDict)
+        output_file.write("%s\n" % json.dumps(reannotate(conflict,
+                                                         pool_metadata)))
+    if compress:
+        output_file.close()
+    return output.getvalue()
+
+
+def fork_annotation_pool(metadata, processes=None):
+    """
+    Fork a pool of `processes' annotating with `metadata': the structures
+    are shared copy-on-write with the processes.
+    """
+
+    global pool_metadata
+    pool_metadata = metadata
+    return multiprocessing.Pool(processes)
+
+
+def reannotate_file(pool, input, output, chunk_size=10000, max_chunks=8):
+    """
+    Re-annotate every conflict of `input' with a pool forked by
+    `fork_annotation_pool'. The lines are read, annotated and written in
+    their original order, with at most `max_chunks' chunks in memory.
+
+    :param pool: Pool of annotation processes
+    :param input: File of conflicts, decompressed if its name ends with .gz
+    :param output: File written, compressed if its name ends with .gz
+    :param chunk_size: Number of lines annotated at once by a process
+    :param max_chunks: Number of chunks annotated at the same time
+    :return: Number of lines read
+    """
+
+    compress = output.endswith(".gz")
+    count = 0
+    pending = deque()
+    with gunzip_opener(input) as input_file:
+        with open(output, "wb") as output_file:
+            while True:
+                lines = list(islice(input_file, chunk_size))
+                if not lines:
+                    break
+                count += len(lines)
+                pending.append(pool.apply_async(annotate_chunk,
+                                                (lines, compress)))
+                while pending and (len(pending) >= max_chunks or
+                                   pending[0].ready()):
+                    output_file.write(pending.popleft().get())
+
+            while pending:
+                output_file.write(pending.popleft().get())
+            if compress and count == 0:
+                output_file.write(annotate_chunk([], True))
+    return count
+
+
+def output_paths(inputs, output_dir):
+    """
+    Return the paths of the outputs of `inputs' in `output_dir', relative to
+    the deepest directory containing every input.
+    """
+
+    directories = [os.path.dirname(os.path.abspath(input)) + os.sep
+                   for input in inputs]
+    common = os.path.dirname(os.path.commonprefix(directories))
+    return [os.path.join(output_dir, os.path.relpath(os.path.abspath(input),
+                                                     common))
+            for input in inputs]
+
+
+def add_metadata_arguments(parser, prefix=""):
+    """Add the options giving the metadata files to `parser'."""
+
+    for name, help in (("irr-ro-file", "IRR route objects"),
+                       ("irr-mnt-file", "IRR maintainer objects"),
+                       ("irr-org-file", "IRR organisation objects"),
+                       ("rpki-roa-file", "ROA")):
+        parser.add_argument("--%s%s" % (prefix, name),
+                            help="CSV file containing %s%s" %
+                            (prefix.replace("-", " "), help))
+
+
+def metadata_from_arguments(args, prefix=""):
+    """Return the Metadata of the options added by add_metadata_arguments."""
+
+    def get(name):
+        return getattr(args, "%s%s" % (prefix.replace("-", "_"), name))
+    return load_metadata(irr_org_file=get("irr_org_file"),
+                         irr_mnt_file=get("irr_mnt_file"),
+                         irr_ro_file=get("irr_ro_file"),
+                         rpki_roa_file=get("rpki_roa_file"))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Re-annotate stored conflicts with new metadata")
+    parser.add_argument("inputs", nargs="+",
+                        help="files of conflicts, e.g. all.hijacks.json.gz")
+    parser.add_argument("-o", "--output", required=True,
+                        help="directory where the files are written, with "
+                             "their paths relative to the directory of the "
+                             "inputs")
+    parser.add_argument("-p", "--processes", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="number of annotation processes")
+    parser.add_argument("--chunk-size", type=int, default=10000,
+                        help="number of conflicts annotated at once by a "
+                             "process")
+    parser.add_argument("--keep-index", action="store_true",
+                        help="with the old metadata, keep the index of the "
+                             "conflicts of each input in <input>.index")
+    add_metadata_arguments(parser)
+    add_metadata_arguments(parser, "old-")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="more logging")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    outputs = output_paths(args.inputs, args.output)
+    for input, output in zip(args.inputs, outputs):
+        if os.path.abspath(input) == os.path.abspath(output):
+            raise CriticalException("%s would be overwritten" % input)
+        if not os.path.isdir(os.path.dirname(output)):
+            os.makedirs(os.path.dirname(output))
+
+    metadata = metadata_from_arguments(args)
+    incremental = any(getattr(args, "old_%s" % name) is not None
+                      for name in ("irr_ro_file", "irr_mnt_file",
+                                   "irr_org_file", "rpki_roa_file"))
+
+    if incremental:
+        # Only the conflicts affected by the changes are annotated
+        old_metadata = metadata_from_arguments(args, "old-")
+        changes = diff_metadata(old_metadata, metadata)
+        logger.info("%d route objects or ROA and %d ASN relations changed",
+                    len(changes[0]), len(changes[1]))
+        for input, output in zip(args.inputs, outputs):
+            index = None
+            if args.keep_index:
+                index = load_conflict_index("%s.index" % input, input)
+            count = reannotate_changed(input, output, old_metadata,
+                                       metadata, index, changes)
+            logger.info("%s: %d conflicts re-annotated", input, count)
+        return
+
+    pool = fork_annotation_pool(metadata, args.processes)
+    try:
+        for input, output in zip(args.inputs, outputs):
+            count = reannotate_file(pool, input, output, args.chunk_size,
+                                    2 * args.processes)
+            logger.info("%s: %d conflicts re-annotated", input, count)
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+
+
+if __name__ == "__main__":
+    main()
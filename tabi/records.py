@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 ANSSI
+# This file is part of the tabi project licensed under the MIT license.
+
+# Output records
+#
+# Routes and conflicts are produced for every BGP message, but most of them
+# are only filtered on a key or two. Records are dictionaries whose order is
+# given by the fields of their class, followed by the keys added afterwards,
+# e.g. by the annotation functions. They behave like the OrderedDict they
+# replace and are serialized by json.dumps as is, but are built much faster
+# since no linked list of keys is maintained.
+
+import sys
+import json
+
+from itertools import izip
+from collections import OrderedDict
+
+
+class Record(dict):
+    """
+    Dictionary whose keys are the `fields' of its class, in this order,
+    followed by the keys added afterwards.
+    """
+
+    __slots__ = ("extra",)
+    fields = ()
+    positions = {}
+
+    def __init__(self, *values):
+        dict.__init__(self, izip(self.fields, values))
+        self.extra = None
+
+    def __setitem__(self, key, value):
+        if key not in self.positions and not dict.__contains__(self, key):
+            if self.extra is None:
+                self.extra = []
+            self.extra.append(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        if key not in self.positions:
+            self.extra.remove(key)
+
+    def __iter__(self):
+        for field in self.fields:
+            if dict.__contains__(self, field):
+                yield field
+        if self.extra is not None:
+            for key in self.extra:
+                yield key
+
+    iterkeys = __iter__
+
+    def iteritems(self):
+        for key in self:
+            yield key, dict.__getitem__(self, key)
+
+    def itervalues(self):
+        for key in self:
+            yield dict.__getitem__(self, key)
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def pop(self, key, *default):
+        if dict.__contains__(self, key):
+            value = dict.__getitem__(self, key)
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def popitem(self):
+        if not self:
+            raise KeyError("dictionary is empty")
+        key = self.keys()[-1]
+        return key, self.pop(key)
+
+    def setdefault(self, key, default=None):
+        if not dict.__contains__(self, key):
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for key, value in OrderedDict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def clear(self):
+        dict.clear(self)
+        self.extra = None
+
+    def copy(self):
+        record = self.__class__()
+        record.update(self.iteritems())
+        return record
+
+    def to_dict(self):
+        """Return the record as an OrderedDict, nested records included."""
+
+        return OrderedDict((key, value.to_dict()
+                            if isinstance(value, Record) else value)
+                           for key, value in self.iteritems())
+
+    def __eq__(self, other):
+        # Like an OrderedDict, the order matters against ordered mappings
+        if isinstance(other, (Record, OrderedDict)):
+            return dict.__eq__(self, other) and self.keys() == other.keys()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.items())
+
+    def __reduce__(self):
+        return (self.__class__, (), None, None, self.iteritems())
+
+
+def record_type(name, fields):
+    """Return a Record class whose keys are `fields', like namedtuple."""
+
+    fields = tuple(fields)
+    # The class is pickled by reference to the module calling record_type
+    module = sys._getframe(1).f_globals.get("__name__", "__main__")
+    return type(name, (Record,),
+                {"__slots__": (),
+                 "__module__": module,
+                 "fields": fields,
+                 "positions": dict((field, position)
+                                   for position, field in enumerate(fields))})
+
+
+def to_json(obj):
+    """Return the JSON representation of `obj', which may contain records."""
+    return json.dumps(obj)
@@ -2,57 +2,89 @@
 # Copyright (C) 2016 ANSSI
 # This file is part of the tabi project licensed under the MIT license.
 
-from radix import Radix
+try:
+    from radix import Radix
+except ImportError:
+    # e.g. under PyPy
+    from tabi.backends.hashed import HashTree as Radix
+
+from tabi.backends import new_tree
+from tabi.helpers import Prefix
+from tabi.conflicts import ReportedConflicts
+
+
+def radix_call(method, prefix):
+    """
+    Call a radix `method' on `prefix', using its packed representation
+    when it is a Prefix object to avoid parsing the text again.
+    """
+    if isinstance(prefix, Prefix):
+        return method(packed=prefix.packed, masklen=prefix.length)
+    return method(prefix)
 
 
 class EmulatedRIB(object):
-    """Emulated RIB using a Radix object."""
+    """
+    Emulated RIB using a Radix object, or the tree of another `backend'
+    (see `tabi.backends.new_tree').
+    """
 
-    def __init__(self):
-        self.radix = Radix()
+    def __init__(self, backend=None):
+        self.radix = new_tree(backend)
         self.peers = dict()
+        # peer_as -> peer_ip -> interned (peer_as, peer_ip) peer
+        self.peers_by_address = dict()
+        # Conflicts of the last announces, when duplicates are suppressed
+        self.reported = ReportedConflicts()
+
+    def peer(self, peer_as, peer_ip):
+        """Return the interned peer (peer_as, peer_ip), or None if unknown."""
+        peer_ips = self.peers_by_address.get(peer_as, None)
+        if peer_ips is not None:
+            return peer_ips.get(peer_ip, None)
 
     def update(self, prefix, peer, value):
         """Update the information stored concerning a specific prefix."""
         peer_sym = self.peers.get(peer, None)
         if peer_sym is None:
             peer_sym = self.peers[peer] = peer
-        node = self.radix.add(prefix)
+            self.peers_by_address.setdefault(peer[0], dict())[peer[1]] = peer
+        node = radix_call(self.radix.add, prefix)
         node.data[peer_sym] = value
         return node
 
     def lookup(self, prefix, peer):
         peer_sym = self.peers.get(peer, None)
         if peer_sym is not None:
-            node = self.radix.search_exact(prefix)
+            node = radix_call(self.radix.search_exact, prefix)
             if node is not None:
                 return node.data.get(peer_sym, None)
 
     def pop(self, prefix, peer):
-        node = self.radix.search_exact(prefix)
+        node = radix_call(self.radix.search_exact, prefix)
         if node is not None:
             val = node.data.pop(peer, None)
             if len(node.data) == 0:
-                self.radix.delete(prefix)
+                radix_call(self.radix.delete, prefix)
             return val
 
     def delete(self, prefix):
-        return self.radix.delete(prefix)
+        return radix_call(self.radix.delete, prefix)
 
     def search_all_containing(self, prefix):
-        tmp_node = self.radix.search_covering(prefix)
+        tmp_node = radix_call(self.radix.search_covering, prefix)
         if tmp_node is None:
             return []
         return tmp_node
 
     def search_all_contained(self, prefix):
-        tmp_node = self.radix.search_covered(prefix)
+        tmp_node = radix_call(self.radix.search_covered, prefix)
         if tmp_node is None:
             return []
         return tmp_node
 
     def search_exact(self, prefix):
-        return self.radix.search_exact(prefix)
+        return radix_call(self.radix.search_exact, prefix)
 
     def nodes(self):
         return self.radix.nodes()
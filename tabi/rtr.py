@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 ANSSI
+# This file is part of the tabi project licensed under the MIT license.
+
+# RPKI to Router protocol client (RFC 8210, and RFC 6810 for version 0)
+#
+# Validated ROA payloads are fetched from a validator cache and applied to
+# a radix tree using the layout of `tabi.annotate.fill_roa_struct': the data
+# of a node maps an ASN to the largest max length of its ROAs.
+
+import socket
+import struct
+import logging
+
+from tabi.helpers import CriticalException
+from tabi.rib import Radix
+
+logger = logging.getLogger(__name__)
+
+# PDU types
+SERIAL_NOTIFY = 0
+SERIAL_QUERY = 1
+RESET_QUERY = 2
+CACHE_RESPONSE = 3
+IPV4_PREFIX = 4
+IPV6_PREFIX = 6
+END_OF_DATA = 7
+CACHE_RESET = 8
+ROUTER_KEY = 9
+ERROR_REPORT = 10
+
+# Error codes
+UNSUPPORTED_VERSION = 4
+
+HEADER = struct.Struct("!BBHI")
+PREFIX = struct.Struct("!BBBx")
+ASN = struct.Struct("!I")
+
+# Largest PDU accepted
+MAX_PDU_LENGTH = 1 << 16
+
+
+def pack_pdu(version, pdu_type, session, payload=""):
+    """Return the bytes of a PDU."""
+    return HEADER.pack(version, pdu_type, session,
+                       HEADER.size + len(payload)) + payload
+
+
+def recv_exactly(sock, length):
+    """Read `length' bytes from `sock'."""
+
+    chunks = []
+    while length > 0:
+        chunk = sock.recv(length)
+        if not chunk:
+            raise CriticalException("RTR connection closed by the cache")
+        chunks.append(chunk)
+        length -= len(chunk)
+    return "".join(chunks)
+
+
+def read_pdu(sock):
+    """Return the (version, type, session or error code, payload) of a PDU."""
+
+    version, pdu_type, session, length = HEADER.unpack(
+        recv_exactly(sock, HEADER.size))
+    if length < HEADER.size or length > MAX_PDU_LENGTH:
+        raise CriticalException("invalid RTR PDU length %d" % length)
+    return version, pdu_type, session, recv_exactly(sock,
+                                                     length - HEADER.size)
+
+
+def parse_prefix(pdu_type, payload):
+    """
+    Return the (announce, packed prefix, prefix length, max length, asn)
+    tuple of an IPv4 or IPv6 prefix PDU.
+    """
+
+    flags, length, max_length = PREFIX.unpack(payload[:PREFIX.size])
+    width = 4 if pdu_type == IPV4_PREFIX else 16
+    packed = payload[PREFIX.size:PREFIX.size + width]
+    asn = ASN.unpack(payload[PREFIX.size + width:])[0]
+    return bool(flags & 1), packed, length, max_length, asn
+
+
+class RTRClient(object):
+    """
+    Client of an RTR validator cache keeping `rad_tree' up to date.
+
+    `fetch' retrieves the changes since the last serial, `apply' applies
+    them to the tree. They are separated so that the network part can run
+    in a thread, and the tree be modified where it is read.
+    """
+
+    def __init__(self, host, port, rad_tree=None, version=1, timeout=30):
+        self.host = host
+        self.port = port
+        self.rad_tree = Radix() if rad_tree is None else rad_tree
+        self.version = version
+        self.timeout = timeout
+        self.sock = None
+        self.session_id = None
+        self.serial = None
+        self.refresh = 3600
+        # (packed, length, asn) -> list of the max lengths of the ROAs
+        self.roas = dict()
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port),
+                                             self.timeout)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def send_query(self, reset):
+        """Send a Reset Query, or a Serial Query if a session is known."""
+
+        if reset or self.session_id is None:
+            self.sock.sendall(pack_pdu(self.version, RESET_QUERY, 0))
+            return True
+        self.sock.sendall(pack_pdu(self.version, SERIAL_QUERY,
+                                   self.session_id,
+                                   ASN.pack(self.serial)))
+        return False
+
+    def fetch(self, reset=False):
+        """
+        Query the cache and return a (full, changes) tuple. `changes' is the
+        list of (announce, packed prefix, length, max length, asn) tuples,
+        `full' is True if they replace the whole content of the tree.
+        """
+
+        if self.sock is None:
+            self.connect()
+
+        full = self.send_query(reset)
+        changes = []
+        while True:
+            version, pdu_type, session, payload = read_pdu(self.sock)
+
+            if pdu_type == ERROR_REPORT:
+                if session == UNSUPPORTED_VERSION and self.version > 0:
+                    # Downgrade and start again, the cache closes the
+                    # connection after an error
+                    self.version -= 1
+                    self.close()
+                    return self.fetch(True)
+                raise CriticalException("RTR error %d: %s" %
+                                        (session, error_text(payload)))
+
+            elif pdu_type == SERIAL_NOTIFY:
+                continue
+
+            elif pdu_type == CACHE_RESET:
+                # The cache cannot send the changes, get everything
+                full = self.send_query(True)
+                changes = []
+
+            elif pdu_type == CACHE_RESPONSE:
+                if not full and session != self.session_id:
+                    raise CriticalException("RTR session changed")
+                self.session_id = session
+
+            elif pdu_type in (IPV4_PREFIX, IPV6_PREFIX):
+                changes.append(parse_prefix(pdu_type, payload))
+
+            elif pdu_type == ROUTER_KEY:
+                # BGPsec router keys are not used
+                continue
+
+            elif pdu_type == END_OF_DATA:
+                self.serial = ASN.unpack(payload[:ASN.size])[0]
+                if version > 0:
+                    self.refresh = ASN.unpack(payload[4:8])[0]
+                return full, changes
+
+            else:
+                raise CriticalException("unknown RTR PDU type %d" % pdu_type)
+
+    def apply(self, full, changes):
+        """Apply the result of `fetch' to the tree."""
+
+        if full:
+            for node in self.rad_tree.nodes():
+                self.rad_tree.delete(node.prefix)
+            self.roas = dict()
+
+        for announce, packed, length, max_length, asn in changes:
+            key = (packed, length, asn)
+            if announce:
+                max_lengths = self.roas.setdefault(key, [])
+                max_lengths.append(max_length)
+            else:
+                max_lengths = self.roas.get(key, None)
+                if max_lengths is None or max_length not in max_lengths:
+                    logger.warning("withdraw of an unknown ROA %r", key)
+                    continue
+                max_lengths.remove(max_length)
+
+            node = self.rad_tree.search_exact(packed=packed, masklen=length)
+            if len(max_lengths):
+                if node is None:
+                    node = self.rad_tree.add(packed=packed, masklen=length)
+                node.data[asn] = max(max_lengths)
+                continue
+
+            del self.roas[key]
+            if node is not None:
+                node.data.pop(asn, None)
+                if len(node.data) == 0:
+                    self.rad_tree.delete(packed=packed, masklen=length)
+
+    def update(self, reset=False):
+        """Fetch and apply the changes, return their number."""
+
+        full, changes = self.fetch(reset)
+        self.apply(full, changes)
+        return len(changes)
+
+
+def error_text(payload):
+    """Return the text of an Error Report PDU."""
+
+    try:
+        pdu_length = ASN.unpack(payload[:4])[0]
+        text_start = 4 + pdu_length
+        text_length = ASN.unpack(payload[text_start:text_start + 4])[0]
+        return payload[text_start + 4:text_start + 4 + text_length]
+    except struct.error:
+        return ""
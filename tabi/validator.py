@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016 ANSSI
+# This file is part of the tabi project licensed under the MIT license.
+
+# Batch origin validation of (prefix, ASN) pairs with NumPy
+#
+# ROAs and route objects are compiled into sorted arrays of keys, one array
+# per address family and prefix length. A key is the network masked to the
+# prefix length followed by the ASN, so that checking if an entry covers a
+# prefix announced by an ASN is a `searchsorted' lookup per prefix length.
+
+import socket
+
+from csv import reader
+
+import numpy
+
+from tabi.helpers import CriticalException, default_opener, as_prefix
+
+# Size of the packed addresses of each address family
+FAMILY_WIDTHS = {socket.AF_INET: 4, socket.AF_INET6: 16}
+
+
+def prefix_masks(width):
+    """Return the uint8 masks of every prefix length for `width' bytes."""
+
+    bits = numpy.tri(8 * width + 1, 8 * width, -1, dtype=numpy.uint8)
+    return numpy.packbits(bits, axis=1)
+
+
+MASKS = dict((family, prefix_masks(width))
+             for family, width in FAMILY_WIDTHS.iteritems())
+
+
+def make_keys(addresses, asns, mask):
+    """
+    Return the keys of `addresses', a uint8 matrix of packed addresses,
+    masked with `mask' and followed by the big endian `asns'.
+    """
+
+    count, width = addresses.shape
+    matrix = numpy.empty((count, width + 4), dtype=numpy.uint8)
+    matrix[:, :width] = addresses & mask
+    matrix[:, width:] = asns.astype(">u4").view(numpy.uint8).reshape(count, 4)
+    return matrix.view("S%d" % (width + 4)).ravel()
+
+
+def pack_prefixes(prefixes):
+    """
+    Group parsable `prefixes' by address family. Return a dictionary
+    mapping a family to (indexes, uint8 matrix of addresses, lengths).
+    """
+
+    groups = dict()
+    for i, prefix in enumerate(prefixes):
+        try:
+            prefix = as_prefix(prefix)
+        except CriticalException:
+            continue
+        indexes, packed, lengths = groups.setdefault(prefix.family,
+                                                     ([], [], []))
+        indexes.append(i)
+        packed.append(prefix.packed)
+        lengths.append(prefix.length)
+
+    packed_groups = dict()
+    for family, (indexes, packed, lengths) in groups.iteritems():
+        addresses = numpy.frombuffer("".join(packed), dtype=numpy.uint8)
+        addresses = addresses.reshape(len(indexes), FAMILY_WIDTHS[family])
+        packed_groups[family] = (numpy.array(indexes),
+                                 addresses,
+                                 numpy.array(lengths))
+    return packed_groups
+
+
+class OriginTable(object):
+    """
+    (network, ASN) entries with an integer value, compiled into sorted
+    arrays per address family and prefix length. The value of duplicated
+    entries is combined with `merge'.
+    """
+
+    def __init__(self, merge=max):
+        self.merge = merge
+        self.pending = dict()
+        # (family, length) -> (sorted keys, values)
+        self.arrays = dict()
+
+    def add(self, prefix, asn, value):
+        """Add an entry, raise CriticalException if `prefix' is invalid."""
+
+        prefix = as_prefix(prefix)
+        entries = self.pending.setdefault((prefix.family, prefix.length), {})
+        key = (prefix.packed, asn)
+        if key in entries:
+            value = self.merge(entries[key], value)
+        entries[key] = value
+
+    def compile(self, encode=None):
+        """
+        Build the sorted arrays from the added entries, values are
+        transformed to integers with `encode' if given.
+        """
+
+        for (family, length), entries in self.pending.iteritems():
+            packed, asns = zip(*entries.iterkeys())
+            addresses = numpy.frombuffer("".join(packed), dtype=numpy.uint8)
+            addresses = addresses.reshape(len(packed), FAMILY_WIDTHS[family])
+            keys = make_keys(addresses, numpy.array(asns, dtype=numpy.int64),
+                             MASKS[family][length])
+            values = entries.values()
+            if len(numpy.unique(keys)) != len(keys):
+                # Entries whose prefixes only differ by their host bits
+                merged = dict()
+                for key, value in zip(keys, values):
+                    if key in merged:
+                        value = self.merge(merged[key], value)
+                    merged[key] = value
+                keys = numpy.array(merged.keys(), dtype=keys.dtype)
+                values = merged.values()
+            if encode is not None:
+                values = [encode(value) for value in values]
+            values = numpy.array(values, dtype=numpy.int64)
+            order = numpy.argsort(keys, kind="mergesort")
+            self.arrays[(family, length)] = (keys[order], values[order])
+        self.pending = dict()
+
+    def lookup(self, family, addresses, lengths, asns):
+        """
+        Look up the entries covering a batch of prefixes of `family'.
+        Yield (rows, values): the rows of the prefixes covered by an entry of
+        the same ASN, and the values of these entries.
+        """
+
+        for (entry_family, length), (keys, values) in \
+                self.arrays.iteritems():
+            if entry_family != family:
+                continue
+            covered = lengths >= length
+            if not covered.any():
+                continue
+            queries = make_keys(addresses, asns, MASKS[family][length])
+            positions = numpy.searchsorted(keys, queries)
+            positions = numpy.minimum(positions, len(keys) - 1)
+            found = covered & (keys[positions] == queries)
+            rows = numpy.nonzero(found)[0]
+            if len(rows):
+                yield rows, values[positions[rows]]
+
+
+class OriginValidator(object):
+    """
+    Validate (prefix, ASN) pairs against ROAs and route objects, giving the
+    same "valid" lists as `annotate_route_announce' then
+    `annotate_roa_announce'.
+    """
+
+    def __init__(self):
+        self.roas = OriginTable(max)
+        self.route_objects = OriginTable(frozenset.union)
+        # Route objects values are indexes in this list of IRR sets
+        self.bases = []
+        self.bases_ids = dict()
+
+    def load_roas(self, input, opener=default_opener):
+        """
+        Load a CSV file containing roa entries with columns:
+        asn, prefix, max_length, validity
+        """
+        roas = OriginTable(max)
+        with opener(input) as roa_file:
+            for roa in reader(roa_file, delimiter=","):
+                if roa[3].lower() == "true":
+                    roas.add(roa[1], int(roa[0]), int(roa[2]))
+        roas.compile()
+        self.roas = roas
+
+    def load_route_objects(self, input, opener=default_opener):
+        """
+        Load a CSV file containing route objects with columns:
+        authority, prefix, asn
+        """
+        route_objects = OriginTable(frozenset.union)
+        with opener(input) as ro_file:
+            for ro in reader(ro_file, delimiter=","):
+                route_objects.add(ro[1], int(ro[2]), frozenset([ro[0]]))
+        self.bases = []
+        self.bases_ids = dict()
+        route_objects.compile(self.bases_id)
+        self.route_objects = route_objects
+
+    def bases_id(self, bases):
+        """Return the index of the IRR set `bases' in `self.bases'."""
+
+        bases_id = self.bases_ids.get(bases, None)
+        if bases_id is None:
+            bases_id = self.bases_ids[bases] = len(self.bases)
+            self.bases.append(bases)
+        return bases_id
+
+    def validate(self, prefixes, asns):
+        """
+        Return the list of "valid" lists of the (prefix, ASN) pairs, empty
+        when the pair is not valid. Invalid prefixes are never valid.
+
+        :param prefixes: sequence of prefixes
+        :param asns: sequence of ASN
+        :return: list of lists
+        """
+
+        bases = [None] * len(prefixes)
+        roas = numpy.zeros(len(prefixes), dtype=bool)
+        asns = numpy.array(asns, dtype=numpy.int64)
+
+        for family, (indexes, addresses, lengths) in \
+                pack_prefixes(prefixes).iteritems():
+            family_asns = asns[indexes]
+
+            for rows, max_lengths in self.roas.lookup(family, addresses,
+                                                      lengths, family_asns):
+                valid = lengths[rows] <= max_lengths
+                roas[indexes[rows[valid]]] = True
+
+            for rows, ids in self.route_objects.lookup(family, addresses,
+                                                       lengths, family_asns):
+                for row, bases_id in zip(indexes[rows], ids):
+                    if bases[row] is None:
+                        bases[row] = set()
+                    bases[row].update(self.bases[bases_id])
+
+        results = []
+        for irrs, roa in zip(bases, roas):
+            valid = list(irrs) if irrs is not None else []
+            if roa:
+                valid.append("roa")
+            results.append(valid)
+        return results
+
+    def annotate(self, conflicts):
+        """
+        Annotate the "announce" and "conflict_with" fields of a batch of
+        `conflicts' like `annotate_if_route_objects' then `annotate_if_roa'.
+
+        :param conflicts: list of conflict dictionaries
+        :return: `conflicts'
+        """
+
+        announces = []
+        for conflict in conflicts:
+            announce = conflict.get("announce", None)
+            conflict_with = conflict.get("conflict_with", None)
+            if announce is not None and conflict_with is not None:
+                announces.append(announce)
+                announces.append(conflict_with)
+
+        results = self.validate([announce["prefix"] for announce in announces],
+                                [announce["asn"] for announce in announces])
+        for announce, valid in zip(announces, results):
+            if len(valid) == 0:
+                continue
+            if "valid" in announce:
+                roa = valid[-1] == "roa"
+                if roa:
+                    valid.pop()
+                valid = list(set(announce["valid"]).union(valid))
+                if roa:
+                    valid.append("roa")
+            announce["valid"] = valid
+        return conflicts
@@ -1,13 +1,20 @@
 # -*- coding: utf-8 -*-
 import os
+import socket
 
-from radix import Radix
+from gzip import GzipFile
 from collections import defaultdict
 
+from tabi.rib import Radix
 from tabi.annotate import fill_relation_struct, fill_ro_struct, \
     fill_roa_struct
 from tabi.annotate import annotate_if_roa, annotate_if_route_objects, annotate_if_direct, annotate_if_relation
-from tabi.annotate import annotate_with_type
+from tabi.annotate import annotate_if_relation_index, RelationIndex, AnnotationContext
+from tabi.annotate import annotate_with_type, annotate_with_precedence
+from tabi.annotate import iter_rpsl_objects, fill_rpsl_structs
+from tabi import emulator
+from tabi.emulator import annotate_parallel, fork_annotation_pool
+from tabi.rtr import RTRClient
 
 PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources")
 
@@ -66,6 +73,34 @@ def test_fill_relation_struct():
                                                 'FAKE': {17676, 9737}}}
 
 
+def test_iter_rpsl_objects():
+    with open(os.path.join(PATH, "rpsl", "irr.db")) as rpsl_file:
+        objects = list(iter_rpsl_objects(rpsl_file, ["route6", "aut-num"]))
+    assert [attributes[0] for attributes in objects] == [("route6", "2001:db8::/32"), ("aut-num", "AS17676"),
+                                                         ("aut-num", "AS9737")]
+    assert objects[0][1:3] == [("descr", "Example route continued"), ("origin", "AS17676")]
+
+
+def test_fill_rpsl_structs(tmpdir):
+    dump = tmpdir.join("irr.db.gz")
+    with open(os.path.join(PATH, "rpsl", "irr.db")) as rpsl_file:
+        gzip_file = GzipFile(str(dump), "w")
+        gzip_file.write(rpsl_file.read())
+        gzip_file.close()
+    rad_tree = Radix()
+    relations_dict = dict()
+    fill_rpsl_structs(str(dump), rad_tree, relations_dict)
+    assert [(node.prefix, node.data) for node in rad_tree] == [("60.145.0.0/16", {17676: {"jpnic"}}),
+                                                             ("2001:db8::/32", {17676: {"jpnic"}})]
+    # The organisation and mntner objects are skipped
+    assert relations_dict == {"organisations": {"ORG-EX1-TEST": {17676, 9737}},
+                              "organisations_reverse": {17676: {"ORG-EX1-TEST"}, 9737: {"ORG-EX1-TEST"}},
+                              "contacts": {"JD1-TEST": {17676}},
+                              "contacts_reverse": {17676: {"JD1-TEST"}},
+                              "maintainers": {"MAINT-AS17676": {17676}, "MAINT-AS9737": {9737}},
+                              "maintainers_reverse": {17676: {"MAINT-AS17676"}, 9737: {"MAINT-AS9737"}}}
+
+
 def test_annotate_if_valid_ok():
     file = os.path.join(PATH, "conflict_annotation", "inputs", "ro_file")
     ro_rad_tree = Radix()
@@ -463,3 +498,153 @@ def test_annotate_with_type_valid():
                 "conflict_with": {"prefix": "1.0.128.0/17", "asn": 9737}, "asn": 9737, "direct": True}
     annotate_with_type(inp_dict)
     assert inp_dict["type"] == "VALID"
+
+
+def test_annotate_with_precedence_valid():
+    file = os.path.join(PATH, "conflict_annotation", "inputs", "roa_file")
+    rpki_rad_tree = Radix()
+    fill_roa_struct(file, rpki_rad_tree)
+    called = []
+    inp_dict = {"timestamp": 1445817600.0, "collector": "rrc01", "peer_as": 13030, "peer_ip": "195.66.224.175",
+                "announce": {"prefix": "212.234.194.0/24", "asn": 16071, "as_path": "13030 3491 4651 9737 16071"},
+                "conflict_with": {"prefix": "212.234.194.0/24", "asn": 16072}, "asn": 16072}
+    funcs = [lambda c: annotate_if_roa(rpki_rad_tree, c, announce_only=True),
+             lambda c: called.append(c), annotate_if_direct]
+    annotate_with_precedence(funcs, inp_dict)
+    assert inp_dict["type"] == "VALID"
+    assert inp_dict["announce"]["valid"] == ["roa"]
+    assert "valid" not in inp_dict["conflict_with"]
+    assert called == []
+
+
+def test_annotate_with_precedence_direct():
+    inp_dict = {"timestamp": 1445817600.0, "collector": "rrc01", "peer_as": 13030, "peer_ip": "195.66.224.175",
+                "announce": {"prefix": "1.0.128.0/24", "asn": 23969, "as_path": "13030 3491 4651 9737 23969"},
+                "conflict_with": {"prefix": "1.0.128.0/17", "asn": 9737}, "asn": 9737}
+    annotate_with_precedence([annotate_if_direct], inp_dict)
+    assert inp_dict["type"] == "DIRECT"
+
+
+def test_relation_index():
+    relations_dict = defaultdict(set)
+    file = os.path.join(PATH, "conflict_annotation", "inputs", "maintainers_file")
+    fill_relation_struct(file, relations_dict, "maintainers")
+    file = os.path.join(PATH, "conflict_annotation", "inputs", "organisations_file")
+    fill_relation_struct(file, relations_dict, "organisations")
+    relations_dict["contacts_reverse"] = {9737: {"C1"}, 202214: {"C1"}, 30896: {"C2"}}
+    index = RelationIndex(relations_dict)
+    assert index.groups[17676].organisations is index.groups[9737].organisations
+    asns = [37554, 202214, 17676, 9737, 30896, 21242, 12322]
+    for as1 in asns:
+        for as2 in asns:
+            expected = {"announce": {"asn": as1}, "conflict_with": {"asn": as2}}
+            result = {"announce": {"asn": as1}, "conflict_with": {"asn": as2}}
+            annotate_if_relation(relations_dict, expected)
+            annotate_if_relation_index(index, result)
+            assert result == expected
+    assert index.relations(17676, 202214) == ["contact"]
+
+
+def test_annotation_context_cache():
+    roa_file = os.path.join(PATH, "conflict_annotation", "inputs", "roa_file")
+    ro_file = os.path.join(PATH, "conflict_annotation", "inputs", "ro_file")
+    context = AnnotationContext(full_annotation=True)
+    context.load_roas(roa_file)
+    context.load_route_objects(ro_file)
+
+    def conflict(peer_as):
+        return {"timestamp": 1445817600.0, "collector": "rrc01", "peer_as": peer_as, "peer_ip": "195.66.224.175",
+                "announce": {"prefix": "212.234.194.0/24", "asn": 16071,
+                             "as_path": "%d 3491 16072 16071" % peer_as},
+                "conflict_with": {"prefix": "212.234.194.0/24", "asn": 16072}, "asn": 16072}
+
+    first = context.annotate(conflict(13030))
+    second = context.annotate(conflict(3356))
+    assert (context.hits, context.misses) == (1, 1)
+    assert first["type"] == second["type"] == "VALID"
+    assert second["announce"]["valid"] == ["roa"]
+    assert second["conflict_with"]["valid"] == ["roa"]
+    assert second["direct"] is True
+    assert second["announce"]["valid"] is not first["announce"]["valid"]
+
+    # Reloading metadata invalidates the cache
+    context.load_roas(roa_file)
+    assert len(context.cache) == 0
+    context.annotate(conflict(13030))
+    assert context.misses == 2
+
+
+def test_annotation_context_reload(tmpdir):
+    roa_file = tmpdir.join("roa_file")
+    roa_file.write("16071,212.234.194.0/24,28,True\n")
+    context = AnnotationContext()
+    context.load_roas(str(roa_file))
+
+    def conflict():
+        return {"announce": {"prefix": "212.234.194.0/24", "asn": 16071, "as_path": "1 16071"},
+                "conflict_with": {"prefix": "212.234.0.0/16", "asn": 1}, "asn": 1}
+
+    assert context.annotate(conflict())["type"] == "VALID"
+    assert context.reload() == []
+
+    snapshot = context.snapshot
+    roa_file.write("16072,212.234.194.0/24,28,True\n")
+    roa_file.setmtime(roa_file.mtime() + 10)
+    assert context.reload() == ["roas"]
+    assert context.snapshot is not snapshot
+    assert context.annotate(conflict())["type"] == "DIRECT"
+    # The previous snapshot is left untouched
+    assert snapshot.roa_rad_tree.search_exact("212.234.194.0/24").data == {16071: 28}
+
+    roa_file.write("16071,212.234.194.0/24,28,True\n")
+    context.request_reload().join()
+    assert context.reloads == 2
+    assert context.annotate(conflict())["type"] == "VALID"
+
+
+def test_annotate_parallel(tmpdir):
+    roa_file = tmpdir.join("roa_file")
+    roa_file.write("16071,212.234.194.0/24,28,True\n")
+    context = AnnotationContext()
+    context.load_roas(str(roa_file))
+
+    def conflicts():
+        for i in range(10):
+            if i == 6:
+                yield {"type": "STORM", "peer_as": 1}
+                # Conflicts after the reload are annotated with the new ROA
+                roa_file.write("16072,212.234.194.0/24,24,True\n")
+                context.load_roas(str(roa_file))
+            yield {"announce": {"prefix": "212.234.194.0/24", "asn": 16071, "as_path": "%d 16071" % i},
+                   "conflict_with": {"prefix": "212.234.0.0/16", "asn": 1}, "asn": 1}
+
+    results = list(annotate_parallel(context, conflicts(), 2, batch_size=3, max_batches=2))
+    assert [conflict.get("announce", {}).get("as_path") for conflict in results] == \
+        ["%d 16071" % i for i in range(6)] + [None] + ["%d 16071" % i for i in range(6, 10)]
+    assert [conflict["type"] for conflict in results] == ["VALID"] * 6 + ["STORM"] + ["ABNORMAL"] * 4
+    # The statistics of the annotation processes are collected
+    assert context.hits + context.misses == 10
+
+
+def test_annotate_parallel_rtr(monkeypatch):
+    context = AnnotationContext()
+    context.rtr = RTRClient("localhost", 0)
+    context.invalidate()
+    roa = (True, socket.inet_aton("212.234.194.0"), 24, 28, 16071)
+    forks = []
+    monkeypatch.setattr(emulator, "fork_annotation_pool",
+                        lambda *args: forks.append(args) or fork_annotation_pool(*args))
+
+    def conflicts():
+        for i in range(9):
+            if i == 3:
+                context.rtr_changes.append((False, [roa]))
+            elif i == 6:
+                context.rtr_changes.append((False, [(False,) + roa[1:]]))
+            yield {"announce": {"prefix": "212.234.194.0/24", "asn": 16071, "as_path": "6450%d 16071" % i},
+                   "conflict_with": {"prefix": "212.234.0.0/16", "asn": 1}, "asn": 1}
+
+    results = list(emulator.annotate_parallel(context, conflicts(), 2, batch_size=3, max_batches=1))
+    # The ROA changes are sent to the processes instead of forking them again
+    assert [conflict["type"] for conflict in results] == ["ABNORMAL"] * 3 + ["VALID"] * 3 + ["ABNORMAL"] * 3
+    assert len(forks) == 1
@@ -0,0 +1,71 @@
+from tabi.aspath import ASPathTable, canonical_as_path
+from tabi.helpers import CriticalException, LRUCache
+
+
+class TestASPath:
+
+    def test_intern(self):
+        """Check that the same AS_PATH object is returned for equal strings."""
+
+        table = ASPathTable()
+        path = table.get("1 2 3")
+        assert table.get("".join(["1 2", " 3"])) is path
+        assert path.path == "1 2 3"
+        assert path.origins == (3,)
+        assert path.origin == 3
+        assert len(table) == 1
+
+    def test_as_set(self):
+        """Check origins extracted from an AS_SET."""
+
+        path = ASPathTable().get("1 2 {3,4}")
+        assert path.origins == (3, 4)
+        assert path.origin == frozenset([3, 4])
+        assert path.canonical == [[1], [2], [3, 4]]
+
+    def test_canonical(self):
+        """Check that the canonical form is the one of canonical_as_path()."""
+
+        path = ASPathTable().get("1 1 2 2 2 3")
+        assert path.canonical == canonical_as_path("1 1 2 2 2 3")
+        assert path.canonical is path.canonical
+
+    def test_invalid(self):
+        """Check that invalid AS_PATH are rejected and not stored."""
+
+        table = ASPathTable()
+        try:
+            table.get("1 {bgp}")
+            assert False
+        except CriticalException:
+            pass
+        assert len(table) == 0
+
+    def test_eviction(self):
+        """Check that the least recently used AS_PATH are evicted."""
+
+        table = ASPathTable(maxsize=2)
+        path1 = table.get("1")
+        table.get("2")
+        assert table.get("1") is path1
+        table.get("3")
+        assert len(table) == 2
+        assert "2" not in table.entries
+        assert "1" in table.entries
+
+
+class TestLRUCache:
+
+    def test_evict_callback(self):
+        """Check that evicted entries are given to the callback."""
+
+        evicted = []
+        cache = LRUCache(2, on_evict=lambda k, v: evicted.append((k, v)))
+        cache["a"] = 1
+        cache["b"] = 2
+        cache.get("a")
+        cache["c"] = 3
+        assert evicted == [("b", 2)]
+        assert cache.hits == 1
+        assert cache.get("b") is None
+        assert cache.misses == 1
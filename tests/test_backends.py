@@ -0,0 +1,246 @@
+import os
+import sys
+import random
+import socket
+import functools
+
+import pytest
+
+from tabi.backends import new_tree, mask_packed, parse_key
+from tabi.backends.hashed import HashTree
+from tabi.backends.spill import SpillTree, MIN_NODES
+from tabi.helpers import check_python_radix
+from tabi.core import process_update
+from tabi.rib import EmulatedRIB
+
+from test_core import message
+
+
+def random_prefixes(generator, count):
+  prefixes = []
+  for _ in range(count):
+    if generator.random() < 0.8:
+      length = generator.choice([8, 12, 16, 20, 22, 23, 24, 24, 24, 32])
+      address = ".".join(str(generator.choice([1, 2, 10, 192, generator.randint(0, 255)]))
+                         for _ in range(4))
+    else:
+      length = generator.choice([0, 16, 32, 40, 48, 64, 128])
+      address = "2001:db8:%x:%x::%x" % (generator.randint(0, 3), generator.randint(0, 0xffff),
+                                         generator.randint(0, 0xffff))
+    prefixes.append("%s/%d" % (address, length))
+  return prefixes
+
+
+class BackendTests:
+  """Compare a backend with py-radix."""
+
+  backend = None
+
+  def trees(self, prefixes):
+    radix = pytest.importorskip("radix")
+    tree = new_tree(self.backend)
+    reference = radix.Radix()
+    for prefix in prefixes:
+      tree.add(prefix).data["prefix"] = prefix
+      reference.add(prefix).data["prefix"] = prefix
+    return tree, reference
+
+  def test_searches(self):
+    """Check that the searches return the nodes of py-radix."""
+
+    generator = random.Random(2807)
+    tree, reference = self.trees(random_prefixes(generator, 3000))
+
+    assert tree.prefixes() == reference.prefixes()
+    assert sorted(node.prefix for node in tree) == sorted(node.prefix for node in reference)
+    for prefix in random_prefixes(generator, 500):
+      assert [node.prefix for node in tree.search_covering(prefix)] == \
+          [node.prefix for node in reference.search_covering(prefix)]
+      assert sorted(node.prefix for node in tree.search_covered(prefix)) == \
+          sorted(node.prefix for node in reference.search_covered(prefix))
+      exact = tree.search_exact(prefix)
+      expected = reference.search_exact(prefix)
+      assert (exact and exact.data) == (expected and expected.data)
+
+  def test_packed(self):
+    """Check the methods called with a packed prefix."""
+
+    tree = new_tree(self.backend)
+    node = tree.add(packed="\x01\x02\x03\x04", masklen=16)
+    assert (node.prefix, node.network, node.prefixlen) == ("1.2.0.0/16", "1.2.0.0", 16)
+    assert tree.search_exact(packed="\x01\x02\x00\x00", masklen=16) is node
+    assert tree.search_covering(packed="\x01\x02\x03\x00", masklen=24) == [node]
+    assert tree.search_covered(packed="\x01\x00\x00\x00", masklen=8) == [node]
+    tree.delete(packed="\x01\x02\x00\x00", masklen=16)
+    assert tree.nodes() == []
+
+  def test_delete(self):
+    """Check that deleted prefixes are not found."""
+
+    generator = random.Random(2808)
+    prefixes = random_prefixes(generator, 3000)
+    tree, reference = self.trees(prefixes)
+    for prefix in prefixes[::2]:
+      if reference.search_exact(prefix) is not None:
+        tree.delete(prefix)
+        reference.delete(prefix)
+    assert tree.prefixes() == reference.prefixes()
+
+    try:
+      tree.delete(prefixes[0])
+      assert False
+    except KeyError:
+      pass
+
+  def test_rib(self):
+    """Check that the RIB gives the same conflicts with the backend."""
+
+    generator = random.Random(2807)
+    prefixes = ["1.0.0.0/8", "1.2.0.0/16", "1.2.3.0/24", "1.2.4.0/24", "2001:db8::/32", "2001:db8:1::/48"]
+    rib = EmulatedRIB(self.backend)
+    reference_rib = EmulatedRIB()
+    for timestamp in range(2000):
+      update = message(timestamp, generator.choice(prefixes), generator.choice([None, 1, 2, 3]),
+                       generator.choice([64496, 64497, 64498]))
+      routes = []
+      reference_routes = []
+      assert list(process_update(rib, update, routes=routes)) == \
+          list(process_update(reference_rib, update, routes=reference_routes))
+      assert routes == reference_routes
+    assert [(node.prefix, node.data) for node in rib.nodes()] == \
+        [(node.prefix, node.data) for node in reference_rib.nodes()]
+
+
+class TestArrayTree(BackendTests):
+
+  backend = "nparray"
+
+  def setup_method(self, method):
+    pytest.importorskip("numpy")
+
+  def test_rebuild(self):
+    """Check the searches while nodes are pending or deleted."""
+
+    from tabi.backends.nparray import ArrayTree
+    tree = ArrayTree()
+    for i in range(3000):
+      tree.add("10.%d.%d.0/24" % (i // 256, i % 256))
+    table = tree.tables[socket.AF_INET]
+    assert len(table.keys) > 0 and len(table.pending) > 0
+
+    tree.delete("10.0.0.0/24")
+    assert table.deleted == 1
+    assert tree.search_exact("10.0.0.0/24") is None
+    assert [node.prefix for node in tree.search_covered("10.0.0.0/23")] == ["10.0.1.0/24"]
+    assert len(tree.nodes()) == 2999
+
+
+class TestHashTree(BackendTests):
+
+  backend = "hashed"
+
+  def test_fallback(self, monkeypatch):
+    """Check that the hashed backend is used without py-radix."""
+
+    monkeypatch.setitem(sys.modules, "radix", None)
+    assert isinstance(new_tree(), HashTree)
+    assert check_python_radix() == "hashed"
+
+
+class TestSpillTree(BackendTests):
+
+  backend = functools.partial(SpillTree, max_nodes=MIN_NODES)
+
+  def test_spill(self):
+    """Check that cold nodes are spilled and faulted back in."""
+
+    tree = SpillTree(max_nodes=MIN_NODES)
+    for i in range(3000):
+      tree.add("10.%d.%d.0/24" % (i // 256, i % 256)).data["index"] = i
+    assert len(tree.used) <= MIN_NODES
+    assert tree.spilled[socket.AF_INET][24] == 3000 - len(tree.used)
+
+    node = tree.search_exact("10.0.0.0/24")
+    assert node.data == {"index": 0}
+    node.data["index"] = -1
+    assert [node.data for node in tree.search_covering("10.0.1.1/32")] == [{"index": 1}]
+    for i in range(3000, 5000):
+      tree.add("10.%d.%d.0/24" % (i // 256, i % 256))
+    assert tree.search_exact("10.0.0.0/24").data == {"index": -1}
+    assert len(tree.nodes()) == 5000
+    # Spilled nodes are iterated without being restored
+    assert sorted(node.prefix for node in tree) == sorted(tree.prefixes())
+    assert len(tree.used) <= MIN_NODES
+    tree.close()
+
+  def test_fork(self):
+    """Check that a forked process uses a copy of the database."""
+
+    tree = SpillTree(max_nodes=MIN_NODES)
+    for i in range(3000):
+      tree.add("10.%d.%d.0/24" % (i // 256, i % 256)).data["index"] = i
+    tree.commit()
+    path = tree.path
+    pid = os.fork()
+    if pid == 0:
+      status = 1
+      try:
+        node = tree.search_exact("10.0.0.0/24")
+        node.data["index"] = -1
+        tree.add("192.0.2.0/24")
+        if node.data == {"index": -1} and tree.path != path:
+          status = 0
+        tree.close()
+      finally:
+        os._exit(status)
+    assert os.waitpid(pid, 0)[1] == 0
+    assert os.path.exists(path)
+    assert tree.search_exact("10.0.0.0/24").data == {"index": 0}
+    tree.close()
+    assert not os.path.exists(path)
+
+  def test_covered_kept(self):
+    """Check that the nodes returned by search_covered are not spilled."""
+
+    tree = SpillTree(max_nodes=MIN_NODES)
+    for i in range(3000):
+      tree.add("10.%d.%d.0/24" % (i // 256, i % 256))
+    nodes = tree.search_covered("10.0.0.0/8")
+    assert len(nodes) == 3000
+    for node in nodes:
+      node.data["seen"] = True
+    assert all(node.data == {"seen": True} for node in tree.nodes())
+    tree.add("192.0.2.0/24")
+    assert len(tree.used) <= MIN_NODES
+    tree.close()
+
+  def test_summary(self):
+    """Check that searches of unknown prefixes do not read the database."""
+
+    tree = SpillTree(max_nodes=MIN_NODES)
+    for i in range(3000):
+      tree.add("10.%d.%d.0/24" % (i // 256, i % 256))
+    db, tree.db = tree.db, None
+    assert tree.search_covering("192.0.2.1/32") == []
+    assert tree.search_exact("2001:db8::/32") is None
+    tree.db = db
+    tree.close()
+
+
+class TestHelpers:
+
+  def test_mask_packed(self):
+    """Check that host bits are unset."""
+
+    assert mask_packed("\x01\x02\x03\x04", 32) == "\x01\x02\x03\x04"
+    assert mask_packed("\x01\x02\x03\x04", 16) == "\x01\x02\x00\x00"
+    assert mask_packed("\x01\xff\x03\x04", 12) == "\x01\xf0\x00\x00"
+    assert mask_packed("\x01\x02\x03\x04", 0) == "\x00\x00\x00\x00"
+
+  def test_parse_key(self):
+    """Check the prefixes given like to py-radix."""
+
+    assert parse_key("1.2.3.4/16") == (2, "\x01\x02\x00\x00", 16)
+    assert parse_key("1.2.3.4", 16) == (2, "\x01\x02\x00\x00", 16)
+    assert parse_key("1.2.3.4") == (2, "\x01\x02\x03\x04", 32)
+    assert parse_key(packed="\x01\x02\x03\x04") == (2, "\x01\x02\x03\x04", 32)
@@ -0,0 +1,329 @@
+import pytest
+
+from tabi.conflicts import ConflictAggregator, ConflictGuard, ConflictTracker, \
+    FlapDamping, PeerStormDetector
+from tabi.core import InternalMessage as EmulatorMessage
+from tabi.rib import EmulatedRIB as EmulatorRIB
+from tabi.emulator import detect_conflicts, process_message as emulator_process_message
+from tabi.parallel.core import InternalMessage, Route, Hijack
+from tabi.parallel.rib import EmulatedRIB
+
+
+route4 = InternalMessage(0, "collector", 64496, "127.0.0.1",
+                         "1.2.0.0/16", 64497, "64496 64497")
+
+
+def hijack_message(timestamp, peer_as, peer_ip="127.0.0.1", prefix="1.2.3.0/24"):
+  return InternalMessage(timestamp, "collector", peer_as, peer_ip,
+                         prefix, 666, "%d 666" % peer_as)
+
+
+def withdraw_message(timestamp, peer_as, peer_ip="127.0.0.1", prefix="1.2.3.0/24"):
+  return InternalMessage(timestamp, "collector", peer_as, peer_ip,
+                         prefix, None, None)
+
+
+class TestConflictTracker:
+
+  def setup_method(self, method):
+    self.rib = EmulatedRIB()
+    Route(self.rib).process(route4)
+    self.hijack = Hijack(self.rib, "U")
+
+  def track(self, tracker, update):
+    return tracker.process(update, self.hijack.process(update))
+
+  def test_lifecycle(self):
+    """Check that start, summary and end events are reported."""
+
+    tracker = ConflictTracker(summary_interval=10)
+
+    events = self.track(tracker, hijack_message(1, 64496))
+    assert len(events) == 1
+    assert events[0]["event"] == "start"
+    assert events[0]["conflict_with"]["asn"] == 64497
+
+    # Same conflict seen from another peer, nothing to report
+    assert self.track(tracker, hijack_message(2, 64498, "127.0.0.2")) == []
+
+    events = self.track(tracker, hijack_message(11, 64496))
+    assert [e["event"] for e in events] == ["summary"]
+    assert events[0]["peers"] == 2
+    assert events[0]["updates"] == 3
+
+    # The conflict ends when the last peer withdraws it
+    assert tracker.process(withdraw_message(12, 64496), []) == []
+    events = tracker.process(withdraw_message(13, 64498, "127.0.0.2"), [])
+    assert [e["event"] for e in events] == ["end"]
+    assert events[0]["first_seen"] == 1
+    assert events[0]["last_seen"] == 11
+    assert len(tracker.conflicts) == 0
+    assert tracker.peers == {}
+
+  def test_summaries(self):
+    """Check that conflicts without updates are summarized."""
+
+    tracker = ConflictTracker(summary_interval=10)
+    self.track(tracker, hijack_message(1, 64496))
+    assert tracker.summaries(5) == []
+
+    # Any update gives the summaries due
+    events = tracker.process(withdraw_message(11, 64498, "127.0.0.2", prefix="1.2.5.0/24"), [])
+    assert [e["event"] for e in events] == ["summary"]
+    assert events[0]["last_seen"] == 1
+
+    assert [e["event"] for e in tracker.summaries(21)] == ["summary"]
+    assert tracker.summaries(22) == []
+
+  def test_implicit_withdraw(self):
+    """Check that a new announce without conflict ends the conflict."""
+
+    tracker = ConflictTracker()
+    self.track(tracker, hijack_message(1, 64496))
+    update = InternalMessage(2, "collector", 64496, "127.0.0.1",
+                             "1.2.3.0/24", 64497, "64496 64497")
+    events = tracker.process(update, [])
+    assert [e["event"] for e in events] == ["end"]
+
+  def test_eviction(self):
+    """Check that evicted conflicts are ended."""
+
+    tracker = ConflictTracker(max_conflicts=1)
+    self.track(tracker, hijack_message(1, 64496, prefix="1.2.3.0/24"))
+    events = self.track(tracker, hijack_message(2, 64496, prefix="1.2.4.0/24"))
+    assert [e["event"] for e in events] == ["start", "end"]
+    assert events[1]["reason"] == "evicted"
+    assert events[1]["announce"]["prefix"] == "1.2.3.0/24"
+    assert len(tracker.peers) == 1
+
+
+def conflict_record(timestamp, peer_as=64496, hijacker=666, victim=64497):
+  return {"timestamp": timestamp, "peer_as": peer_as, "peer_ip": "127.0.0.1",
+          "announce": {"prefix": "1.2.3.0/24", "asn": hijacker},
+          "conflict_with": {"prefix": "1.2.0.0/16", "asn": victim},
+          "asn": victim}
+
+
+class TestConflictAggregator:
+
+  def test_tumbling(self):
+    """Check that a summary is reported per key and window."""
+
+    aggregator = ConflictAggregator(window=60)
+    assert aggregator.add(conflict_record(0)) == []
+    assert aggregator.add(conflict_record(10, peer_as=64498)) == []
+    assert aggregator.add(conflict_record(20, hijacker=667)) == []
+
+    summaries = aggregator.add(conflict_record(61))
+    assert len(summaries) == 2
+    assert summaries[0]["window_start"] == 0
+    assert summaries[0]["window_end"] == 60
+    assert summaries[0]["hijacker_asn"] == 666
+    assert summaries[0]["conflicts"] == 2
+    assert summaries[0]["peers"] == 2
+    assert summaries[1]["hijacker_asn"] == 667
+
+    summaries = aggregator.flush()
+    assert len(summaries) == 1
+    assert summaries[0]["conflicts"] == 1
+    assert summaries[0]["first_seen"] == 0
+
+  def test_tick(self):
+    """Check that windows end without records."""
+
+    aggregator = ConflictAggregator(window=60)
+    assert aggregator.tick(30) == []
+    aggregator.add(conflict_record(0))
+    assert aggregator.tick(59) == []
+    summaries = aggregator.tick(61)
+    assert [s["window_end"] for s in summaries] == [60]
+    assert aggregator.tick(62) == []
+
+  def test_withdraws(self):
+    """Check that withdraws are not counted as conflicts."""
+
+    aggregator = ConflictAggregator(window=60)
+    aggregator.add(conflict_record(0))
+    withdraw = conflict_record(10)
+    withdraw["withdraw"] = withdraw.pop("announce")
+    aggregator.add(withdraw)
+    summaries = aggregator.flush()
+    assert (summaries[0]["conflicts"], summaries[0]["withdraws"]) == (1, 1)
+
+  def test_sliding(self):
+    """Check that a conflict is reported in every window containing it."""
+
+    aggregator = ConflictAggregator(window=60, step=20)
+    aggregator.add(conflict_record(5))
+    summaries = aggregator.add(conflict_record(70, hijacker=667))
+    assert [s["window_end"] for s in summaries] == [20, 40, 60]
+    assert all(s["conflicts"] == 1 for s in summaries)
+
+  def test_ttl(self):
+    """Check that idle keys are forgotten."""
+
+    aggregator = ConflictAggregator(window=10, ttl=100)
+    aggregator.add(conflict_record(0))
+    aggregator.add(conflict_record(50, hijacker=667))
+    assert len(aggregator.keys) == 2
+    aggregator.add(conflict_record(500, hijacker=667))
+    assert aggregator.keys.keys() == [(64497, 667, "1.2.3.0/24")]
+
+    summaries = aggregator.flush()
+    assert summaries[0]["first_seen"] == 500
+
+
+class FakeFile(list):
+  """Messages opened like a file."""
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    pass
+
+
+def emulator_message(timestamp, prefix, origin, peer_as=64496):
+  return EmulatorMessage("U", timestamp, "collector", peer_as, "127.0.0.1",
+                         prefix, origin, "%d %d" % (peer_as, origin))
+
+
+class TestPeerStormDetector:
+
+  def test_incomplete_guard(self):
+    """Check that a guard missing a method cannot be built."""
+
+    class Guard(ConflictGuard):
+
+      def account(self, update, conflicting):
+        return False
+
+    with pytest.raises(TypeError):
+      Guard()
+
+  def setup_method(self, method):
+    self.rib = EmulatorRIB()
+    emulator_process_message(self.rib, "collector",
+                             emulator_message(0, "1.0.0.0/8", 64497, 64499))
+
+  def leak(self, detector, timestamp, count, peer_as=64496):
+    reported = 0
+    for i in range(count):
+      msg = emulator_message(timestamp, "1.%d.0.0/16" % i, 666, peer_as)
+      _, _, conflicts = emulator_process_message(self.rib, "collector", msg,
+                                                 storm_detector=detector)
+      reported += len(conflicts)
+    return reported
+
+  def test_storm(self):
+    """Check that the conflicts of a leaking peer are summarized."""
+
+    detector = PeerStormDetector(threshold=3, window=60)
+    assert self.leak(detector, 1, 10) == 3
+    events = detector.pop_events()
+    assert len(events) == 1
+    assert events[0]["type"] == "STORM"
+    assert events[0]["event"] == "start"
+    assert events[0]["peer_as"] == 64496
+
+    # Other peers are not affected
+    assert self.leak(detector, 2, 2, peer_as=64498) == 2
+    assert detector.pop_events() == []
+
+    # The routes are still stored in the RIB
+    assert self.rib.search_exact("1.9.0.0/16") is not None
+
+    # The peer calms down during the next window
+    assert self.leak(detector, 100, 1) == 0
+    assert detector.pop_events() == []
+    assert self.leak(detector, 200, 1) == 1
+    events = detector.pop_events()
+    assert [e["event"] for e in events] == ["end"]
+    assert events[0]["updates"] == 11
+    assert events[0]["suppressed"] == 8
+
+
+  def test_expire(self):
+    """Check that the storm of a quiet peer ends with other updates."""
+
+    detector = PeerStormDetector(threshold=3, window=60)
+    self.leak(detector, 1, 10)
+    detector.pop_events()
+
+    # The leaking peer does not send updates anymore
+    assert self.leak(detector, 100, 1, peer_as=64498) == 1
+    assert detector.pop_events() == []
+    assert self.leak(detector, 200, 1, peer_as=64498) == 1
+    events = detector.pop_events()
+    assert [(e["event"], e["peer_as"]) for e in events] == [("end", 64496)]
+    assert detector.storms == {}
+
+    self.leak(detector, 300, 10)
+    detector.pop_events()
+    detector.expire(400)
+    assert detector.pop_events() == []
+    detector.expire(430)
+    assert [e["event"] for e in detector.pop_events()] == ["end"]
+
+  def test_tracker(self):
+    """Check that the conflicts of a peer in storm are still tracked."""
+
+    bview = [EmulatorMessage("F", 0, "collector", 64499, "127.0.0.2",
+                             "1.0.0.0/8", 64497, "64499 64497")]
+    updates = [emulator_message(1, "1.%d.0.0/16" % i, 666) for i in range(10)]
+    tracker = ConflictTracker()
+    records = list(detect_conflicts("collector", [bview, updates], opener=FakeFile,
+                                    format=lambda collector, data: [data],
+                                    conflict_tracker=tracker,
+                                    storm_detector=PeerStormDetector(threshold=3)))
+    # Only the start of the conflicts before the storm are reported
+    assert [r.get("type", "conflict") for r in records] == ["conflict"] * 3 + ["STORM"]
+    assert len(tracker.conflicts) == 10
+
+
+class TestFlapDamping:
+
+  def setup_method(self, method):
+    self.rib = EmulatorRIB()
+    emulator_process_message(self.rib, "collector",
+                             emulator_message(0, "1.2.0.0/16", 64497, 64499))
+
+  def flap(self, damping, timestamp, origin=666, peer_as=64496):
+    msg = emulator_message(timestamp, "1.2.3.0/24", origin, peer_as)
+    _, _, conflicts = emulator_process_message(self.rib, "collector", msg,
+                                               flap_damping=damping)
+    return len(conflicts)
+
+  def test_damping(self):
+    """Check that a flapping prefix is suppressed then reused."""
+
+    damping = FlapDamping(penalty=1000, suppress_limit=2000,
+                          reuse_limit=750, half_life=10)
+    assert self.flap(damping, 1, 666) == 1
+    assert self.flap(damping, 1, 667) > 0
+    assert self.flap(damping, 1, 666) > 0
+    assert damping.pop_events() == []
+
+    assert self.flap(damping, 1, 667) == 0
+    events = damping.pop_events()
+    assert [e["event"] for e in events] == ["suppressed"]
+    assert events[0]["type"] == "DAMPING"
+    assert events[0]["prefix"] == "1.2.3.0/24"
+    assert self.flap(damping, 2, 666) == 0
+
+    # 3800 decays under 750 in 28 seconds
+    assert self.flap(damping, 30, 666) == 1
+    events = damping.pop_events()
+    assert [e["event"] for e in events] == ["reused"]
+    assert events[0]["suppressed"] == 2
+
+  def test_stable(self):
+    """Check that the same origin announced by many peers is not damped."""
+
+    damping = FlapDamping(penalty=1000, suppress_limit=2000,
+                          reuse_limit=750, half_life=10)
+    for peer_as in range(64496, 64506):
+      assert self.flap(damping, 1, peer_as=peer_as) == 1
+    assert self.flap(damping, 2) == 1
+    assert damping.pop_events() == []
+    assert self.rib.search_exact("1.2.3.0/24") is not None
@@ -0,0 +1,55 @@
+import random
+
+from tabi.core import InternalMessage, hijack, route, withdraw, \
+    process_update, NO_CONFLICTS
+from tabi.helpers import Prefix
+from tabi.rib import EmulatedRIB
+
+
+def message(timestamp, prefix, origin, peer_as):
+  as_path = None if origin is None else "%d %d" % (peer_as, origin)
+  return InternalMessage("U" if as_path else "W", timestamp, "collector", peer_as, "127.0.0.%d" % peer_as,
+                         Prefix(prefix), origin, as_path)
+
+
+def reference_update(rib, update, routes):
+  conflicts = list(hijack(rib, update))
+  if update.as_path is None:
+    routes.extend(withdraw(rib, update))
+  else:
+    routes.extend(route(rib, update))
+  return conflicts
+
+
+class TestProcessUpdate:
+
+  def test_same_as_separate_functions(self):
+    """Check that the fused processing gives the outputs and RIB of hijack() then route() or withdraw()."""
+
+    generator = random.Random(2807)
+    prefixes = ["1.0.0.0/8", "1.2.0.0/16", "1.2.3.0/24", "1.2.4.0/24", "2001:db8::/32", "2001:db8:1::/48"]
+    fused_rib = EmulatedRIB()
+    reference_rib = EmulatedRIB()
+    for timestamp in range(2000):
+      update = message(timestamp, generator.choice(prefixes), generator.choice([None, 1, 2, 3]),
+                       generator.choice([64496, 64497, 64498]))
+      fused_routes = []
+      reference_routes = []
+      assert list(process_update(fused_rib, update, routes=fused_routes)) == \
+          reference_update(reference_rib, update, reference_routes)
+      assert fused_routes == reference_routes
+    assert [(node.prefix, node.data) for node in fused_rib.nodes()] == \
+        [(node.prefix, node.data) for node in reference_rib.nodes()]
+
+  def test_no_conflicts(self):
+    """Check the results without conflicts and for default routes."""
+
+    rib = EmulatedRIB()
+    assert process_update(rib, message(0, "1.2.0.0/16", 1, 64496)) is NO_CONFLICTS
+    assert process_update(rib, message(1, "1.2.0.0/16", 1, 64497)) is NO_CONFLICTS
+    assert process_update(rib, message(2, "0.0.0.0/0", 1, 64497)) is None
+    assert len(rib.search_exact("1.2.0.0/16").data) == 2
+
+    # Routes of updates without conflicts are only stored if watched
+    assert process_update(rib, message(3, "1.3.0.0/16", 1, 64497), lambda update: False) is NO_CONFLICTS
+    assert rib.search_exact("1.3.0.0/16") is None
@@ -0,0 +1,207 @@
+import collections
+
+from tabi.conflicts import ConflictTracker, PeerStormDetector
+from tabi.core import InternalMessage as EmulatorMessage
+from tabi.rib import EmulatedRIB as EmulatorRIB
+from tabi.emulator import detect_conflicts, process_message as emulator_process_message
+from tabi.parallel.core import InternalMessage, DuplicateFilter, MessageProcessor, process_message, bview_fake_withdraw
+from tabi.parallel.rib import EmulatedRIB
+
+from test_conflicts import FakeFile
+
+
+class FakeDocument:
+  """Minimal abstracted BGP message."""
+
+  def __init__(self, announces=[], withdraws=[], datatype="U"):
+    self.datatype = datatype
+    self._announces = announces
+    self._withdraws = withdraws
+
+  def announces(self):
+    return self._announces
+
+  def withdraws(self):
+    return self._withdraws
+
+
+update = InternalMessage(2807, "collector", 64496, "127.0.0.1",
+                         "1.2.0.0/16", 64497, "64496 64497")
+update_path = InternalMessage(2808, "collector", 64496, "127.0.0.1",
+                              "1.2.0.0/16", 64497, "64496 64499 64497")
+hijack = InternalMessage(2809, "collector", 64496, "127.0.0.1",
+                         "1.2.3.0/24", 666, "64496 666")
+withdraw = InternalMessage(2810, "collector", 64496, "127.0.0.1",
+                           "1.2.0.0/16", None, None)
+
+
+class TestDuplicates:
+
+  def test_filter(self):
+    """Check that only identical announces are duplicates."""
+
+    duplicates = DuplicateFilter()
+    assert not duplicates.is_duplicate(update)
+    duplicates.remember(update)
+    assert duplicates.is_duplicate(update)
+    assert not duplicates.is_duplicate(update_path)
+    duplicates.forget(withdraw)
+    assert not duplicates.is_duplicate(update)
+
+    # The least recently announced are forgotten
+    duplicates = DuplicateFilter(max_entries=1)
+    duplicates.remember(update)
+    duplicates.remember(hijack)
+    assert not duplicates.is_duplicate(update)
+    assert duplicates.is_duplicate(hijack)
+
+  def test_parallel_process_message(self):
+    """Check that duplicates do not produce messages but refresh the RIB."""
+
+    rib = EmulatedRIB()
+    duplicates = DuplicateFilter()
+
+    rib.set_access_time(0)
+    _, routes, _ = process_message(rib, FakeDocument([update]), duplicates=duplicates)
+    assert len(routes) == 1
+    _, _, hijacks = process_message(rib, FakeDocument([hijack]), duplicates=duplicates)
+    assert len(hijacks) == 1
+
+    rib.set_access_time(1)
+    _, routes, _ = process_message(rib, FakeDocument([update]), duplicates=duplicates)
+    assert routes == []
+    _, _, hijacks = process_message(rib, FakeDocument([hijack]), duplicates=duplicates)
+    assert hijacks == []
+
+    # Refreshed elements are not removed at the end of a bview
+    routes, hijacks = bview_fake_withdraw(rib, "collector", 1, 42, duplicates)
+    assert routes == [] and hijacks == []
+
+    # A new AS_PATH is processed
+    _, routes, _ = process_message(rib, FakeDocument([update_path]), duplicates=duplicates)
+    assert len(routes) == 1
+
+  def test_parallel_new_conflicts(self):
+    """Check that duplicates report the conflicts with routes announced since."""
+
+    rib = EmulatedRIB()
+    rib.set_access_time(0)
+    duplicates = DuplicateFilter()
+    process_message(rib, FakeDocument([update]), duplicates=duplicates)
+    process_message(rib, FakeDocument([hijack]), duplicates=duplicates)
+
+    covering = InternalMessage(2811, "collector", 64500, "127.0.0.2",
+                               "1.0.0.0/8", 64500, "64500")
+    process_message(rib, FakeDocument([covering]), duplicates=duplicates)
+    _, _, hijacks = process_message(rib, FakeDocument([hijack]), duplicates=duplicates)
+    assert [h["conflict_with"]["prefix"] for h in hijacks] == ["1.0.0.0/8"]
+    _, _, hijacks = process_message(rib, FakeDocument([hijack]), duplicates=duplicates)
+    assert hijacks == []
+
+  def test_parallel_keep_asn(self):
+    """Check that announces producing no messages are not remembered."""
+
+    rib = EmulatedRIB()
+    duplicates = DuplicateFilter()
+    process_message(rib, FakeDocument([update]), keep_asn=lambda asn: False,
+                    duplicates=duplicates)
+    assert len(duplicates.as_paths) == 0
+
+  def test_message_processor(self):
+    """Check that a processor gives the messages of process_message."""
+
+    documents = [FakeDocument([update]), FakeDocument([hijack]),
+                 FakeDocument([update_path]), FakeDocument(withdraws=[withdraw])]
+
+    rib = EmulatedRIB()
+    rib.set_access_time(0)
+    expected = ([], [], [])
+    for document in documents:
+      for messages, new in zip(expected, process_message(rib, document, duplicates=DuplicateFilter())):
+        messages.extend(new)
+
+    rib = EmulatedRIB()
+    rib.set_access_time(0)
+    processor = MessageProcessor(rib, duplicates=DuplicateFilter())
+    assert processor.process_all(documents) == expected
+
+  def test_emulator_process_message(self):
+    """Check that the emulator ignores duplicates if asked to."""
+
+    rib = EmulatorRIB()
+    route = EmulatorMessage("U", 0, "collector", 64496, "127.0.0.1",
+                            "1.2.0.0/16", 64497, "64496 64497")
+    moas = EmulatorMessage("U", 1, "collector", 64498, "127.0.0.2",
+                           "1.2.0.0/16", 666, "64498 666")
+
+    emulator_process_message(rib, "collector", route)
+    _, routes, conflicts = emulator_process_message(rib, "collector", moas,
+                                                    suppress_duplicates=True)
+    assert len(list(routes)) == 1 and len(conflicts) == 1
+
+    _, routes, conflicts = emulator_process_message(rib, "collector", moas,
+                                                    suppress_duplicates=True)
+    assert routes == [] and conflicts == []
+
+    _, routes, conflicts = emulator_process_message(rib, "collector", moas)
+    assert len(list(routes)) == 1 and len(conflicts) == 1
+
+  def test_emulator_new_conflicts(self):
+    """Check that duplicates report the conflicts with routes announced since."""
+
+    rib = EmulatorRIB()
+    hijack = EmulatorMessage("U", 0, "collector", 64496, "127.0.0.1",
+                             "1.2.3.0/24", 666, "64496 666")
+    covering = EmulatorMessage("U", 1, "collector", 64498, "127.0.0.2",
+                               "1.2.0.0/16", 64497, "64498 64497")
+
+    emulator_process_message(rib, "collector", hijack, suppress_duplicates=True)
+    emulator_process_message(rib, "collector", covering, suppress_duplicates=True)
+    _, routes, conflicts = emulator_process_message(rib, "collector", hijack,
+                                                    suppress_duplicates=True)
+    assert routes == []
+    assert [c["conflict_with"]["prefix"] for c in conflicts] == ["1.2.0.0/16"]
+    _, _, conflicts = emulator_process_message(rib, "collector", hijack,
+                                               suppress_duplicates=True)
+    assert conflicts == []
+
+  def test_parallel_tracker(self):
+    """Check that duplicates do not end the conflicts they still announce."""
+
+    rib = EmulatedRIB()
+    rib.set_access_time(0)
+    tracker = ConflictTracker()
+    processor = MessageProcessor(rib, duplicates=DuplicateFilter(), tracker=tracker)
+    _, _, hijacks = processor.process_all([FakeDocument([update]), FakeDocument([hijack]),
+                                           FakeDocument([hijack]), FakeDocument([hijack])])
+    assert [h.get("event") for h in hijacks] == ["start"]
+    assert len(tracker.conflicts) == 1
+
+  def test_emulator_tracker(self):
+    """Check that duplicates do not end the conflicts they still announce."""
+
+    bview = [EmulatorMessage("F", 0, "collector", 64499, "127.0.0.2",
+                             "1.2.0.0/16", 64497, "64499 64497")]
+    updates = [EmulatorMessage("U", timestamp, "collector", 64496, "127.0.0.1",
+                               "1.2.3.0/24", 666, "64496 666") for timestamp in range(1, 4)]
+    tracker = ConflictTracker()
+    records = list(detect_conflicts("collector", [bview, updates], opener=FakeFile,
+                                    format=lambda collector, data: [data],
+                                    suppress_duplicates=True, conflict_tracker=tracker))
+    assert [r.get("event") for r in records] == ["start"]
+    assert len(tracker.conflicts) == 1
+
+  def test_emulator_suppressed_tracker(self):
+    """Check that duplicates from a peer in storm do not end its conflicts."""
+
+    bview = [EmulatorMessage("F", 0, "collector", 64499, "127.0.0.2",
+                             "1.0.0.0/8", 64497, "64499 64497")]
+    updates = [EmulatorMessage("U", i + 1, "collector", 64496, "127.0.0.1",
+                               "1.%d.0.0/16" % (i % 4), 666, "64496 666") for i in range(8)]
+    tracker = ConflictTracker()
+    records = list(detect_conflicts("collector", [bview, updates], opener=FakeFile,
+                                    format=lambda collector, data: [data],
+                                    suppress_duplicates=True, conflict_tracker=tracker,
+                                    storm_detector=PeerStormDetector(threshold=2)))
+    assert [r.get("type", r["event"]) for r in records] == ["start"] * 2 + ["STORM"]
+    assert len(tracker.conflicts) == 4
@@ -1,4 +1,11 @@
-from tabi.parallel.rib import EmulatedRIB
+from tabi.parallel.core import HijackInformation
+from tabi.parallel.rib import EmulatedRIB, HijackTable, logger
+
+
+hijack1 = HijackInformation(64497, 666, 64496, "127.0.0.1")
+hijack2 = HijackInformation(64498, 666, 64496, "127.0.0.1")
+hijack3 = HijackInformation(64497, 666, 64500, "127.0.0.2")
+
 
 class TestEmulatedRib:
 
@@ -70,3 +77,67 @@ class TestEmulatedRib:
     node = rib.search_exact("192.168.0.0/24")
 
     assert node.prefix == "192.168.0.0/24"
+
+class TestHijackTable:
+
+  def test_withdraw(self):
+    """Check that only the information of the peer is withdrawn."""
+
+    table = HijackTable()
+    table.update("1.2.3.0/24", hijack1, 0)
+    table.update("1.2.3.0/24", hijack3, 0)
+    table.update("1.2.3.0/24", hijack2, 0)
+
+    assert table.withdraw("1.2.0.0/16", 64496, "127.0.0.1") == []
+    assert table.withdraw("1.2.3.0/24", 64496, "127.0.0.1") == [ hijack1, hijack2 ]
+    assert len(table) == 1
+    assert table.withdraw("1.2.3.0/24", 64500, "127.0.0.2") == [ hijack3 ]
+    assert len(table) == 0 and table.prefixes == {}
+
+  def test_max_entries(self):
+    """Check that the least recently updated information is evicted."""
+
+    table = HijackTable(max_entries=2)
+    table.update("1.2.3.0/24", hijack1, 0)
+    table.update("1.2.4.0/24", hijack2, 1)
+    table.update("1.2.3.0/24", hijack1, 2)
+    table.update("1.2.5.0/24", hijack3, 3)
+
+    assert len(table) == 2 and table.evicted == 1
+    assert table.withdraw("1.2.4.0/24", 64496, "127.0.0.1") == []
+    assert table.withdraw("1.2.3.0/24", 64496, "127.0.0.1") == [ hijack1 ]
+
+  def test_eviction_warnings(self, monkeypatch):
+    """Check that evictions are logged less and less often."""
+
+    warnings = []
+    monkeypatch.setattr(logger, "warning", lambda message, evicted: warnings.append(evicted))
+    table = HijackTable(max_entries=1)
+    for i in range(10):
+      table.update("1.2.%d.0/24" % i, hijack1, i)
+
+    assert table.evicted == 9
+    assert warnings == [1, 2, 4, 8]
+
+  def test_max_age(self):
+    """Check that old information expires."""
+
+    table = HijackTable(max_age=10)
+    table.update("1.2.3.0/24", hijack1, 0)
+    table.update("1.2.4.0/24", hijack2, 5)
+    table.refresh("1.2.3.0/24", 64496, "127.0.0.1", 8)
+    table.update("1.2.5.0/24", hijack3, 16)
+
+    assert len(table) == 2 and table.expired == 1
+    assert table.older(16) == [ ("1.2.3.0/24", hijack1) ]
+
+  def test_rib(self):
+    """Check that hijacks are not stored in the radix tree."""
+
+    rib = EmulatedRIB(max_hijacks=1)
+    rib.set_access_time(2807)
+    rib.update_hijack("1.2.3.0/24", hijack1)
+    rib.update_hijack("1.2.4.0/24", hijack2)
+
+    assert rib.nodes() == []
+    assert rib.hijacks.older(2808) == [ ("1.2.4.0/24", hijack2) ]
@@ -1,5 +1,5 @@
 from tabi.parallel.helpers import *
-import random, sys, tempfile
+import random, sys, tempfile, socket
 
 class TestHelpers:
 
@@ -129,3 +129,34 @@ class TestHelpers:
               if not isinstance(e, CriticalException):
                 assert False
               print e
+
+    def test_prefix(self):
+        """Check that Prefix objects keep the text and its packed form."""
+
+        prefix = Prefix("192.168.0.0/16")
+        assert prefix == "192.168.0.0/16"
+        assert (prefix.packed, prefix.length) == get_packed_addr("192.168.0.0/16")
+        assert prefix.family == socket.AF_INET
+
+        prefix = Prefix("2001:db8::/32")
+        assert prefix.length == 32
+        assert prefix.family == socket.AF_INET6
+
+        # Single addresses are host prefixes
+        assert Prefix("192.168.0.1").length == 32
+        assert Prefix("2001:db8::1").length == 128
+
+        # Prefix objects are not parsed again
+        assert as_prefix(prefix) is prefix
+
+        # Host bits are unset like in py-radix, the text is kept
+        prefix = Prefix("10.1.2.3/8")
+        assert prefix == "10.1.2.3/8"
+        assert (prefix.packed, prefix.length) == ("\x0a\x00\x00\x00", 8)
+        assert Prefix("2001:db8::1/32").packed == socket.inet_pton(socket.AF_INET6, "2001:db8::")
+
+        try:
+          Prefix("bgp/24")
+          assert False
+        except CriticalException:
+          pass
@@ -319,7 +319,8 @@ class TestHijack:
                                          ("conflict_with", collections.OrderedDict([ ("prefix", "2011:db8::/32"),
                                              ("asn", 10) ])), ("asn", 10) ] )
     assert hijack.process(untracked_update2) == [ expected_untracked_hijack2 ]
-    assert len(rib.nodes()) == 2
+    assert len(rib.nodes()) == 1
+    assert len(rib.hijacks) == 1
 
     # Process the /32 withdraw
     untracked_update3 = InternalMessage(2, "collector", 0, "127.0.0.1",
@@ -333,7 +334,8 @@ class TestHijack:
     route_messages, hijack_messages = withdraw.process(untracked_update3)
     assert route_messages == [ expected_untracked_update3 ]
     assert hijack_messages == []
-    assert len(rib.nodes()) == 1
+    assert len(rib.nodes()) == 0
+    assert len(rib.hijacks) == 1
 
     # Process the /48 withdraw
     untracked_update4 = InternalMessage(3, "collector", 0, "127.0.0.1",
@@ -348,3 +350,4 @@ class TestHijack:
     assert route_messages == []
     assert hijack_messages == [ expected_untracked_update4 ]
     assert len(rib.nodes()) == 0
+    assert len(rib.hijacks) == 0
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from collections import defaultdict
+
+from tabi.rib import Radix
+from tabi.annotate import fill_ro_struct, fill_roa_struct, fill_relation_struct, \
+    annotate_if_route_objects, annotate_if_roa, annotate_if_relation, \
+    AnnotationContext
+
+numpy = pytest.importorskip("numpy")
+
+from tabi.index import compile_index, load_index
+
+PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources",
+                    "conflict_annotation", "inputs")
+
+pairs = [("60.145.0.0/28", 17676), ("60.145.1.0/24", 17676),
+         ("60.136.0.0/16", 666), ("192.0.1.0/24", 17),
+         ("212.234.194.0/24", 16071), ("212.234.194.16/28", 16072),
+         ("194.209.159.1/32", 16079), ("91.91.0.0/17", 35238),
+         ("192.113.0.0/16", 16074), ("2001:db8::/32", 16074)]
+
+
+class TestIndex:
+
+  def setup_method(self, method):
+    self.path = tempfile.mkdtemp()
+    compile_index(self.path,
+                  irr_ro_file=os.path.join(PATH, "ro_file"),
+                  rpki_roa_file=os.path.join(PATH, "roa_file"),
+                  irr_org_file=os.path.join(PATH, "organisations_file"),
+                  irr_mnt_file=os.path.join(PATH, "maintainers_file"))
+    self.index = load_index(self.path)
+
+  def teardown_method(self, method):
+    shutil.rmtree(self.path)
+
+  def test_search_covering(self):
+    """Check that mapped tables give the nodes of the radix trees."""
+
+    roa_rad_tree = Radix()
+    fill_roa_struct(os.path.join(PATH, "roa_file"), roa_rad_tree)
+    nodes = self.index.roas.search_covering("212.234.194.16/28")
+    assert [(n.prefix, n.data) for n in nodes] == \
+        [(n.prefix, n.data) for n in roa_rad_tree.search_covering("212.234.194.16/28")]
+    assert self.index.roas.search_covering("10.0.0.0/8") == []
+
+  def test_annotate(self):
+    """Check that annotations with the index and the CSV files are equal."""
+
+    ro_rad_tree = Radix()
+    fill_ro_struct(os.path.join(PATH, "ro_file"), ro_rad_tree)
+    roa_rad_tree = Radix()
+    fill_roa_struct(os.path.join(PATH, "roa_file"), roa_rad_tree)
+
+    for prefix, asn in pairs:
+      expected = {"announce": {"prefix": prefix, "asn": asn},
+                  "conflict_with": {"prefix": prefix, "asn": asn}}
+      result = {"announce": {"prefix": prefix, "asn": asn},
+                "conflict_with": {"prefix": prefix, "asn": asn}}
+      annotate_if_route_objects(ro_rad_tree, expected)
+      annotate_if_roa(roa_rad_tree, expected)
+      annotate_if_route_objects(self.index.route_objects, result)
+      annotate_if_roa(self.index.roas, result)
+      assert result == expected
+
+  def test_relations(self):
+    """Check the relations of the mapped index."""
+
+    relations_dict = defaultdict(set)
+    fill_relation_struct(os.path.join(PATH, "maintainers_file"), relations_dict, "maintainers")
+    fill_relation_struct(os.path.join(PATH, "organisations_file"), relations_dict, "organisations")
+    asns = [37554, 202214, 17676, 9737, 30896, 21242, 12322]
+    for as1 in asns:
+      for as2 in asns:
+        expected = {"announce": {"asn": as1}, "conflict_with": {"asn": as2}}
+        annotate_if_relation(relations_dict, expected)
+        assert self.index.relation_index.relations(as1, as2) == expected.get("relation", [])
+
+  def test_context(self):
+    """Check that an AnnotationContext can use the index."""
+
+    context = AnnotationContext()
+    context.load_index(self.path)
+    conflict = {"announce": {"prefix": "60.145.0.0/24", "asn": 17676, "as_path": "1 17676"},
+                "conflict_with": {"prefix": "60.0.0.0/8", "asn": 1}, "asn": 1}
+    assert context.annotate(conflict)["type"] == "VALID"
+    assert conflict["announce"]["valid"] == ["jpnic"]
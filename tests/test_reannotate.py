@@ -0,0 +1,111 @@
+import json
+
+from gzip import GzipFile
+
+from tabi.rib import Radix
+from tabi.annotate import annotate_directly_with_type
+from tabi.reannotate import Metadata, diff_trees, diff_relations, \
+    index_conflicts, reannotate_changed, load_conflict_index, \
+    fork_annotation_pool, reannotate_file, output_paths
+
+
+def roa_metadata(roas, relations_dict=None):
+  roa_rad_tree = Radix()
+  for prefix, asn, max_length in roas:
+    roa_rad_tree.add(prefix).data[asn] = max_length
+  return Metadata(relations_dict or {}, Radix(), roa_rad_tree)
+
+
+def conflict(prefix, asn, other_prefix, other_asn):
+  return {"timestamp": 1, "collector": "rrc01", "peer_as": 1, "peer_ip": "1.1.1.1",
+          "announce": {"prefix": prefix, "asn": asn, "as_path": "64496 %d" % asn},
+          "conflict_with": {"prefix": other_prefix, "asn": other_asn}, "asn": other_asn}
+
+
+class TestReannotate:
+
+  def test_diff_trees(self):
+    """Check the (prefix, asn) that differ between two trees."""
+
+    old = roa_metadata([("1.0.0.0/8", 1, 8), ("2.0.0.0/8", 2, 8), ("3.0.0.0/8", 3, 8)])
+    new = roa_metadata([("1.0.0.0/8", 1, 8), ("2.0.0.0/8", 2, 16), ("4.0.0.0/8", 4, 8)])
+    assert diff_trees(old.roa_rad_tree, new.roa_rad_tree) == \
+        {("2.0.0.0/8", 2), ("3.0.0.0/8", 3), ("4.0.0.0/8", 4)}
+
+  def test_diff_relations(self):
+    """Check that the siblings of an ASN whose maintainers changed are affected."""
+
+    old = {"organisations": {"ORG": {1, 2}}, "organisations_reverse": {1: {"ORG"}, 2: {"ORG"}},
+           "maintainers_reverse": {1: {"MNT"}, 3: {"MNT"}}}
+    new = dict(old, maintainers_reverse={1: {"MNT"}, 3: {"MNT"}, 2: {"MNT2"}})
+    assert diff_relations(old, new) == {1, 2}
+    assert diff_relations(old, old) == set()
+
+  def test_reannotate_changed(self, tmpdir):
+    """Check that only the affected conflicts are re-annotated."""
+
+    old = roa_metadata([("10.0.0.0/8", 10, 24)])
+    new = roa_metadata([("10.0.0.0/8", 10, 16), ("20.0.0.0/8", 20, 8)])
+
+    input = tmpdir.join("all.hijacks.json.gz")
+    conflicts = [conflict("10.1.0.0/16", 10, "10.0.0.0/8", 1),
+                 conflict("10.1.1.0/24", 10, "10.0.0.0/8", 1),
+                 conflict("30.0.0.0/8", 30, "30.0.0.0/8", 3),
+                 conflict("20.0.0.0/8", 1, "20.0.0.0/8", 20),
+                 {"timestamp": 1, "withdraw": {"prefix": "10.0.0.0/8", "asn": 1},
+                  "conflict_with": {"prefix": "10.1.0.0/16", "asn": 10}, "asn": 10}]
+    gzip_file = GzipFile(str(input), "w")
+    for stored in conflicts:
+      annotate_directly_with_type(stored, old.relations_dict, old.ro_rad_tree, old.roa_rad_tree)
+      gzip_file.write("%s\n" % json.dumps(stored))
+    gzip_file.close()
+
+    index = load_conflict_index(str(tmpdir.join("index")), str(input))
+    assert index.asns == index_conflicts(str(input)).asns
+
+    output = tmpdir.join("new.hijacks.json")
+    assert reannotate_changed(str(input), str(output), old, new, index) == 3
+    results = [json.loads(line) for line in output.readlines()]
+    assert [result.get("type") for result in results] == ["VALID", "ABNORMAL", "ABNORMAL", "ABNORMAL", "ABNORMAL"]
+    assert "valid" not in results[1]["announce"]
+    assert results[3]["conflict_with"]["valid"] == ["roa"]
+
+    # Every conflict is annotated as if it was annotated with the new metadata
+    for stored, result in zip(conflicts, results):
+      for route in ("announce", "conflict_with"):
+        stored.get(route, {}).pop("valid", None)
+      for key in ("relation", "direct", "type"):
+        stored.pop(key, None)
+      annotate_directly_with_type(stored, new.relations_dict, new.ro_rad_tree, new.roa_rad_tree)
+      assert json.loads(json.dumps(stored)) == result
+
+  def test_reannotate_file(self, tmpdir):
+    """Check that files are entirely re-annotated, in order, by a pool."""
+
+    metadata = roa_metadata([("10.0.0.0/8", 10, 16)])
+    input = tmpdir.join("all.hijacks.json.gz")
+    gzip_file = GzipFile(str(input), "w")
+    for i in range(25):
+      prefix = "10.%d.0.0/16" % i if i % 2 else "10.%d.1.0/24" % i
+      gzip_file.write("%s\n" % json.dumps(conflict(prefix, 10, "10.0.0.0/8", 1)))
+    gzip_file.close()
+
+    pool = fork_annotation_pool(metadata, 2)
+    try:
+      output = tmpdir.join("output", "all.hijacks.json.gz")
+      output.dirpath().ensure(dir=True)
+      assert reannotate_file(pool, str(input), str(output), chunk_size=4, max_chunks=2) == 25
+    finally:
+      pool.terminate()
+
+    results = [json.loads(line) for line in GzipFile(str(output))]
+    assert [result["announce"]["prefix"] for result in results] == \
+        ["10.%d.0.0/16" % i if i % 2 else "10.%d.1.0/24" % i for i in range(25)]
+    assert [result["type"] for result in results] == ["ABNORMAL", "VALID"] * 12 + ["ABNORMAL"]
+
+  def test_output_paths(self):
+    """Check that outputs keep the paths relative to the inputs directory."""
+
+    assert output_paths(["/data/2016.01.01/all.hijacks.json.gz", "/data/2016.01.02/all.hijacks.json.gz"],
+                        "/out") == ["/out/2016.01.01/all.hijacks.json.gz", "/out/2016.01.02/all.hijacks.json.gz"]
+    assert output_paths(["/data/a.json.gz"], "/out") == ["/out/a.json.gz"]
@@ -0,0 +1,69 @@
+import json
+import pickle
+
+from collections import OrderedDict
+
+from tabi.annotate import annotate_if_direct, annotate_with_type
+from tabi.core import ConflictRecord, UpdateRecord, ConflictWithRecord
+from tabi.records import to_json
+
+
+def conflict_record():
+  return ConflictRecord(1, "rrc00", 64496, "127.0.0.1",
+                        UpdateRecord("U", "1.2.0.0/16", 666, "64496 64499 666"),
+                        ConflictWithRecord("1.2.0.0/16", 64499), 64499)
+
+
+conflict_dict = OrderedDict([("timestamp", 1), ("collector", "rrc00"), ("peer_as", 64496),
+                             ("peer_ip", "127.0.0.1"),
+                             ("announce", OrderedDict([("type", "U"), ("prefix", "1.2.0.0/16"), ("asn", 666),
+                                                       ("as_path", "64496 64499 666")])),
+                             ("conflict_with", OrderedDict([("prefix", "1.2.0.0/16"), ("asn", 64499)])),
+                             ("asn", 64499)])
+
+
+class TestRecords:
+
+  def test_dict_access(self):
+    """Check that records behave like the OrderedDict they replace."""
+
+    record = conflict_record()
+    assert record == conflict_dict
+    assert conflict_dict == record
+    assert record["announce"]["as_path"] == "64496 64499 666"
+    assert record.get("type") is None
+    assert "withdraw" not in record
+    assert record.keys() == conflict_dict.keys()
+    assert len(record) == 7
+
+    record["type"] = "ABNORMAL"
+    assert record != conflict_dict
+    assert record.keys()[-1] == "type"
+    assert record.pop("peer_ip") == "127.0.0.1"
+    assert "peer_ip" not in record
+    assert record.pop("peer_ip", None) is None
+    assert len(record) == 7
+
+    copy = record.copy()
+    copy.update([("peer_ip", "127.0.0.2"), ("direct", False)])
+    assert copy.keys() == conflict_dict.keys() + ["type", "direct"]
+    assert "direct" not in record
+
+  def test_order(self):
+    """Check that the equality with OrderedDict depends on the keys order."""
+
+    reversed_dict = OrderedDict(reversed(conflict_dict.items()))
+    assert conflict_record() != reversed_dict
+    assert conflict_record() == dict(reversed_dict)
+
+  def test_serialize(self):
+    """Check the JSON and pickle representations."""
+
+    record = conflict_record()
+    annotate_with_type(annotate_if_direct(record))
+    expected = OrderedDict(conflict_dict.items() + [("direct", True), ("type", "DIRECT")])
+    assert to_json(record) == json.dumps(expected)
+    assert json.dumps(record) == json.dumps(expected)
+    assert json.dumps([record], indent=2) == json.dumps([expected], indent=2)
+    assert pickle.loads(pickle.dumps(record, 2)) == expected
+    assert pickle.loads(pickle.dumps(record)) == expected
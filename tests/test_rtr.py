@@ -0,0 +1,158 @@
+import socket
+import struct
+import threading
+import SocketServer
+
+import pytest
+
+from tabi.annotate import AnnotationContext
+from tabi.helpers import CriticalException
+from tabi.rtr import RTRClient, pack_pdu, read_pdu, RESET_QUERY, SERIAL_QUERY, \
+    CACHE_RESPONSE, IPV4_PREFIX, IPV6_PREFIX, END_OF_DATA, CACHE_RESET
+
+
+def prefix_pdu(announce, prefix, max_length, asn):
+  network, length = prefix.split("/")
+  family = socket.AF_INET6 if ":" in network else socket.AF_INET
+  pdu_type = IPV6_PREFIX if family == socket.AF_INET6 else IPV4_PREFIX
+  payload = struct.pack("!BBBx", int(announce), int(length), max_length)
+  payload += socket.inet_pton(family, network) + struct.pack("!I", asn)
+  return pack_pdu(1, pdu_type, 0, payload)
+
+
+class FakeCache(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+  """Stand-in RTR cache: `serials' lists the changes of each serial."""
+
+  allow_reuse_address = True
+  daemon_threads = True
+
+  def __init__(self):
+    SocketServer.TCPServer.__init__(self, ("127.0.0.1", 0), FakeCacheHandler)
+    self.session_id = 42
+    self.serials = [[(True, "212.234.194.0/24", 28, 16071)]]
+    self.forget_history = False
+
+
+class FakeCacheHandler(SocketServer.BaseRequestHandler):
+
+  def end_of_data(self):
+    serial = len(self.server.serials) - 1
+    return pack_pdu(1, END_OF_DATA, self.server.session_id,
+                    struct.pack("!IIII", serial, 60, 60, 600))
+
+  def handle(self):
+    server = self.server
+    while True:
+      try:
+        _, pdu_type, _, payload = read_pdu(self.request)
+      except Exception:
+        return
+      response = pack_pdu(1, CACHE_RESPONSE, server.session_id)
+      if pdu_type == RESET_QUERY:
+        state = {}
+        for changes in server.serials:
+          for announce, prefix, max_length, asn in changes:
+            key = (prefix, max_length, asn)
+            state[key] = state.get(key, 0) + (1 if announce else -1)
+        for (prefix, max_length, asn), count in state.items():
+          response += count * prefix_pdu(True, prefix, max_length, asn)
+      elif pdu_type == SERIAL_QUERY:
+        if server.forget_history:
+          self.request.sendall(pack_pdu(1, CACHE_RESET, 0))
+          continue
+        serial = struct.unpack("!I", payload)[0]
+        for changes in server.serials[serial + 1:]:
+          for change in changes:
+            response += prefix_pdu(*change)
+      self.request.sendall(response + self.end_of_data())
+
+
+class TestRTR:
+
+  def setup_method(self, method):
+    self.cache = FakeCache()
+    self.thread = threading.Thread(target=self.cache.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    self.address = self.cache.server_address
+
+  def teardown_method(self, method):
+    self.cache.shutdown()
+    self.cache.server_close()
+
+  def test_updates(self):
+    """Check that announces and withdraws are applied to the tree."""
+
+    client = RTRClient(*self.address)
+    assert client.update() == 1
+    assert client.session_id == 42
+    assert client.serial == 0
+    assert client.rad_tree.search_exact("212.234.194.0/24").data == {16071: 28}
+
+    self.cache.serials.append([(True, "212.234.194.0/24", 24, 16071),
+                               (True, "212.234.194.0/24", 24, 16072),
+                               (True, "2001:db8::/32", 48, 64496)])
+    assert client.update() == 3
+    assert client.serial == 1
+    assert client.rad_tree.search_exact("212.234.194.0/24").data == {16071: 28, 16072: 24}
+    assert client.rad_tree.search_exact("2001:db8::/32").data == {64496: 48}
+
+    self.cache.serials.append([(False, "212.234.194.0/24", 28, 16071),
+                               (False, "212.234.194.0/24", 24, 16072),
+                               (False, "2001:db8::/32", 48, 64496)])
+    client.update()
+    assert client.rad_tree.search_exact("212.234.194.0/24").data == {16071: 24}
+    assert client.rad_tree.search_exact("2001:db8::/32") is None
+
+    # Nothing new
+    assert client.update() == 0
+    client.close()
+
+  def test_unknown_withdraw(self):
+    """Check that withdraws of unknown ROA leave nothing behind."""
+
+    client = RTRClient("localhost", 0)
+    packed = socket.inet_aton("212.234.194.0")
+    client.apply(False, [(True, packed, 24, 28, 16071), (False, packed, 24, 24, 16071),
+                         (False, packed, 24, 24, 16072)])
+    assert client.roas == {(packed, 24, 16071): [28]}
+    assert client.rad_tree.search_exact("212.234.194.0/24").data == {16071: 28}
+
+  def test_cache_reset(self):
+    """Check that the tree is rebuilt when the cache lost the history."""
+
+    client = RTRClient(*self.address)
+    client.update()
+    self.cache.serials.append([(False, "212.234.194.0/24", 28, 16071),
+                               (True, "91.91.0.0/16", 16, 35238)])
+    self.cache.forget_history = True
+    client.update()
+    assert client.rad_tree.search_exact("212.234.194.0/24") is None
+    assert client.rad_tree.search_exact("91.91.0.0/16").data == {35238: 16}
+    client.close()
+
+  def test_context(self):
+    """Check that changes fetched by the context are applied when annotating."""
+
+    context = AnnotationContext()
+    context.load_rtr(*self.address)
+
+    def conflict():
+      return {"announce": {"prefix": "212.234.194.0/24", "asn": 16071, "as_path": "1 16071"},
+              "conflict_with": {"prefix": "212.234.0.0/16", "asn": 1}, "asn": 1}
+
+    assert context.annotate(conflict())["type"] == "VALID"
+    self.cache.serials.append([(False, "212.234.194.0/24", 28, 16071)])
+    context.fetch_rtr()
+    assert context.annotate(conflict())["type"] == "DIRECT"
+
+    # Changes are applied while the other sources are rebuilt
+    with context.build_lock:
+      self.cache.serials.append([(True, "212.234.194.0/24", 28, 16071)])
+      context.fetch_rtr()
+      assert context.annotate(conflict())["type"] == "VALID"
+
+    # The RTR cache is the only source of ROA
+    with pytest.raises(CriticalException):
+      context.load_roas("roa_file")
+    context.rtr.close()
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from tabi.rib import Radix
+from tabi.annotate import fill_ro_struct, fill_roa_struct, \
+    annotate_if_route_objects, annotate_if_roa
+
+numpy = pytest.importorskip("numpy")
+
+from tabi.validator import OriginValidator
+
+PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources",
+                    "conflict_annotation", "inputs")
+
+pairs = [("60.145.0.0/28", 17676), ("60.145.0.0/24", 17676),
+         ("60.145.1.0/24", 17676), ("60.146.0.0/16", 17676),
+         ("60.136.0.0/16", 666), ("192.0.1.0/24", 17),
+         ("212.234.194.0/24", 16071), ("212.234.194.0/24", 16072),
+         ("212.234.194.16/28", 16071), ("212.234.194.16/28", 16072),
+         ("194.209.159.1/32", 16079), ("91.91.0.0/17", 35238),
+         ("192.118.0.0/16", 16074), ("192.113.0.0/16", 16074),
+         ("2001:db8::/32", 16074), ("not a prefix", 1)]
+
+
+class TestOriginValidator:
+
+  def setup_method(self, method):
+    self.validator = OriginValidator()
+    self.validator.load_roas(os.path.join(PATH, "roa_file"))
+    self.validator.load_route_objects(os.path.join(PATH, "ro_file"))
+
+  def test_validate(self):
+    """Check that the results are the ones of the radix annotation."""
+
+    ro_rad_tree = Radix()
+    fill_ro_struct(os.path.join(PATH, "ro_file"), ro_rad_tree)
+    roa_rad_tree = Radix()
+    fill_roa_struct(os.path.join(PATH, "roa_file"), roa_rad_tree)
+
+    results = self.validator.validate([prefix for prefix, _ in pairs],
+                                      [asn for _, asn in pairs])
+    for (prefix, asn), valid in zip(pairs[:-1], results):
+      conflict = {"announce": {"prefix": prefix, "asn": asn},
+                  "conflict_with": {"prefix": prefix, "asn": asn}}
+      annotate_if_route_objects(ro_rad_tree, conflict)
+      annotate_if_roa(roa_rad_tree, conflict)
+      assert conflict["announce"].get("valid", []) == valid
+    assert results[-1] == []
+    assert results[0] == ["jpnic"]
+    assert results[6] == ["roa"]
+
+  def test_annotate(self):
+    """Check the annotation of a batch of conflicts."""
+
+    conflicts = [{"announce": {"prefix": "60.145.0.0/24", "asn": 17676},
+                  "conflict_with": {"prefix": "212.234.194.0/24", "asn": 16072}},
+                 {"withdraw": {"prefix": "60.145.0.0/24", "asn": 17676},
+                  "conflict_with": {"prefix": "212.234.194.0/24", "asn": 16072}}]
+    self.validator.annotate(conflicts)
+    assert conflicts[0]["announce"]["valid"] == ["jpnic"]
+    assert conflicts[0]["conflict_with"]["valid"] == ["roa"]
+    assert "valid" not in conflicts[1]["conflict_with"]